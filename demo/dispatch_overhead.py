@@ -0,0 +1,94 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 par_loop dispatch overhead benchmark
+
+Measures the time taken to dispatch and execute a :func:`par_loop` over a
+small set, for which the Python overhead of building and launching the
+loop dominates the run time of the kernel.
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils
+import numpy as np
+from time import time
+
+
+def main(opt):
+    n = opt['size']
+    nodes = op2.Set(n, "nodes")
+    edges = op2.Set(n, "edges")
+    edge2node = op2.Map(edges, nodes, 2,
+                        np.array([(i, (i + 1) % n) for i in range(n)], dtype=np.int32),
+                        "edge2node")
+    x = op2.Dat(nodes, np.ones(n), np.float64, "x")
+    y = op2.Dat(edges, np.zeros(n), np.float64, "y")
+    w = op2.Dat(edges, np.ones(n), np.float64, "w")
+    g = op2.Global(1, 0.0, np.float64, "g")
+
+    direct = op2.Kernel("void direct(double *y, double *w) { *y += *w; }", "direct")
+    indirect = op2.Kernel("""void indirect(double *y, double *x0, double *x1, double *g) {
+  *y += *x0 + *x1;
+  *g += *y;
+}""", "indirect")
+
+    def run_direct():
+        op2.par_loop(direct, edges, y(op2.INC), w(op2.READ))
+
+    def run_indirect():
+        op2.par_loop(indirect, edges, y(op2.INC),
+                     x(op2.READ, edge2node[0]), x(op2.READ, edge2node[1]),
+                     g(op2.INC))
+
+    for name, loop in [('direct', run_direct), ('indirect', run_indirect)]:
+        # Warm up caches and compile the kernel
+        loop()
+        y.data_ro
+        t = time()
+        for i in range(opt['niter']):
+            loop()
+            # Force evaluation of the trace
+            y.data_ro
+        t = time() - t
+        print("%-8s %8.2f us per par_loop" % (name, 1e6 * t / opt['niter']))
+
+if __name__ == '__main__':
+    parser = utils.parser(group=True, description=__doc__)
+    parser.add_argument('-s', '--size', default=10, type=int,
+                        help='number of elements in the iteration set (default: 10)')
+    parser.add_argument('-n', '--niter', default=10000, type=int,
+                        help='number of par_loops to time (default: 10000)')
+    opt = vars(parser.parse_args())
+    op2.init(**opt)
+
+    main(opt)
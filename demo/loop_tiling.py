@@ -0,0 +1,96 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 sparse tiling benchmark
+
+Times a chain of indirect :func:`par_loop`\s over the edges of a ring
+executed one after the other and tile by tile (see the ``loop_tiling``
+configuration parameter). The chain is executed repeatedly, such that the
+tiling schedule and the per-tile loops are built once and reused.
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils
+import numpy as np
+from time import time
+
+
+def main(opt):
+    n = opt['size']
+    nodes = op2.Set(n, "nodes")
+    edges = op2.Set(n, "edges")
+    edge2node = op2.Map(edges, nodes, 2,
+                        np.array([(i, (i + 1) % n) for i in range(n)], dtype=np.int32),
+                        "edge2node")
+    x = op2.Dat(nodes, np.ones(n), np.float64, "x")
+    y = op2.Dat(edges, np.zeros(n), np.float64, "y")
+
+    scatter = op2.Kernel("""void scatter(double *x0, double *x1, double *y) {
+  *x0 += 0.5 * (*y); *x1 += 0.5 * (*y);
+}""", "scatter")
+    gather = op2.Kernel("""void gather(double *y, double *x0, double *x1) {
+  *y = 0.25 * (*x0 + *x1);
+}""", "gather")
+
+    def chain():
+        op2.par_loop(gather, edges, y(op2.WRITE),
+                     x(op2.READ, edge2node[0]), x(op2.READ, edge2node[1]))
+        op2.par_loop(scatter, edges, x(op2.INC, edge2node[0]),
+                     x(op2.INC, edge2node[1]), y(op2.READ))
+        # Force evaluation of the trace
+        x.data_ro
+
+    for tiling in [False, True]:
+        op2.configuration['loop_tiling'] = tiling
+        # Warm up caches and compile the kernels
+        chain()
+        t = time()
+        for i in range(opt['niter']):
+            chain()
+        t = time() - t
+        print("%-8s %8.2f ms per chain" % ('tiled' if tiling else 'untiled',
+                                           1e3 * t / opt['niter']))
+
+if __name__ == '__main__':
+    parser = utils.parser(group=True, description=__doc__)
+    parser.add_argument('-s', '--size', default=1000000, type=int,
+                        help='number of edges in the ring (default: 1000000)')
+    parser.add_argument('-n', '--niter', default=20, type=int,
+                        help='number of chains to time (default: 20)')
+    parser.add_argument('-t', '--tile-size', default=4096, type=int,
+                        help='number of iterations per tile (default: 4096)')
+    opt = vars(parser.parse_args())
+    op2.init(**opt)
+    op2.configuration['tile_size'] = opt['tile_size']
+
+    main(opt)
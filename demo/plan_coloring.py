@@ -0,0 +1,95 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 plan colouring benchmark
+
+Measures the time taken to build a :class:`pyop2.plan.Plan` for an
+indirect loop incrementing the vertices of a structured triangle mesh, and
+the number of block and thread colours, for each colouring algorithm.
+
+Baseline recorded on a single core with the default options for the
+previous colouring implementation, which only did greedy colouring, and
+for the current one::
+
+  coloring          partition   time [s]   colors  thrcols
+  previous                256     2.3897        4        4
+  previous               1024     1.0494        3        4
+  previous               4096     0.6516        2        7
+  greedy                  256     0.6808        4        4
+  greedy                 1024     0.4640        3        4
+  greedy                 4096     0.4761        2        7
+  jones_plassmann         256     0.9431        7        5
+  jones_plassmann        1024     0.7278        5        5
+  jones_plassmann        4096     0.7846        3        9
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils, plan
+import numpy as np
+from time import time
+
+
+def main(opt):
+    n = opt['size']
+    nodes = op2.Set((n + 1) ** 2, "nodes")
+    cells = op2.Set(2 * n ** 2, "cells")
+    # Two triangles per square of the grid
+    v = np.arange((n + 1) ** 2, dtype=np.int32).reshape(n + 1, n + 1)
+    sw, se, nw, ne = v[:-1, :-1].ravel(), v[:-1, 1:].ravel(), v[1:, :-1].ravel(), v[1:, 1:].ravel()
+    values = np.empty((2 * n ** 2, 3), dtype=np.int32)
+    values[0::2] = np.column_stack((sw, se, ne))
+    values[1::2] = np.column_stack((sw, ne, nw))
+    cell2node = op2.Map(cells, nodes, 3, values, "cell2node")
+    x = op2.Dat(nodes, dtype=np.float64, name="x")
+    args = [x(op2.INC, cell2node[i]) for i in range(3)]
+
+    print("%-16s %10s %10s %8s %8s" % ("coloring", "partition", "time [s]", "colors", "thrcols"))
+    for coloring in ['greedy', 'jones_plassmann']:
+        for partition_size in opt['partition_size']:
+            t = time()
+            p = plan.Plan(cells.core_part, *args, partition_size=partition_size,
+                          coloring=coloring, refresh_cache=True)
+            t = time() - t
+            print("%-16s %10d %10.4f %8d %8d" % (coloring, partition_size, t,
+                                                 p.ncolors, max(p.nthrcol)))
+
+if __name__ == '__main__':
+    parser = utils.parser(group=True, description=__doc__)
+    parser.add_argument('-s', '--size', default=1000, type=int,
+                        help='number of squares along each side of the mesh (default: 1000)')
+    parser.add_argument('-p', '--partition-size', default=[256, 1024, 4096], type=int, nargs='+',
+                        help='partition sizes to build plans for (default: 256 1024 4096)')
+    opt = vars(parser.parse_args())
+    op2.init(**opt)
+
+    main(opt)
@@ -0,0 +1,86 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 SoA layout benchmark
+
+Measures the time taken by a direct :func:`par_loop` updating a vector
+valued :class:`Dat` in SoA format, accessing it through its AoS data and
+through a transposed SoA copy, see the ``soa_layout`` configuration
+parameter. The SoA copy is only transposed back once the data are read
+after all loops have run.
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils
+from pyop2.configuration import configuration
+import numpy as np
+from time import time
+
+
+def main(opt):
+    n, dim = opt['size'], opt['dim']
+    elems = op2.Set(n, "elems")
+    x = op2.Dat(elems ** dim, np.ones(n * dim), np.float64, "x", soa=True)
+    y = op2.Dat(elems ** dim, np.ones(n * dim), np.float64, "y", soa=True)
+
+    axpy = op2.Kernel("""void axpy(double *x, double *y) {
+  for (int j = 0; j < %d; ++j) OP2_STRIDE(x, j) += 2.0 * OP2_STRIDE(y, j);
+}""" % dim, "axpy")
+
+    for layout in [False, True]:
+        configuration['soa_layout'] = layout
+        # Warm up caches and compile the kernel
+        op2.par_loop(axpy, elems, x(op2.RW), y(op2.READ))
+        x.data_ro
+        t = time()
+        for i in range(opt['niter']):
+            op2.par_loop(axpy, elems, x(op2.RW), y(op2.READ))
+        # Force evaluation of the trace and transposition back to AoS
+        x.data_ro
+        t = time() - t
+        print("%-4s %8.2f ms per par_loop" % ('soa' if layout else 'aos',
+                                              1e3 * t / opt['niter']))
+
+
+if __name__ == '__main__':
+    parser = utils.parser(group=True, description=__doc__)
+    parser.add_argument('-s', '--size', default=1000000, type=int,
+                        help='number of elements in the iteration set (default: 1000000)')
+    parser.add_argument('-c', '--dim', default=8, type=int,
+                        help='number of components of the Dats (default: 8)')
+    parser.add_argument('-n', '--niter', default=50, type=int,
+                        help='number of par_loops to time (default: 50)')
+    opt = vars(parser.parse_args())
+    op2.init(**opt)
+
+    main(opt)
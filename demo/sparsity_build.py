@@ -0,0 +1,75 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+
+"""PyOP2 sparsity construction benchmark
+
+Measures the time taken to build the :class:`pyop2.op2.Sparsity` of a
+vector valued P1 field on a triangle mesh, for a range of vector dimensions.
+The mesh is read from the triangle files given with ``-m``, which are
+generated with the :mod:`demo.meshes.generate_mesh` generator (requires
+``gmsh``) if they do not exist yet. Running it with an older version of PyOP2
+compares against a previous implementation of the sparsity builder.
+"""
+
+from __future__ import print_function
+import os
+from pyop2 import op2, utils
+from triangle_reader import read_triangle
+from time import time
+
+
+def main(opt):
+    if not os.path.exists(opt['mesh'] + '.node'):
+        from meshes.generate_mesh import generate_meshfile
+        generate_meshfile(opt['mesh'], opt['layers'])
+    nodes, coords, elements, elem_node = read_triangle(opt['mesh'])
+
+    print("%-6s %10s %12s %10s" % ("dim", "rows", "nonzeros", "time [s]"))
+    for dim in opt['dim']:
+        # Make sure the sparsity is built rather than retrieved from cache
+        op2.base.Sparsity._cache.clear()
+        t = time()
+        sparsity = op2.Sparsity(nodes ** dim, elem_node, "sparsity")
+        t = time() - t
+        print("%-6d %10d %12d %10.4f" % (dim, nodes.size * dim,
+                                         sparsity.nz + sparsity.onz, t))
+
+if __name__ == '__main__':
+    parser = utils.parser(group=True, description=__doc__)
+    parser.add_argument('-m', '--mesh', required=True,
+                        help='Base name of triangle mesh (excluding the .ele or .node extension)')
+    parser.add_argument('-l', '--layers', default=256, type=int,
+                        help='number of layers of elements to generate the mesh with, if it does not exist (default: 256)')
+    parser.add_argument('-d', '--dim', default=[1, 2, 3], type=int, nargs='+',
+                        help='vector dimensions to build sparsities for (default: 1 2 3)')
+    opt = vars(parser.parse_args())
+    op2.init(**opt)
+
+    main(opt)
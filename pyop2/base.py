@@ -36,17 +36,26 @@ information which is backend independent. Individual runtime backends should
 subclass these as required to implement backend-specific features.
 """
 
+from copy import copy
+try:
+    from collections import OrderedDict
+# OrderedDict was added in Python 2.7. Earlier versions can use ordereddict
+# from PyPI
+except ImportError:
+    from ordereddict import OrderedDict
 import numpy as np
 import operator
+import re
 from hashlib import md5
 
 from caching import Cached, KernelCached
+from ir.ast_base import Node
 from configuration import configuration
 from exceptions import *
 from utils import *
 from backends import _make_object
 from mpi import MPI, _MPI, _check_comm, collective
-from sparsity import build_sparsity
+from sparsity import build_sparsity, expand_sparsity
 from version import __version__ as version
 
 
@@ -98,8 +107,7 @@ class ExecutionTrace(object):
 
     def evaluate_all(self):
         """Forces the evaluation of all delayed computations."""
-        for comp in self._trace:
-            comp._run()
+        self._execute(self._optimise(self._trace))
         self._trace = list()
 
     def evaluate(self, reads=None, writes=None):
@@ -141,13 +149,114 @@ class ExecutionTrace(object):
                 comp._scheduled = False
 
         new_trace = list()
+        self._execute(self._optimise([comp for comp in self._trace if comp._scheduled]))
         for comp in self._trace:
-            if comp._scheduled:
-                comp._run()
-            else:
+            if not comp._scheduled:
                 new_trace.append(comp)
         self._trace = new_trace
 
+    @collective
+    def _execute(self, comps):
+        """Run the list of :class:`LazyComputation`\s ``comps`` in order.
+
+        In parallel, the halo exchange of each :class:`Dat` whose halo a
+        :class:`ParLoop` reads is started before the first computation
+        following the last one in ``comps`` that accesses the :class:`Dat`,
+        rather than by the :class:`ParLoop` itself, such that it overlaps
+        with the computations in between. Since these do not access the
+        :class:`Dat`, whether its halo is stale is known when the exchange
+        is started, and it is only exchanged if it is.
+        """
+        if not MPI.parallel:
+            for comp in comps:
+                comp._run()
+            return
+
+        # For each computation, the Dats whose exchange starts before it
+        hoisted = [OrderedDict() for comp in comps]
+        last = {}
+        for i, comp in enumerate(comps):
+            if isinstance(comp, ParLoop):
+                for d in comp._halo_reads:
+                    j = last.get(id(d), -1) + 1
+                    if j < i:
+                        hoisted[j][id(d)] = d
+            for data in comp.reads | comp.writes:
+                if isinstance(data, Dat):
+                    for d in data:
+                        last[id(d)] = i
+
+        for dats, comp in zip(hoisted, comps):
+            # Dats are in the same order on all ranks, since they are
+            # collected in argument order
+            batches = OrderedDict()
+            for d in dats.values():
+                if d.needs_halo_update and d.dataset.halo is not None:
+                    d.needs_halo_update = False
+                    batches.setdefault(d.dataset.halo, []).append(d)
+            for halo, batch in batches.iteritems():
+                halo.exchange_begin(batch)
+            comp._run()
+
+    def _optimise(self, comps):
+        """Apply loop fusion and sparse tiling, if enabled, to the list of
+        :class:`LazyComputation`\s ``comps`` about to be executed."""
+        return self._tile(self._fuse(comps))
+
+    def _fuse(self, comps):
+        """Replace runs of consecutive :class:`ParLoop`\s in ``comps`` which
+        can legally be executed as a single loop by a fused :class:`ParLoop`.
+
+        Fusion is only attempted if the ``loop_fusion`` configuration
+        parameter is set, otherwise ``comps`` is returned unchanged.
+
+        :arg comps: a list of :class:`LazyComputation`\s in execution order.
+        """
+        if not configuration['loop_fusion']:
+            return comps
+        fused = list()
+        group = list()
+        for comp in comps:
+            if group and _can_fuse(group, comp):
+                group.append(comp)
+                continue
+            if group:
+                fused.append(_fuse_loops(group))
+            if isinstance(comp, ParLoop) and comp._is_fusable:
+                group = [comp]
+            else:
+                group = list()
+                fused.append(comp)
+        if group:
+            fused.append(_fuse_loops(group))
+        return fused
+
+    def _tile(self, comps):
+        """Replace runs of consecutive :class:`ParLoop`\s in ``comps`` which
+        contain at least one indirect loop by a :class:`TiledLoopChain`.
+
+        Tiling is only attempted if the ``loop_tiling`` configuration
+        parameter is set, otherwise ``comps`` is returned unchanged.
+
+        :arg comps: a list of :class:`LazyComputation`\s in execution order.
+        """
+        if not configuration['loop_tiling']:
+            return comps
+        tiled = list()
+        group = list()
+        for comp in comps + [None]:
+            if isinstance(comp, ParLoop) and comp._is_tileable:
+                group.append(comp)
+                continue
+            if len(group) > 1 and not all(loop.is_direct for loop in group):
+                tiled.append(TiledLoopChain(group))
+            else:
+                tiled.extend(group)
+            group = list()
+            if comp is not None:
+                tiled.append(comp)
+        return tiled
+
 
 _trace = ExecutionTrace()
 
@@ -244,6 +353,7 @@ class Arg(object):
         self._in_flight = False  # some kind of comms in flight for this arg
         self._position = None
         self._indirect_position = None
+        self._sig = None
 
         if self._is_mixed_mat and flatten:
             raise MatTypeError("A Mat Arg on a mixed space cannot be flattened!")
@@ -281,6 +391,43 @@ class Arg(object):
             self._block_shape = None
             self._offsets = None
 
+    @property
+    def _signature(self):
+        """Hashable signature of the structure of this :class:`Arg`, which is
+        part of the :class:`JITModule` cache key. A fresh :class:`Arg` is
+        built for every :func:`par_loop`, so the signature is cached on the
+        data carrier, keyed on the map, index and access descriptor, none of
+        which can change the structure of the data carrier."""
+        if self._sig is None:
+            idx = self._idx
+            if isinstance(idx, (tuple, list)):
+                idx = tuple((i.__class__, i.index) for i in idx)
+            elif isinstance(idx, IterationIndex):
+                idx = (idx.__class__, idx.index)
+            m = self._map
+            if isinstance(m, list):
+                m = tuple(m)
+            key = (m, idx, self._access)
+            sigs = self._dat._arg_signatures
+            if key not in sigs:
+                sigs[key] = self._build_signature(idx)
+            self._sig = sigs[key]
+        return self._sig
+
+    def _build_signature(self, idx):
+        if self._is_global:
+            return (self.data.dim, self.data.dtype, self.access)
+        elif self._is_dat:
+            map_arity = self.map.arity if self.map else None
+            disjoint = self.map._layers_disjoint if self.map else None
+            return (self.data.dim, self.data.dtype, self.data.soa,
+                    map_arity, idx, disjoint, self.access)
+        elif self._is_mat:
+            map_arities = (self.map[0].arity, self.map[1].arity)
+            return (self.data.dims, self.data.dtype, idx,
+                    map_arities, self.access)
+        return ()
+
     def __eq__(self, other):
         """:class:`Arg`\s compare equal of they are defined on the same data,
         use the same :class:`Map` with the same index and the same access
@@ -471,20 +618,7 @@ class Arg(object):
         assert not self._in_flight, \
             "Reduction already in flight for Arg %s" % self
         if self.access is not READ:
-            self._in_flight = True
-            if self.access is INC:
-                op = _MPI.SUM
-            elif self.access is MIN:
-                op = _MPI.MIN
-            elif self.access is MAX:
-                op = _MPI.MAX
-            # If the MPI supports MPI-3, this could be MPI_Iallreduce
-            # instead, to allow overlapping comp and comms.
-            # We must reduce into a temporary buffer so that when
-            # executing over the halo region, which occurs after we've
-            # called this reduction, we don't subsequently overwrite
-            # the result.
-            MPI.comm.Allreduce(self.data._data, self.data._buf, op=op)
+            GlobalReduction([self])
 
     @collective
     def reduction_end(self):
@@ -494,9 +628,8 @@ class Arg(object):
             "Doing global reduction only makes sense for Globals"
         if self.access is not READ and self._in_flight:
             self._in_flight = False
-            # Must have a copy here, because otherwise we just grab a
-            # pointer.
-            self.data._data = np.copy(self.data._buf)
+            self._reduction.end()
+            self._reduction = None
 
     @property
     def data(self):
@@ -505,6 +638,62 @@ class Arg(object):
         return self._dat
 
 
+class GlobalReduction(object):
+
+    """A non-blocking global reduction of the values of several :class:`Global`
+    arguments with the same access descriptor and data type, packed into a
+    single buffer such that they are reduced by a single message.
+
+    The reduction is started on construction, and marks the arguments as in
+    flight. It is completed by :meth:`end`, or equivalently
+    :meth:`Arg.reduction_end` on any of the arguments.
+
+    :param args: a list of :class:`Arg`\s on :class:`Global`\s"""
+
+    _ops = {INC: _MPI.SUM, MIN: _MPI.MIN, MAX: _MPI.MAX}
+
+    @collective
+    def __init__(self, args):
+        self._args = args
+        # We must reduce from a copy of the data so that when executing
+        # over the halo region, which occurs after we've started this
+        # reduction, we don't modify the buffer in flight, and into a
+        # temporary buffer so that we don't subsequently overwrite the result
+        self._sendbuf = np.concatenate([arg.data._data.ravel() for arg in args])
+        self._recvbuf = np.empty_like(self._sendbuf)
+        op = self._ops[args[0].access]
+        if not MPI.parallel:
+            self._recvbuf[:] = self._sendbuf
+            self._request = None
+        else:
+            try:
+                self._request = MPI.comm.Iallreduce(self._sendbuf, self._recvbuf, op=op)
+            except (AttributeError, NotImplementedError):
+                # The MPI implementation does not support MPI-3
+                MPI.comm.Allreduce(self._sendbuf, self._recvbuf, op=op)
+                self._request = None
+        for arg in args:
+            arg._in_flight = True
+            arg._reduction = self
+
+    @collective
+    def end(self):
+        """Wait for the reduction to complete and set the data of all
+        :class:`Global`\s to the reduced values."""
+        if self._args is None:
+            return
+        if self._request is not None:
+            self._request.Wait()
+        offset = 0
+        for arg in self._args:
+            g = arg.data
+            # Must have a copy here, because otherwise the data of all
+            # Globals would point into the same buffer.
+            g._data = self._recvbuf[offset:offset + g._data.size].reshape(g._data.shape).copy()
+            offset += g._data.size
+        self._args = None
+
+
 class Set(object):
 
     """OP2 set.
@@ -684,7 +873,7 @@ class Set(object):
         slot = f[name]
         if slot.shape != (1,):
             raise SizeTypeError("Shape of %s is incorrect" % name)
-        size = slot.value.astype(np.int)
+        size = slot[...].astype(np.int)
         return cls(size[0], name)
 
     @property
@@ -734,9 +923,10 @@ class Subset(Set):
                 'Out of bounds indices in Subset construction: [%d, %d) not [0, %d)' %
                 (self._indices[0], self._indices[-1], self._superset.total_size))
 
-        self._core_size = sum(self._indices < superset._core_size)
-        self._size = sum(self._indices < superset._size)
-        self._ieh_size = sum(self._indices < superset._ieh_size)
+        # The indices are sorted, so count those below each boundary
+        self._core_size = np.searchsorted(self._indices, superset._core_size)
+        self._size = np.searchsorted(self._indices, superset._size)
+        self._ieh_size = np.searchsorted(self._indices, superset._ieh_size)
         self._inh_size = len(self._indices)
 
     # Look up any unspecified attributes on the _set.
@@ -1132,6 +1322,7 @@ class Halo(object):
             "Halo was specified with self-sends on rank %d" % rank
         assert rank not in self._receives, \
             "Halo was specified with self-receives on rank %d" % rank
+        self._exchanges = {}
 
     @property
     def sends(self):
@@ -1184,9 +1375,31 @@ class Halo(object):
                 "Halo receive from %d is invalid (not in halo elements)" % \
                 source
 
+    @collective
+    def exchange_begin(self, dats):
+        """Begin the exchange of the halo values of ``dats``, which are
+        packed into a single message per neighbour.
+
+        :param dats: a list of :class:`Dat`\s defined on the :class:`Set`
+            of this :class:`Halo`
+        :returns: the :class:`HaloExchange` in flight"""
+        layout = tuple((d.dtype, d._data.shape[1:]) for d in dats)
+        pool = self._exchanges.setdefault(layout, [])
+        # All ranks exchange the same halos in the same order, so they
+        # agree on which exchange from the pool is used
+        for exchange in pool:
+            if not exchange.in_flight:
+                break
+        else:
+            exchange = HaloExchange(self, layout, MPI.next_tag())
+            pool.append(exchange)
+        exchange.begin(dats)
+        return exchange
+
     def __getstate__(self):
         odict = self.__dict__.copy()
         del odict['_comm']
+        del odict['_exchanges']
         return odict
 
     def __setstate__(self, d):
@@ -1210,6 +1423,90 @@ class Halo(object):
         self._receives = receives
         # FIXME: This will break for custom halo communicators
         self._comm = MPI.comm
+        self._exchanges = {}
+
+
+class HaloExchange(object):
+
+    """A persistent exchange of the halo values of :class:`Dat`\s with a
+    given layout, i.e. data type and dimension of each :class:`Dat`.
+
+    The values of all :class:`Dat`\s are packed into a single buffer per
+    neighbour, which is allocated once, and sent and received with
+    persistent MPI requests, which are created once, such that repeated
+    exchanges do not allocate memory or set up communication.
+
+    .. Warning ::
+        User code should not directly instantiate :class:`HaloExchange`.
+        Use :meth:`Halo.exchange_begin` instead."""
+
+    def __init__(self, halo, layout, tag):
+        self._dats = None
+        # One packed record with a field per Dat for each halo element
+        self._dtype = np.dtype([('f%d' % i, dtype, shape)
+                                for i, (dtype, shape) in enumerate(layout)])
+
+        def buffers(elements):
+            buffers = {}
+            for rank, ele in elements.iteritems():
+                buf = np.empty(len(ele), dtype=self._dtype)
+                # A contiguous range of elements is indexed with a slice
+                # rather than with fancy indexing
+                if len(ele) > 0 and (np.diff(ele) == 1).all():
+                    ele = slice(ele[0], ele[-1] + 1)
+                buffers[rank] = (ele, buf)
+            return buffers
+        self._sends = buffers(halo.sends)
+        self._receives = buffers(halo.receives)
+        self._requests = [halo.comm.Send_init([buf.view(np.uint8), _MPI.BYTE], dest=dest, tag=tag)
+                          for dest, (ele, buf) in self._sends.iteritems()] + \
+            [halo.comm.Recv_init([buf.view(np.uint8), _MPI.BYTE], source=source, tag=tag)
+             for source, (ele, buf) in self._receives.iteritems()]
+
+    def __del__(self):
+        # Release the persistent requests once the Halo goes away
+        if not _MPI.Is_finalized():
+            for request in getattr(self, '_requests', ()):
+                request.Free()
+
+    @property
+    def in_flight(self):
+        """Is this exchange in flight?"""
+        return self._dats is not None
+
+    @collective
+    def begin(self, dats):
+        """Pack the values of ``dats`` sent to each neighbour and start
+        the exchange."""
+        assert not self.in_flight, "Halo exchange already in flight"
+        self._dats = dats
+        for d in dats:
+            d._halo_exchange_prepare()
+        for ele, buf in self._sends.itervalues():
+            for i, d in enumerate(dats):
+                buf['f%d' % i] = d._data[ele]
+        _MPI.Prequest.Startall(self._requests)
+        for d in dats:
+            d._halo_exchange = self
+
+    @collective
+    def end(self):
+        """Wait for the exchange to complete and unpack the received values
+        into the halo of each :class:`Dat`."""
+        if not self.in_flight:
+            return
+        _MPI.Request.Waitall(self._requests)
+        for d in self._dats:
+            # data is read-only in a ParLoop, make it temporarily writable
+            maybe_setflags(d._data, write=True)
+        for ele, buf in self._receives.itervalues():
+            for i, d in enumerate(self._dats):
+                d._data[ele] = buf['f%d' % i]
+        for d in self._dats:
+            maybe_setflags(d._data, write=False)
+            d._halo_exchange = None
+            d._soa_valid = False
+        self._dats = None
 
 
 class IterationSpace(object):
@@ -1329,6 +1626,16 @@ class DataCarrier(object):
     (:class:`Const` and :class:`Global`), rank 1 (:class:`Dat`), or rank 2
     (:class:`Mat`)"""
 
+    @property
+    def _arg_signatures(self):
+        """Signatures of the :class:`Arg`\s on this data carrier, see
+        :attr:`Arg._signature`."""
+        try:
+            return self._arg_sigs
+        except AttributeError:
+            self._arg_sigs = {}
+            return self._arg_sigs
+
     @property
     def dtype(self):
         """The Python type of the data."""
@@ -1474,6 +1781,13 @@ class Dat(DataCarrier, _EmptyDataMixin):
         self._dataset = dataset
         # Are these data to be treated as SoA on the device?
         self._soa = bool(soa)
+        # Transposed copy of the data for direct loops on host backends,
+        # whether it and the data are up to date, and how many parallel
+        # loops have accessed these data directly and indirectly
+        self._soa_array = None
+        self._soa_valid = False
+        self._aos_valid = True
+        self._layout_profile = [0, 0]
         self._needs_halo_update = False
         # If the uid is not passed in from outside, assume that Dats
         # have been declared in the same order everywhere.
@@ -1483,12 +1797,7 @@ class Dat(DataCarrier, _EmptyDataMixin):
         else:
             self._id = uid
         self._name = name or "dat_%d" % self._id
-        halo = dataset.halo
-        if halo is not None:
-            self._send_reqs = {}
-            self._send_buf = {}
-            self._recv_reqs = {}
-            self._recv_buf = {}
+        self._halo_exchange = None
 
     @validate_in(('access', _modes, ModeValueError))
     def __call__(self, access, path=None, flatten=False):
@@ -1522,9 +1831,52 @@ class Dat(DataCarrier, _EmptyDataMixin):
 
     @property
     def soa(self):
-        """Are the data in SoA format?"""
+        """Are the data in SoA format?
+
+        Kernels address the components of a SoA :class:`Dat` with the
+        ``OP2_STRIDE`` macro. On the host backends the data are stored in
+        AoS format. If the ``soa_layout`` configuration parameter is set,
+        direct loops instead work on a SoA copy, see :attr:`_prefers_soa`,
+        which is only transposed back when the AoS data are needed."""
         return self._soa
 
+    @property
+    def _prefers_soa(self):
+        """Have at least as many of the parallel loops executed on this
+        :class:`Dat` accessed it directly as through a :class:`Map`?
+        Direct loops stream the SoA copy of the data, whereas gathers
+        read whole elements at a time and are better served by the AoS
+        layout."""
+        direct, indirect = self._layout_profile
+        return direct >= indirect
+
+    @property
+    def _soa_data(self):
+        """The data in SoA format, with one row per component of the
+        values of all elements including the halo. Only up to date after
+        a call to :meth:`_to_soa`."""
+        if self._soa_array is None:
+            self._soa_array = np.empty((self.cdim, self.dataset.total_size),
+                                       dtype=self.dtype)
+        return self._soa_array
+
+    def _to_soa(self):
+        """Transpose the data into :attr:`_soa_data`. The transposed copy
+        is cached until the data are next written."""
+        if not self._soa_valid:
+            self._soa_data[:] = self._data.reshape(-1, self.cdim).T
+            self._soa_valid = True
+
+    def _to_aos(self):
+        """Transpose the SoA data written by parallel loops back into the
+        AoS data, if these are stale. Both are valid afterwards."""
+        if not self._aos_valid:
+            writeable = self._data.flags.writeable
+            maybe_setflags(self._data, write=True)
+            self._data.reshape(-1, self.cdim)[:] = self._soa_data.T
+            maybe_setflags(self._data, write=writeable)
+            self._aos_valid = True
+
     @property
     @collective
     def data(self):
@@ -1541,6 +1893,9 @@ class Dat(DataCarrier, _EmptyDataMixin):
         _trace.evaluate(set([self]), set([self]))
         if self.dataset.total_size > 0 and self._data.size == 0 and self.cdim > 0:
             raise RuntimeError("Illegal access: no data associated with this Dat!")
+        self._to_aos()
+        # The data may be written, the SoA copy is stale
+        self._soa_valid = False
         maybe_setflags(self._data, write=True)
         v = self._data[:self.dataset.size].view()
         self.needs_halo_update = True
@@ -1579,6 +1934,7 @@ class Dat(DataCarrier, _EmptyDataMixin):
         _trace.evaluate(set([self]), set())
         if self.dataset.total_size > 0 and self._data.size == 0 and self.cdim > 0:
             raise RuntimeError("Illegal access: no data associated with this Dat!")
+        self._to_aos()
         v = self._data[:self.dataset.size].view()
         v.setflags(write=False)
         return v
@@ -1656,6 +2012,86 @@ class Dat(DataCarrier, _EmptyDataMixin):
         _make_object('ParLoop', self._copy_kernel, self.dataset.set,
                      self(READ), other(WRITE)).enqueue()
 
+    def _blas(self, name, expr, access, alpha, *dats):
+        """Queue a :func:`par_loop` setting the values of this :class:`Dat`
+        to the C expression ``expr`` of ``self``, ``alpha`` and the
+        :class:`Dat`\s ``dats``, which are called ``x`` and ``y``."""
+        for d in dats:
+            self._check_shape(d)
+        if np.isscalar(alpha):
+            alpha = _make_object('Global', 1, data=alpha, dtype=self.dtype)
+        params = ['%s *self' % self.ctype, '%s *alpha' % alpha.ctype]
+        params += ['%s *%s' % (d.ctype, n) for d, n in zip(dats, 'xy')]
+        k = _make_object('Kernel',
+                         """void %(name)s(%(params)s) {
+                            for ( int n = 0; n < %(dim)s; ++n ) {
+                                self[n] = %(expr)s;
+                            }
+                         }""" % {'name': name, 'params': ', '.join(params),
+                                 'dim': self.cdim, 'expr': expr},
+                         name)
+        par_loop(k, self.dataset.set, self(access), alpha(READ),
+                 *[d(READ) for d in dats])
+
+    @collective
+    def axpy(self, alpha, x):
+        """Add ``alpha`` times the :class:`Dat` ``x`` to this :class:`Dat`:
+        ``self = alpha * x + self``.
+
+        :arg alpha: a scalar or a :class:`Global` of dimension 1, such as the
+            (lazily computed) result of :meth:`inner`."""
+        self._blas('axpy', '(*alpha) * x[n] + self[n]', RW, alpha, x)
+
+    @collective
+    def aypx(self, alpha, x):
+        """Scale this :class:`Dat` by ``alpha`` and add the :class:`Dat`
+        ``x``: ``self = alpha * self + x``, see :meth:`axpy`."""
+        self._blas('aypx', '(*alpha) * self[n] + x[n]', RW, alpha, x)
+
+    @collective
+    def waxpy(self, alpha, x, y):
+        """Set this :class:`Dat` to ``alpha`` times the :class:`Dat` ``x``
+        plus the :class:`Dat` ``y``: ``self = alpha * x + y``, see
+        :meth:`axpy`."""
+        self._blas('waxpy', '(*alpha) * x[n] + y[n]', WRITE, alpha, x, y)
+
+    @collective
+    def inner(self, other):
+        """Compute the inner product of this :class:`Dat` with the
+        :class:`Dat` ``other`` over the owned values of all processes.
+
+        :returns: a :class:`Global` holding the inner product, which is
+            computed lazily by a single reduction."""
+        self._check_shape(other)
+        ret = _make_object('Global', 1, data=0, dtype=self.dtype)
+        k = _make_object('Kernel',
+                         """void inner(%(t)s *self, %(to)s *other, %(t)s *ret) {
+                            for ( int n = 0; n < %(dim)s; ++n ) {
+                                *ret += self[n] * other[n];
+                            }
+                         }""" % {'t': self.ctype, 'to': other.ctype,
+                                 'dim': self.cdim},
+                         "inner")
+        par_loop(k, self.dataset.set, self(READ), other(READ), ret(INC))
+        return ret
+
+    @property
+    @collective
+    def maxabs(self):
+        """The maximum absolute value over the owned values of all
+        processes."""
+        ret = _make_object('Global', 1, data=0, dtype=self.dtype)
+        k = _make_object('Kernel',
+                         """void maxabs(%(t)s *self, %(t)s *ret) {
+                            for ( int n = 0; n < %(dim)s; ++n ) {
+                                %(t)s a = self[n] < 0 ? -self[n] : self[n];
+                                if ( a > *ret ) *ret = a;
+                            }
+                         }""" % {'t': self.ctype, 'dim': self.cdim},
+                         "maxabs")
+        par_loop(k, self.dataset.set, self(READ), ret(MAX))
+        return ret.data[0]
+
     def __iter__(self):
         """Yield self when iterated over."""
         yield self
@@ -1669,6 +2105,8 @@ class Dat(DataCarrier, _EmptyDataMixin):
         :class:`DataSet` and containing the same data."""
         try:
             if self._is_allocated and other._is_allocated:
+                self._to_aos()
+                other._to_aos()
                 return (self._dataset == other._dataset and
                         self.dtype == other.dtype and
                         np.array_equal(self._data, other._data))
@@ -1697,12 +2135,36 @@ class Dat(DataCarrier, _EmptyDataMixin):
             raise ValueError('Mismatched shapes in operands %s and %s' %
                              self.dataset.dim, other.dataset.dim)
 
+    def _use_numpy(self):
+        """Should pointwise arithmetic on this :class:`Dat` be done in place
+        with NumPy rather than by a generated :func:`par_loop`? That is the
+        case for :class:`Dat`\s without a halo which are small enough for
+        building and launching the loop to cost more than the arithmetic,
+        see the ``dat_op_numpy_size`` configuration parameter, unless the
+        loop may be fused with others on the lazy trace."""
+        if configuration["lazy_evaluation"] and configuration["loop_fusion"]:
+            return False
+        return self.dataset.set.halo is None and \
+            self.dataset.size * self.cdim <= configuration["dat_op_numpy_size"]
+
     def _op(self, other, op):
         ops = {operator.add: '+',
                operator.sub: '-',
                operator.mul: '*',
                operator.div: '/'}
+        # Division is true division followed by a cast to the type of the
+        # result, which truncates integers towards zero like C does
+        ufuncs = {operator.add: np.add,
+                  operator.sub: np.subtract,
+                  operator.mul: np.multiply,
+                  operator.div: np.true_divide}
         ret = _make_object('Dat', self.dataset, None, self.dtype)
+        if self._use_numpy():
+            if not np.isscalar(other):
+                self._check_shape(other)
+                other = other.data_ro
+            ufuncs[op](self.data_ro, other, out=ret.data, casting='unsafe')
+            return ret
         if np.isscalar(other):
             other = _make_object('Global', 1, data=other)
             k = _make_object('Kernel',
@@ -1731,6 +2193,17 @@ class Dat(DataCarrier, _EmptyDataMixin):
                operator.isub: '-=',
                operator.imul: '*=',
                operator.idiv: '/='}
+        ufuncs = {operator.iadd: np.add,
+                  operator.isub: np.subtract,
+                  operator.imul: np.multiply,
+                  operator.idiv: np.true_divide}
+        if self._use_numpy():
+            if not np.isscalar(other):
+                self._check_shape(other)
+                other = other.data_ro
+            data = self.data
+            ufuncs[op](data, other, out=data, casting='unsafe')
+            return self
         if np.isscalar(other):
             other = _make_object('Global', 1, data=other)
             k = _make_object('Kernel',
@@ -1756,6 +2229,10 @@ class Dat(DataCarrier, _EmptyDataMixin):
 
     def _uop(self, op):
         ops = {operator.sub: '-'}
+        if self._use_numpy():
+            data = self.data
+            np.negative(data, out=data)
+            return self
         k = _make_object('Kernel',
                          """void k(%(t)s *self) {
                             for ( int n = 0; n < %(dim)s; ++n ) {
@@ -1833,48 +2310,63 @@ class Dat(DataCarrier, _EmptyDataMixin):
         halo = self.dataset.halo
         if halo is None:
             return
-        for dest, ele in halo.sends.iteritems():
-            self._send_buf[dest] = self._data[ele]
-            self._send_reqs[dest] = halo.comm.Isend(self._send_buf[dest],
-                                                    dest=dest, tag=self._id)
-        for source, ele in halo.receives.iteritems():
-            self._recv_buf[source] = self._data[ele]
-            self._recv_reqs[source] = halo.comm.Irecv(self._recv_buf[source],
-                                                      source=source, tag=self._id)
+        halo.exchange_begin([self])
 
     @collective
     def halo_exchange_end(self):
         """End halo exchange. Waits on MPI recv."""
-        halo = self.dataset.halo
-        if halo is None:
-            return
-        _MPI.Request.Waitall(self._recv_reqs.values())
-        _MPI.Request.Waitall(self._send_reqs.values())
-        self._recv_reqs.clear()
-        self._send_reqs.clear()
-        self._send_buf.clear()
-        # data is read-only in a ParLoop, make it temporarily writable
-        maybe_setflags(self._data, write=True)
-        for source, buf in self._recv_buf.iteritems():
-            self._data[halo.receives[source]] = buf
-        maybe_setflags(self._data, write=False)
-        self._recv_buf.clear()
+        if self._halo_exchange is not None:
+            self._halo_exchange.end()
+
+    def _halo_exchange_prepare(self):
+        """Make the data of this :class:`Dat` ready to have its halo values
+        packed for an exchange."""
+        self._to_aos()
 
     @property
+    @collective
     def norm(self):
-        """The L2-norm on the flattened vector."""
-        return np.linalg.norm(self._data)
+        """The L2-norm on the flattened vector of the owned values of all
+        processes, see :meth:`inner`."""
+        return np.sqrt(self.inner(self).data[0])
 
     @classmethod
-    def fromhdf5(cls, dataset, f, name):
-        """Construct a :class:`Dat` from a Dat named ``name`` in HDF5 data ``f``"""
+    def fromhdf5(cls, dataset, f, name, indices=None):
+        """Construct a :class:`Dat` from a Dat named ``name`` in HDF5 data ``f``
+
+        :arg indices: the rows of the Dat in ``f`` holding the values of the
+            local elements of ``dataset``, owned followed by halo (optional,
+            all rows are read by default). They are read in blocks straight
+            into the :class:`Dat`'s data, see :func:`utils.hdf5_read`."""
         slot = f[name]
-        data = slot.value
+        data = hdf5_read(slot, indices)
         soa = slot.attrs['type'].find(':soa') > 0
         ret = cls(dataset, data, name=name, soa=soa)
         return ret
 
 
+class _GlobalSum(LazyComputation):
+
+    """Set a :class:`Global` to the sum of the values of several other
+    :class:`Global`\s once these have been computed.
+
+    Every rank holds the reduced values of the :class:`Global`\s, so these
+    are added after their reductions rather than by incrementing ``ret``
+    in several :func:`par_loop`\s, which would add its earlier value on
+    every rank.
+
+    :arg globals: the :class:`Global`\s to add.
+    :arg ret: the :class:`Global` set to their sum."""
+
+    def __init__(self, globals, ret):
+        LazyComputation.__init__(self, globals, [ret])
+        self._globals = globals
+        self._ret = ret
+
+    def _run(self):
+        self._ret._data = sum(g._data for g in self._globals)
+
+
 class MixedDat(Dat):
     """A container for a bag of :class:`Dat`\s.
 
@@ -1976,6 +2468,56 @@ class MixedDat(Dat):
         for d in self._dats:
             d.zero()
 
+    def _use_numpy(self):
+        """Arithmetic on a :class:`MixedDat` is always done by a
+        :func:`par_loop`."""
+        return False
+
+    @collective
+    def axpy(self, alpha, x):
+        """Add ``alpha`` times the :class:`MixedDat` ``x`` to this
+        :class:`MixedDat`, see :meth:`Dat.axpy`."""
+        if np.isscalar(alpha):
+            alpha = _make_object('Global', 1, data=alpha, dtype=self.dtype)
+        for s, o in zip(self, x):
+            s.axpy(alpha, o)
+
+    @collective
+    def aypx(self, alpha, x):
+        """Scale this :class:`MixedDat` by ``alpha`` and add the
+        :class:`MixedDat` ``x``, see :meth:`Dat.aypx`."""
+        if np.isscalar(alpha):
+            alpha = _make_object('Global', 1, data=alpha, dtype=self.dtype)
+        for s, o in zip(self, x):
+            s.aypx(alpha, o)
+
+    @collective
+    def waxpy(self, alpha, x, y):
+        """Set this :class:`MixedDat` to ``alpha`` times the
+        :class:`MixedDat` ``x`` plus the :class:`MixedDat` ``y``, see
+        :meth:`Dat.waxpy`."""
+        if np.isscalar(alpha):
+            alpha = _make_object('Global', 1, data=alpha, dtype=self.dtype)
+        for s, o, p in zip(self, x, y):
+            s.waxpy(alpha, o, p)
+
+    @collective
+    def inner(self, other):
+        """Compute the inner product of this :class:`MixedDat` with the
+        :class:`MixedDat` ``other``, see :meth:`Dat.inner`. The inner
+        products of all components are summed lazily as well."""
+        self._check_shape(other)
+        ret = _make_object('Global', 1, data=0, dtype=self.dtype)
+        _GlobalSum([s.inner(o) for s, o in zip(self, other)], ret).enqueue()
+        return ret
+
+    @property
+    @collective
+    def maxabs(self):
+        """The maximum absolute value over the owned values of all
+        components and processes."""
+        return max(s.maxabs for s in self)
+
     def __iter__(self):
         """Yield all :class:`Dat`\s when iterated over."""
         for d in self._dats:
@@ -2016,6 +2558,7 @@ class Const(DataCarrier):
         This exception is raised if the name is already in use."""
 
     _defs = set()
+    _defs_key = None
     _globalcount = 0
 
     @validate_type(('name', str, NameTypeError))
@@ -2028,6 +2571,7 @@ class Const(DataCarrier):
             raise Const.NonUniqueNameError(
                 "OP2 Constants are globally scoped, %s is already in use" % self._name)
         Const._defs.add(self)
+        Const._defs_key = None
         Const._globalcount += 1
 
     @property
@@ -2061,12 +2605,21 @@ class Const(DataCarrier):
     def _definitions(cls):
         return sorted(Const._defs, key=lambda c: c.name)
 
+    @classmethod
+    def _definitions_key(cls):
+        """Cache key identifying the currently defined :class:`Const`\s,
+        recomputed only when a :class:`Const` is added or removed."""
+        if Const._defs_key is None:
+            Const._defs_key = tuple((c.name, c.dtype, c.cdim) for c in Const._definitions())
+        return Const._defs_key
+
     def remove_from_namespace(self):
         """Remove this Const object from the namespace
 
         This allows the same name to be redeclared with a different shape."""
         _trace.evaluate(set(), set([self]))
         Const._defs.discard(self)
+        Const._defs_key = None
 
     def _format_declaration(self):
         d = {'type': self.ctype,
@@ -2117,7 +2670,6 @@ class Global(DataCarrier, _EmptyDataMixin):
         self._dim = as_tuple(dim, int)
         self._cdim = np.asscalar(np.prod(self._dim))
         _EmptyDataMixin.__init__(self, data, dtype, self._dim)
-        self._buf = np.empty(self.shape, dtype=self.dtype)
         self._name = name or "global_%d" % Global._globalcount
         Global._globalcount += 1
 
@@ -2378,6 +2930,26 @@ class Map(object):
         """The bottom layer mask to be applied on a mesh cell."""
         return self._bottom_mask
 
+    @property
+    def _layers_disjoint(self):
+        """Whether the entries reached through this :class:`Map` from the
+        different layers of a column of an extruded ``iterset`` are
+        disjoint. This is the case if all entries are offset by the same
+        amount from one layer to the next and no map entry is that far or
+        further from another of the same element. It is computed once since
+        neither the values nor the offsets can change."""
+        if not hasattr(self, '_disjoint'):
+            off = self._offset
+            if self._iterset.layers == 1 or off is None or \
+                    len(set(off)) != 1 or off[0] <= 0:
+                self._disjoint = False
+            elif self._values.size == 0:
+                self._disjoint = True
+            else:
+                spread = self._values.max(axis=1) - self._values.min(axis=1)
+                self._disjoint = bool((spread < off[0]).all())
+        return self._disjoint
+
     def __str__(self):
         return "OP2 Map: %s from (%s) to (%s) with arity %s" \
                % (self._name, self._iterset, self._toset, self._arity)
@@ -2403,10 +2975,21 @@ class Map(object):
         return self == o or (isinstance(self._parent, Map) and self._parent <= o)
 
     @classmethod
-    def fromhdf5(cls, iterset, toset, f, name):
-        """Construct a :class:`Map` from set named ``name`` in HDF5 data ``f``"""
+    def fromhdf5(cls, iterset, toset, f, name, indices=None, mmap=False):
+        """Construct a :class:`Map` from set named ``name`` in HDF5 data ``f``
+
+        :arg indices: the rows of the map in ``f`` for the local elements of
+            ``iterset``, owned followed by halo (optional, all rows are read
+            by default), see :func:`utils.hdf5_read`.
+        :arg mmap: memory-map the values read-only rather than read them, if
+            all rows are used and they are stored contiguously as 32 bit
+            integers of native byte order (see :func:`utils.hdf5_memmap`)."""
         slot = f[name]
-        values = slot.value
+        values = None
+        if mmap and indices is None and slot.dtype == np.dtype(np.int32):
+            values = hdf5_memmap(slot)
+        if values is None:
+            values = hdf5_read(slot, indices)
         arity = slot.shape[1:]
         if len(arity) != 1:
             raise ArityTypeError("Unrecognised arity value %s" % arity)
@@ -2484,6 +3067,12 @@ class MixedMap(Map):
         """Vertical offsets."""
         return tuple(m.offset for m in self._maps)
 
+    @property
+    def _layers_disjoint(self):
+        """Whether all contained :class:`Map`\s reach disjoint entries from
+        the different layers of a column."""
+        return all(m._layers_disjoint for m in self._maps)
+
     def __iter__(self):
         """Yield all :class:`Map`\s when iterated over."""
         for m in self._maps:
@@ -2633,8 +3222,6 @@ class Sparsity(Cached):
                 for j, cds in enumerate(dsets[1]):
                     row.append(Sparsity((rds, cds), [(rm.split[i], cm.split[j]) for rm, cm in maps]))
                 self._blocks.append(row)
-            self._rowptr = tuple(s._rowptr for s in self)
-            self._colidx = tuple(s._colidx for s in self)
             self._d_nnz = tuple(s._d_nnz for s in self)
             self._o_nnz = tuple(s._o_nnz for s in self)
             self._d_nz = sum(s._d_nz for s in self)
@@ -2642,6 +3229,7 @@ class Sparsity(Cached):
         else:
             build_sparsity(self, parallel=MPI.parallel)
             self._blocks = [[self]]
+        self._offsets = {}
         self._initialized = True
 
     def __getitem__(self, idx):
@@ -2721,6 +3309,62 @@ class Sparsity(Cached):
     def __repr__(self):
         return "Sparsity(%r, %r, %r)" % (self.dsets, self.maps, self.name)
 
+    @property
+    def _rowptr(self):
+        if self.shape > (1, 1):
+            return tuple(s._rowptr for s in self)
+        return self._scalar_pattern[0]
+
+    @property
+    def _colidx(self):
+        if self.shape > (1, 1):
+            return tuple(s._colidx for s in self)
+        return self._scalar_pattern[1]
+
+    @property
+    def _scalar_pattern(self):
+        """The pattern is built and stored per block of :attr:`dims`. The
+        scalar pattern in CSR format is only expanded from that on demand."""
+        if not hasattr(self, '_scalar_csr'):
+            if self._block_rowptr is None:
+                # We do not build the pattern in parallel
+                self._scalar_csr = ([], [])
+            else:
+                self._scalar_csr = expand_sparsity(self._dims[0], self._dims[1],
+                                                   self._block_rowptr,
+                                                   self._block_colidx)
+        return self._scalar_csr
+
+    def _insertion_offsets(self, rmap, cmap):
+        """Offsets into the values of a CSR matrix on this :class:`Sparsity`
+        of the entries of the local tensor of each iteration set element
+        accessed through the row :class:`Map` ``rmap`` and the column
+        :class:`Map` ``cmap``, as an array of shape ``(elements, rmap arity,
+        cmap arity)``.
+
+        Since the pattern is fixed, assembly can add the local tensor
+        straight to the values at these offsets instead of searching each
+        row for the columns. The offsets are computed once per pair of maps
+        and cached. They are only available for a scalar sparsity built in
+        serial."""
+        key = (rmap, cmap)
+        if key not in self._offsets:
+            assert self.shape == (1, 1) and self._dims == (1, 1), \
+                "Insertion offsets only exist for scalar sparsities"
+            rowptr, colidx = self._rowptr, self._colidx
+            ncols = np.int64(self._ncols)
+            # The CSR entries are sorted by row and then by column, so are
+            # their keys row * ncols + col
+            entries = np.repeat(np.arange(self._nrows, dtype=np.int64), np.diff(rowptr)) * ncols + colidx
+            rows = rmap.values_with_halo.astype(np.int64)
+            cols = cmap.values_with_halo.astype(np.int64)
+            keys = rows[:, :, np.newaxis] * ncols + cols[:, np.newaxis, :]
+            offsets = np.searchsorted(entries, keys).astype(np.int32)
+            if (entries.take(offsets, mode='clip') != keys).any():
+                raise MapValueError("Maps %s and %s not in sparsity %s" % (rmap, cmap, self))
+            self._offsets[key] = offsets
+        return self._offsets[key]
+
     @property
     def rowptr(self):
         """Row pointer array of CSR data structure."""
@@ -2888,7 +3532,9 @@ class Kernel(KernelCached):
         # Both code and name are relevant since there might be multiple kernels
         # extracting different functions from the same code
         # Also include the PyOP2 version, since the Kernel class might change
-        return md5(code + name + str(opts) + version).hexdigest()
+        if isinstance(code, Node):
+            code = code.signature()
+        return md5(code + name + str(sorted(opts.items())) + version).hexdigest()
 
     def __init__(self, code, name, opts={}):
         # Protect against re-initialization when retrieved from cache
@@ -2927,30 +3573,12 @@ class JITModule(Cached):
 
     @classmethod
     def _cache_key(cls, kernel, itspace, *args, **kwargs):
-        key = (kernel.cache_key, itspace.cache_key)
-        for arg in args:
-            if arg._is_global:
-                key += (arg.data.dim, arg.data.dtype, arg.access)
-            elif arg._is_dat:
-                if isinstance(arg.idx, IterationIndex):
-                    idx = (arg.idx.__class__, arg.idx.index)
-                else:
-                    idx = arg.idx
-                map_arity = arg.map.arity if arg.map else None
-                key += (arg.data.dim, arg.data.dtype, map_arity, idx, arg.access)
-            elif arg._is_mat:
-                idxs = (arg.idx[0].__class__, arg.idx[0].index,
-                        arg.idx[1].index)
-                map_arities = (arg.map[0].arity, arg.map[1].arity)
-                key += (arg.data.dims, arg.data.dtype, idxs,
-                        map_arities, arg.access)
+        key = (kernel.cache_key, itspace.cache_key, kwargs.get('soa', False))
+        key += tuple(arg._signature for arg in args)
 
         # The currently defined Consts need to be part of the cache key, since
         # these need to be uploaded to the device before launching the kernel
-        for c in Const._definitions():
-            key += (c.name, c.dtype, c.cdim)
-
-        return key
+        return key + Const._definitions_key()
 
     def _dump_generated_code(self, src, ext=None):
         """Write the generated code to a file for debugging purposes.
@@ -2998,23 +3626,106 @@ class ParLoop(LazyComputation):
         self._kernel = kernel
         self._is_layered = iterset.layers > 1
 
+        # Indirect Dat arguments share the indirect position of the first
+        # argument with the same data and map. We have to check for identity
+        # here (we really want these to be the same thing, not just look the
+        # same)
+        first = {}
         for i, arg in enumerate(self._actual_args):
             arg.position = i
-            arg.indirect_position = i
-        for i, arg1 in enumerate(self._actual_args):
-            if arg1._is_dat and arg1._is_indirect:
-                for arg2 in self._actual_args[i:]:
-                    # We have to check for identity here (we really
-                    # want these to be the same thing, not just look
-                    # the same)
-                    if arg2.data is arg1.data and arg2.map is arg1.map:
-                        arg2.indirect_position = arg1.indirect_position
+            if arg._is_dat and arg._is_indirect:
+                arg.indirect_position = first.setdefault((id(arg.data), id(arg.map)), i)
+            else:
+                arg.indirect_position = i
 
         self._it_space = self.build_itspace(iterset)
 
+    def __call__(self, *args):
+        """Enqueue this parallel loop for execution again, reusing the
+        argument vector passed to the generated code and the plan, such that
+        repeatedly executing the same loop is cheap.
+
+        :arg args: optionally, new :class:`Arg`\s to execute the loop with.
+            They need to have the same structure (data shape and type, map
+            arity, index and access descriptor) as the arguments the loop was
+            built with.
+
+        Data buffers which have been replaced since the loop was last
+        executed (e.g. by assigning to the ``data`` of a :class:`Global` or
+        :class:`Const`) are updated in the argument vector."""
+        if args:
+            if len(args) != len(self._actual_args) or \
+                    any(a._signature != b._signature for a, b in zip(args, self._actual_args)):
+                raise ValueError("Arguments do not match the structure of %s" % self)
+            loop = _make_object('ParLoop', self._kernel, self._it_space.iterset, *args)
+            # Map values and sparsity insertion offsets are not tracked as
+            # buffers, so the argument vector can only be reused if all
+            # maps and matrices are the same
+            if hasattr(self, '_jit_args') and hasattr(self, '_buffers') and \
+                    not any(a._is_mat and a.data is not b.data or
+                            a.map is not b.map and
+                            (a.map is None or b.map is None or
+                             any(m is not n for m, n in zip(a.map, b.map)))
+                            for a, b in zip(args, self._actual_args)):
+                loop._jit_args = list(self._jit_args)
+                loop._buffers = self._buffers
+                if hasattr(self, '_soa'):
+                    # The argument vector was built for this data layout
+                    loop._soa = self._soa
+        elif _trace.in_queue(self):
+            # Cannot enqueue the same object twice
+            loop = copy(self)
+            loop._scheduled = False
+        else:
+            loop = self
+        loop._update_buffers()
+        return loop.enqueue()
+
+    def _update_buffers(self):
+        """Replace data buffers in the argument vector of the generated code
+        which have changed since it was built."""
+        buffers = [self._jit_arg_data(arg, d) for arg in self.args
+                   if not arg._is_mat for d in arg.data] + \
+            [c.data for c in Const._definitions()]
+        old = getattr(self, '_buffers', None)
+        self._buffers = buffers
+        if old is None or not hasattr(self, '_jit_args'):
+            return
+        if len(old) != len(buffers):
+            del self._jit_args
+            return
+        if all(a is b for a, b in zip(old, buffers)):
+            return
+        # Buffers appear in the argument vector in the same order
+        j = 0
+        for i, a in enumerate(self._jit_args):
+            if j < len(old) and a is old[j]:
+                self._jit_args[i] = buffers[j]
+                j += 1
+        if j != len(old):
+            del self._jit_args
+
+    def _jit_arg_data(self, arg, d):
+        """The array passed to the generated code for the :class:`Dat`
+        ``d`` of the argument ``arg``."""
+        return d._data
+
+    def enqueue(self):
+        if configuration['lazy_evaluation'] and configuration['compile_in_background']:
+            fun = self._jitmodule
+            if fun is not None:
+                fun.compile_async()
+        return LazyComputation.enqueue(self)
+
     def _run(self):
         return self.compute()
 
+    @property
+    def _jitmodule(self):
+        """The :class:`JITModule` executing this parallel loop, or ``None``
+        if the backend does not support compiling it ahead of execution."""
+        return None
+
     @collective
     def compute(self):
         """Executes the kernel over all members of the iteration space."""
@@ -3046,13 +3757,29 @@ class ParLoop(LazyComputation):
 
     @collective
     def halo_exchange_begin(self):
-        """Start halo exchanges."""
+        """Start halo exchanges. The :class:`Dat`\s of all arguments which
+        need a halo update are grouped by :class:`Halo`, and each group is
+        exchanged in a single message per neighbour. A :class:`Dat` passed
+        in several arguments is only exchanged once."""
         if self.is_direct:
             # No need for halo exchanges for a direct loop
             return
+        batches = OrderedDict()
+        exec_halo = self.needs_exec_halo
         for arg in self.args:
-            if arg._is_dat:
-                arg.halo_exchange_begin()
+            # Direct arguments are only read in the halo when executing
+            # over the exec halo
+            if arg._is_dat and arg.access in [READ, RW] and \
+                    (arg._is_indirect or exec_halo) and arg.data.needs_halo_update:
+                assert not arg._in_flight, \
+                    "Halo exchange already in flight for Arg %s" % arg
+                arg.data.needs_halo_update = False
+                arg._in_flight = True
+                for d in arg.data:
+                    if d.dataset.halo is not None:
+                        batches.setdefault(d.dataset.halo, []).append(d)
+        for halo, dats in batches.iteritems():
+            halo.exchange_begin(dats)
 
     @collective
     def halo_exchange_end(self):
@@ -3062,13 +3789,38 @@ class ParLoop(LazyComputation):
         for arg in self.args:
             if arg._is_dat:
                 arg.halo_exchange_end()
+        # Finish exchanges started ahead of this loop by the ExecutionTrace
+        for d in self._halo_reads:
+            if d._halo_exchange is not None:
+                d.halo_exchange_end()
+
+    @property
+    def _halo_reads(self):
+        """List of the :class:`Dat`\s whose halo values this parallel loop
+        reads, in argument order."""
+        if self.is_direct:
+            return []
+        exec_halo = self.needs_exec_halo
+        dats = OrderedDict()
+        for arg in self.args:
+            if arg._is_dat and arg.access in [READ, RW] and (arg._is_indirect or exec_halo):
+                for d in arg.data:
+                    dats[id(d)] = d
+        return dats.values()
 
     @collective
     def reduction_begin(self):
-        """Start reductions"""
+        """Start reductions. The reductions of all :class:`Global` arguments
+        with the same access descriptor and data type are batched into one
+        :class:`GlobalReduction`."""
+        batches = OrderedDict()
         for arg in self.args:
             if arg._is_global_reduction:
-                arg.reduction_begin()
+                assert not arg._in_flight, \
+                    "Reduction already in flight for Arg %s" % arg
+                batches.setdefault((arg.access, arg.data.dtype), []).append(arg)
+        for args in batches.values():
+            GlobalReduction(args)
 
     @collective
     def reduction_end(self):
@@ -3185,6 +3937,361 @@ class ParLoop(LazyComputation):
         """Flag which triggers extrusion"""
         return self._is_layered
 
+    @property
+    def _is_fusable(self):
+        """Can this parallel loop take part in loop fusion? Loops with
+        :class:`Mat` arguments, local iteration spaces, mixed arguments or
+        extruded iteration sets are never fused."""
+        return not (self._is_layered or self._kernel._opt_is_padded or
+                    any(a._is_mat or a._is_mixed or a._uses_itspace
+                        for a in self.args))
+
+    @property
+    def _is_tileable(self):
+        """Can this parallel loop be part of a sparse tiled loop chain? Loops
+        are only tiled when running on a single process and never if they
+        have :class:`Mat`, mixed or SoA arguments or iterate over a
+        :class:`Subset` or an extruded set."""
+        return not (MPI.comm.size > 1 or self._is_layered or
+                    isinstance(self.it_space.iterset, Subset) or
+                    any(a._is_mat or a._is_mixed or a._is_soa for a in self.args))
+
+
+def _copy_arg(arg):
+    """Build a fresh :class:`Arg` accessing the same data as ``arg``, such
+    that it can be passed to a newly constructed :class:`ParLoop`."""
+    return _make_object('Arg', data=arg.data, map=arg.map, idx=arg.idx,
+                        access=arg.access, flatten=arg._flatten)
+
+
+def _can_fuse(group, loop):
+    """Can ``loop`` be appended to the ``group`` of :class:`ParLoop`\s to be
+    fused?
+
+    All loops need to iterate over the same :class:`Set`. A data carrier
+    modified by one loop and accessed by another may only be a :class:`Dat`
+    accessed directly by both loops (such that all accesses for a given set
+    element happen in the same iteration of the fused loop) or incremented by
+    both loops (since increments commute). Anything else would read values
+    through a :class:`Map` which have not yet been computed. Distinct kernels
+    may not define helper functions of the same name."""
+    if not (isinstance(loop, ParLoop) and loop._is_fusable and
+            loop.it_space.iterset is group[0].it_space.iterset):
+        return False
+    for prev in group:
+        if _kernel_functions(prev.kernel) & _kernel_functions(loop.kernel) and \
+                (prev.kernel.name, prev.kernel.code) != (loop.kernel.name, loop.kernel.code):
+            # The functions would be defined twice in the fused code
+            return False
+        for a in loop.args:
+            for b in prev.args:
+                if a.data is not b.data or (a.access is READ and b.access is READ):
+                    continue
+                if a._is_global:
+                    return False
+                if not (a._is_direct and b._is_direct) and \
+                        not (a.access is INC and b.access is INC):
+                    return False
+    return True
+
+
+_C_KEYWORDS = frozenset(['if', 'else', 'for', 'while', 'do', 'switch', 'return', 'sizeof'])
+
+
+def _kernel_functions(kernel):
+    """The names of the helper functions defined in the code of ``kernel``
+    besides the kernel itself."""
+    names = set(re.findall(r'\b(\w+)\s*\([^()]*\)\s*\{', kernel.code))
+    return names - _C_KEYWORDS - set([kernel.name])
+
+
+def _fuse_loops(loops):
+    """Build a single :class:`ParLoop` executing the kernels of all ``loops``
+    one after the other for each element of the common iteration set.
+
+    The kernels are renamed in the generated code, such that kernels with the
+    same name (e.g. the ones generated by the :class:`Dat` arithmetic) can be
+    fused. Identical kernels are emitted once, such that the helper functions
+    they define are not redefined."""
+    if len(loops) == 1:
+        return loops[0]
+    code = []
+    params = []
+    calls = []
+    args = []
+    names = {}
+    for loop in loops:
+        key = (loop.kernel.name, loop.kernel.code)
+        if key not in names:
+            names[key] = "%s_%d" % (loop.kernel.name, len(names))
+            code.append("#define %(k)s %(name)s\n%(code)s\n#undef %(k)s" %
+                        {'k': loop.kernel.name, 'name': names[key], 'code': loop.kernel.code})
+        name = names[key]
+        cargs = []
+        for arg in loop.args:
+            p = "p%d" % len(args)
+            params.append("%s %s%s" % (arg.ctype, '**' if arg._is_vec_map else '*', p))
+            cargs.append(p)
+            args.append(_copy_arg(arg))
+        calls.append("%s(%s);" % (name, ', '.join(cargs)))
+    name = '_'.join(["fused"] + [loop.kernel.name for loop in loops])
+    code.append("void %(name)s(%(params)s) {\n  %(calls)s\n}" %
+                {'name': name, 'params': ', '.join(params), 'calls': '\n  '.join(calls)})
+    kernel = _make_object('Kernel', '\n'.join(code), name)
+    return _make_object('ParLoop', kernel, loops[0].it_space.iterset, *args)
+
+
+class Tiling(Cached):
+
+    """Sparse tiling schedule for a chain of :class:`ParLoop`\s.
+
+    The iteration set of the first loop in the chain is split into tiles of
+    ``tile_size`` consecutive elements. Each iteration of a subsequent loop
+    is assigned to the lowest tile (no lower than its position in the
+    iteration set suggests) such that it executes after all iterations of
+    previous loops it depends on, i.e. which write data it accesses or read
+    data it writes. Executing all loops for a tile before moving on to the
+    next one therefore gives the same result as executing the loops one after
+    the other, while the data touched by a tile stays in cache.
+
+    The schedule only depends on the iteration sets, the maps and the way
+    data is shared between the loops and is cached accordingly."""
+
+    _cache = {}
+
+    @classmethod
+    def _cache_key(cls, loops, tile_size):
+        key = (tile_size,)
+        # Identity of the data doesn't matter, but which loops share data does
+        slots = {}
+        for loop in loops:
+            subkey = (loop.it_space.iterset,)
+            for arg in loop.args:
+                slot = slots.setdefault(id(arg.data), len(slots))
+                idx = arg.idx.__class__ if arg._uses_itspace else arg.idx
+                subkey += ((slot, arg.map, idx, arg.access),)
+            key += (subkey,)
+        return key
+
+    def __init__(self, loops, tile_size):
+        # Return early if we got a cached object
+        if self._initialized:
+            return
+        self._ntiles = max(1, -(-loops[0].it_space.iterset.size // tile_size))
+        # For each data carrier, the highest tile reading, incrementing and
+        # otherwise writing each element
+        seen = {}
+        self._schedule = []
+        for loop in loops:
+            size = loop.it_space.iterset.size
+            tile = np.arange(size) * self._ntiles // max(size, 1)
+            elems = [self._elements(arg, size) for arg in loop.args]
+            for arg, e in zip(loop.args, elems):
+                if id(arg.data) not in seen:
+                    continue
+                last = seen[id(arg.data)]
+                if arg.access is READ:
+                    deps = (last[INC], last[WRITE])
+                elif arg.access is INC:
+                    deps = (last[READ], last[WRITE])
+                else:
+                    deps = (last[READ], last[INC], last[WRITE])
+                for d in deps:
+                    tile = np.maximum(tile, d[e].max(axis=1))
+            for arg, e in zip(loop.args, elems):
+                if id(arg.data) not in seen:
+                    n = 1 if arg._is_global else arg.data.dataset.set.total_size
+                    seen[id(arg.data)] = dict((a, np.zeros(n, dtype=np.int64) - 1)
+                                              for a in (READ, INC, WRITE))
+                acc = arg.access if arg.access in (READ, INC) else WRITE
+                np.maximum.at(seen[id(arg.data)][acc], e.ravel(),
+                              np.repeat(tile, e.shape[1]))
+            # Iterations of this loop grouped by tile
+            order = np.argsort(tile, kind='mergesort')
+            offsets = np.searchsorted(tile[order], np.arange(self._ntiles + 1))
+            self._schedule.append([order[offsets[t]:offsets[t + 1]]
+                                   for t in range(self._ntiles)])
+        self._itersets = [loop.it_space.iterset for loop in loops]
+        self._subsets = None
+        self._tile_loops = (None, None)
+        self._initialized = True
+
+    @staticmethod
+    def _elements(arg, size):
+        """Elements of the data carrier of ``arg`` accessed by each of the
+        ``size`` iterations, as an array of shape ``(size, n)``."""
+        if arg._is_global:
+            return np.zeros((size, 1), dtype=np.int32)
+        if arg._is_direct:
+            return np.arange(size, dtype=np.int32).reshape(size, 1)
+        values = arg.map.values_with_halo[:size]
+        if arg._uses_itspace or arg._is_vec_map:
+            return values
+        return values[:, [arg.idx]]
+
+    @property
+    def ntiles(self):
+        """Number of tiles in the schedule."""
+        return self._ntiles
+
+    @property
+    def schedule(self):
+        """For each loop of the chain, a list of the iterations executed in
+        each tile."""
+        return self._schedule
+
+    @property
+    def subsets(self):
+        """For each tile, a list of the :class:`Subset`\s of the iteration
+        sets of the loops of the chain executed in the tile, or ``None``
+        for loops which have no iterations in the tile."""
+        if self._subsets is None:
+            self._subsets = [[_make_object('Subset', iterset, schedule[t])
+                              if len(schedule[t]) > 0 else None
+                              for iterset, schedule in zip(self._itersets, self._schedule)]
+                             for t in range(self._ntiles)]
+        return self._subsets
+
+    def tile_loops(self, loops):
+        """For each tile, the list of :class:`ParLoop`\s executing ``loops``
+        over their :attr:`subsets` in the tile. The loops are built once and
+        reused as long as ``loops`` execute the same kernels on the same data
+        through the same maps, which is the case when a chain is executed
+        repeatedly."""
+        key = tuple((id(loop.kernel),) + tuple((id(arg.data), id(arg.map)) for arg in loop.args)
+                    for loop in loops)
+        if self._tile_loops[0] != key:
+            self._tile_loops = (key, [[_make_object('ParLoop', loop.kernel, subset,
+                                                    *[_copy_arg(arg) for arg in loop.args])
+                                       for loop, subset in zip(loops, subsets)
+                                       if subset is not None]
+                                      for subsets in self.subsets])
+        return self._tile_loops[1]
+
+
+class TiledLoopChain(LazyComputation):
+
+    """Executor for a chain of :class:`ParLoop`\s according to a sparse
+    tiling :class:`Tiling` schedule.
+
+    :arg loops: the :class:`ParLoop`\s to execute, in order."""
+
+    def __init__(self, loops):
+        LazyComputation.__init__(self, [l.reads for l in loops],
+                                 [l.writes for l in loops])
+        self._loops = loops
+        self._tiling = Tiling(loops, configuration['tile_size'])
+
+    def _run(self):
+        # Chains are only tiled on a single process, where there are no
+        # halos to exchange and reductions are no-ops, so only the partitions
+        # of the iteration set are executed for each tile
+        for loop in self._loops:
+            loop.maybe_set_dat_dirty()
+        for tile in self._tiling.tile_loops(self._loops):
+            for loop in tile:
+                # Buffers of Globals and Consts may have been replaced
+                loop._update_buffers()
+                loop._compute_if_not_empty(loop.it_space.iterset.core_part)
+                loop._compute_if_not_empty(loop.it_space.iterset.owned_part)
+        for loop in self._loops:
+            loop.maybe_set_halo_update_needed()
+
+
+class MatrixFreeMat(DataCarrier):
+
+    """OP2 matrix-free operator. A ``MatrixFreeMat`` maps a :class:`Dat` on
+    its column :class:`DataSet` to a :class:`Dat` on its row
+    :class:`DataSet` without assembling any matrix entries: applying it
+    executes a :class:`Kernel` over an iteration :class:`Set`, which reads
+    the input :class:`Dat` and increments the zeroed output :class:`Dat`.
+    Neither a :class:`Sparsity` is built nor values stored, which pays off
+    when assembling the matrix costs more than solving with it, as for high
+    order discretisations.
+
+    The arguments of the :func:`pyop2.op2.par_loop` applying the operator
+    are given by a function ``args``, called with the input :class:`Dat`
+    ``x`` and the output :class:`Dat` ``y``. For instance, the action of a
+    mass matrix on ``x`` is given by::
+
+     A = MatrixFreeMat((nodes, nodes), mass_action, elements,
+                       lambda x, y: [y(pyop2.INC, elem_node[pyop2.i[0]]),
+                                     x(pyop2.READ, elem_node),
+                                     coords(pyop2.READ, elem_node)])
+
+    A ``MatrixFreeMat`` can be multiplied with a :class:`Dat` and passed to
+    :meth:`Solver.solve` in place of a :class:`Mat`. Since its entries are
+    not available to precondition with, a :class:`Dat` holding the diagonal
+    of the operator may be given as ``diagonal``, which is required for
+    Jacobi preconditioning."""
+
+    _globalcount = 0
+
+    @validate_type(('kernel', Kernel, KernelTypeError),
+                   ('iterset', Set, SetTypeError),
+                   ('name', str, NameTypeError))
+    def __init__(self, dsets, kernel, iterset, args, diagonal=None, dtype=None, name=None):
+        dsets = as_tuple([s ** 1 if isinstance(s, Set) else s for s in as_tuple(dsets, length=2)],
+                         DataSet, 2)
+        if diagonal is not None and diagonal.dataset != dsets[0]:
+            raise DataSetTypeError("Diagonal must be defined on the row DataSet")
+        self._dsets = dsets
+        self._kernel = kernel
+        self._iterset = iterset
+        self._args = args
+        self._diagonal = diagonal
+        self._datatype = np.dtype(dtype)
+        self._name = name or "matrix_free_mat_%d" % MatrixFreeMat._globalcount
+        MatrixFreeMat._globalcount += 1
+
+    @property
+    def dsets(self):
+        """A pair of :class:`DataSet`\s for the rows and columns of the
+        operator."""
+        return self._dsets
+
+    @property
+    def diagonal(self):
+        """:class:`Dat` holding the diagonal of the operator, or None."""
+        return self._diagonal
+
+    @property
+    def dtype(self):
+        """The Python type of the data."""
+        return self._datatype
+
+    def __iter__(self):
+        """Yield self when iterated over."""
+        yield self
+
+    @collective
+    def _apply(self, x, y):
+        """Apply this operator to the :class:`Dat` ``x``, writing the result
+        to the :class:`Dat` ``y``."""
+        y.zero()
+        par_loop(self._kernel, self._iterset, *self._args(x, y))
+
+    @collective
+    def __mul__(self, v):
+        """Multiply this :class:`MatrixFreeMat` with the :class:`Dat` ``v``."""
+        if not isinstance(v, Dat) or isinstance(v, MixedDat):
+            raise TypeError("Can only multiply MatrixFreeMat and Dat.")
+        if v.dataset != self._dsets[1]:
+            raise DataSetTypeError("Dat must be defined on the column DataSet")
+        y = _make_object('Dat', self._dsets[0], dtype=self.dtype)
+        self._apply(v, y)
+        return y
+
+    def __str__(self):
+        return "OP2 MatrixFreeMat: %s, kernel %s over %s, datatype %s" \
+               % (self._name, self._kernel.name, self._iterset, self._datatype.name)
+
+    def __repr__(self):
+        return "MatrixFreeMat(%r, %r, %r, %r, %r, %r, %r)" \
+               % (self._dsets, self._kernel, self._iterset, self._args,
+                  self._diagonal, self._datatype, self._name)
+
+
 DEFAULT_SOLVER_PARAMETERS = {'ksp_type': 'cg',
                              'pc_type': 'jacobi',
                              'ksp_rtol': 1.0e-7,
@@ -3250,7 +4357,8 @@ class Solver(object):
     def solve(self, A, x, b):
         """Solve a matrix equation.
 
-        :arg A: The :class:`Mat` containing the matrix.
+        :arg A: The :class:`Mat` containing the matrix, or the
+            :class:`MatrixFreeMat` applying it.
         :arg x: The :class:`Dat` to receive the solution.
         :arg b: The :class:`Dat` containing the RHS.
         """
@@ -3264,3 +4372,8 @@ class Solver(object):
 @collective
 def par_loop(kernel, it_space, *args):
     return _make_object('ParLoop', kernel, it_space, *args).enqueue()
+
+
+@collective
+def prepare_par_loop(kernel, it_space, *args):
+    return _make_object('ParLoop', kernel, it_space, *args)
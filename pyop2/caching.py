@@ -112,9 +112,20 @@ class KernelCached(Cached):
 
     def __new__(cls, *args, **kwargs):
         args, kwargs = cls._process_args(*args, **kwargs)
+        if not isinstance(args[0], Node):
+            return super(KernelCached, cls).__new__(cls, *args, **kwargs)
+        # Look up the kernel by the structure of its AST first, so that the
+        # AST is only optimised and translated to C code on a cache miss
+        key = cls._cache_key(*args, **kwargs)
+        try:
+            return cls._cache_lookup(key)
+        except KeyError:
+            pass
         code = cls._ast_to_c(*args, **kwargs)
         args = (code,) + args[1:]
         obj = super(KernelCached, cls).__new__(cls, *args, **kwargs)
+        if key:
+            cls._cache_store(key, obj)
         return obj
 
     @classmethod
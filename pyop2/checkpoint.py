@@ -0,0 +1,225 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Parallel checkpointing of OP2 data to HDF5 files and restarting from them.
+
+A checkpoint stores each :class:`Dat`, :class:`Map` and :class:`Global` as
+an HDF5 dataset named after it, whose rows are indexed by the global number
+of the :class:`Set` element they belong to. All ranks write their owned rows
+concurrently with MPI-IO, so nothing is gathered to any one process. A
+restart reads the rows of the local elements by global number.
+
+Global element numbers which do not depend on the decomposition, e.g. the
+numbers of the mesh entities before partitioning, can be given for each
+:class:`Set` in a ``numbering``. A restart using the same numbering
+redistributes the data to whatever decomposition the objects restarted were
+built with. Sets without one are numbered by rank, in which case a restart
+needs the same decomposition as the checkpoint and is rejected if the
+number of processes differs.
+
+In parallel this requires h5py built against a parallel HDF5 library.
+"""
+
+import numpy as np
+import h5py
+
+from base import Dat, Global, Map, MixedDat
+from logger import progress, INFO
+from mpi import MPI, _MPI, collective
+from utils import hdf5_read
+
+
+def _numbering(s, numbering):
+    """Return the global numbers of the elements of the :class:`Set` ``s``,
+    the global size of the set and whether the numbers are independent of
+    the decomposition, i.e. given in ``numbering``."""
+    nglobal = MPI.comm.allreduce(s.size)
+    if numbering is not None and s in numbering:
+        numbers = np.asarray(numbering[s])
+        if len(numbers) < s.size or numbers.size and \
+                (numbers.min() < 0 or numbers.max() >= nglobal):
+            raise ValueError("Numbering of %s needs to number its elements from 0 to %d"
+                             % (s, nglobal - 1))
+        return numbers, nglobal, True
+    # Only the owned elements are numbered, in rank order
+    return (MPI.comm.exscan(s.size) or 0) + np.arange(s.size), nglobal, False
+
+
+def _check_numbering(slot, independent):
+    """Check that the dataset ``slot`` was numbered the same way as the
+    object restarted from it and, if numbered by rank, written by the same
+    number of processes."""
+    size = slot.attrs.get('comm_size')
+    if independent != (size is None) or size is not None and size != MPI.comm.size:
+        raise ValueError("Cannot restart %s on this decomposition" % slot.name)
+
+
+@collective
+def _write_rows(slot, rows, values):
+    """Write ``values`` to the ``rows`` of the HDF5 dataset ``slot``."""
+    order = np.argsort(rows)
+    rows = rows[order]
+    values = values[order]
+    contiguous = len(rows) == 0 or rows[-1] - rows[0] + 1 == len(rows)
+    # A collective write has to be made by all ranks, so they need to agree
+    # on whether to make one
+    if MPI.parallel and MPI.comm.allreduce(contiguous, op=_MPI.LAND):
+        start = rows[0] if len(rows) else 0
+        with slot.collective:
+            slot[start:start + len(rows)] = values
+        return
+    # Otherwise write each contiguous range of rows independently
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    for a, b in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(rows)]))):
+        if b > a:
+            slot[rows[a]:rows[b - 1] + 1] = values[a:b]
+
+
+def _open(filename, mode):
+    if MPI.parallel:
+        if not h5py.get_config().mpi:
+            raise RuntimeError("Parallel checkpointing requires h5py built with MPI support")
+        return h5py.File(filename, mode, driver='mpio', comm=MPI.comm)
+    return h5py.File(filename, mode)
+
+
+@collective
+def checkpoint(filename, objects, numbering=None, chunks=True, compression=None):
+    """Write the :class:`Dat`\s, :class:`Map`\s and :class:`Global`\s in
+    ``objects`` to the HDF5 file ``filename``.
+
+    :arg filename: the file to write, which is overwritten if it exists
+    :arg objects: an iterable of :class:`Dat`\s, :class:`Map`\s and
+        :class:`Global`\s, which need to have distinct names
+    :arg numbering: a dict of the global numbers of the elements of each
+        :class:`Set`, which do not depend on the decomposition, numbering
+        the elements of all ranks from 0. The numbers of the owned elements
+        are needed, those of the halo elements only to restart a
+        :class:`Map` on the :class:`Set`.
+    :arg chunks: the chunk shape of the datasets, or True to let HDF5 choose
+    :arg compression: the compression filter of the datasets (e.g.
+        ``'gzip'``). Writing compressed datasets in parallel requires
+        HDF5 1.10.2 or later.
+    """
+    objects = list(objects)
+    names = [o.name for o in objects]
+    if len(set(names)) != len(names):
+        raise ValueError("Objects to checkpoint need distinct names")
+    with progress(INFO, 'Writing checkpoint %s' % filename):
+        with _open(filename, 'w') as f:
+            for o in objects:
+                if isinstance(o, MixedDat):
+                    raise TypeError("Cannot checkpoint MixedDat %s, checkpoint its components" % o.name)
+                if isinstance(o, Global):
+                    # Creating datasets is collective, writing small ones is not
+                    slot = f.create_dataset(o.name, o.shape, o.dtype)
+                    if MPI.comm.rank == 0:
+                        slot[...] = o.data_ro
+                    continue
+                if isinstance(o, Dat):
+                    s, values = o.dataset.set, o.data_ro
+                    values_independent = True
+                elif isinstance(o, Map):
+                    s = o.iterset
+                    # Store the global numbers of the elements mapped to
+                    tonumbers, _, values_independent = _numbering(o.toset, numbering)
+                    if o.values.size and o.values.max() >= len(tonumbers):
+                        raise ValueError("Map %s maps to unnumbered elements" % o.name)
+                    values = tonumbers[o.values]
+                else:
+                    raise TypeError("Cannot checkpoint %r" % o)
+                numbers, nglobal, rows_independent = _numbering(s, numbering)
+                shape = (nglobal,) + values.shape[1:]
+                slot = f.create_dataset(o.name, shape, values.dtype,
+                                        chunks=chunks if nglobal > 0 else None,
+                                        compression=compression)
+                if isinstance(o, Dat):
+                    # Readable by Dat.fromhdf5
+                    slot.attrs['type'] = o.ctype + (':soa' if o.soa else '')
+                if not (values_independent and rows_independent):
+                    # Only restartable on the same decomposition
+                    slot.attrs['comm_size'] = MPI.comm.size
+                _write_rows(slot, numbers[:s.size], values)
+
+
+@collective
+def restart(filename, objects, numbering=None):
+    """Read the :class:`Dat`\s, :class:`Map`\s and :class:`Global`\s in
+    ``objects`` from the checkpoint ``filename`` written by
+    :func:`checkpoint`, in place.
+
+    The objects need to be defined on :class:`Set`\s of the same global
+    size as when checkpointed. They may be distributed differently if the
+    checkpoint was written with a ``numbering`` of the :class:`Set`\s and the
+    same numbering is given here. The halos of restarted :class:`Dat`\s are
+    marked as out of date.
+
+    :arg filename: the file to read
+    :arg objects: an iterable of :class:`Dat`\s, :class:`Map`\s and
+        :class:`Global`\s, which are read from the datasets of the same name.
+        Restart :class:`Map`\s before building any :class:`Sparsity` from
+        them.
+    :arg numbering: a dict of the global numbers of the elements of each
+        :class:`Set` as passed to :func:`checkpoint`. The numbers of the
+        halo elements are needed to restart a :class:`Map` in parallel.
+    """
+    with progress(INFO, 'Reading checkpoint %s' % filename):
+        with _open(filename, 'r') as f:
+            for o in objects:
+                slot = f[o.name]
+                if isinstance(o, Global):
+                    o.data = slot[...]
+                    continue
+                if isinstance(o, Dat):
+                    numbers, nglobal, independent = _numbering(o.dataset.set, numbering)
+                    _check_numbering(slot, independent)
+                    if slot.shape[0] != nglobal:
+                        raise ValueError("Dat %s has %d rows, expected %d"
+                                         % (o.name, slot.shape[0], nglobal))
+                    o.data[:] = hdf5_read(slot, numbers[:o.dataset.size])
+                elif isinstance(o, Map):
+                    numbers, nglobal, independent = _numbering(o.iterset, numbering)
+                    tonumbers, _, to_independent = _numbering(o.toset, numbering)
+                    _check_numbering(slot, independent and to_independent)
+                    if slot.shape[0] != nglobal or len(numbers) < o.iterset.total_size:
+                        raise ValueError("Cannot restart Map %s on this decomposition" % o.name)
+                    values = hdf5_read(slot, numbers[:o.iterset.total_size])
+                    # Translate global numbers of the elements mapped to
+                    # back to local numbers
+                    order = np.argsort(tonumbers)
+                    local = order[np.searchsorted(tonumbers[order], values).clip(0, len(order) - 1)]
+                    if (tonumbers[local] != values).any():
+                        raise ValueError("Map %s maps to elements not in the local toset" % o.name)
+                    o.values_with_halo[:] = local
+                else:
+                    raise TypeError("Cannot restart %r" % o)
@@ -53,6 +53,34 @@ class Configuration(object):
     :param lazy_max_trace_length: How many :func:`par_loop`\s
         should be queued lazily before forcing evaluation?  Pass
         `0` for an unbounded length.
+    :param loop_fusion: Should consecutive compatible :func:`par_loop`\s
+        in the lazy trace be fused into a single loop when the trace is
+        evaluated?
+    :param loop_tiling: Should chains of :func:`par_loop`\s in the lazy
+        trace containing indirect loops be executed tile by tile
+        (sparse tiling)?
+    :param tile_size: How many iterations of the first loop of a chain
+        should make up a tile?
+    :param cache_dir: Where should compiled kernels be cached on disk?
+    :param compile_in_background: Should kernels be compiled in
+        background processes as soon as a :func:`par_loop` is queued
+        lazily?
+    :param partition_cache_size: How many bytes of data should a block
+        of an OpenMP parallel loop access at most (e.g. the size of the
+        L2 cache)?
+    :param coloring: Which algorithm should be used to colour plans,
+        ``greedy`` or ``jones_plassmann`` (largest degree first)?
+    :param plan_disk_cache: Should plans be stored in and loaded from
+        ``cache_dir``, keyed on the values of the maps?
+    :param dat_op_numpy_size: Up to how many values may a :class:`Dat`
+        without a halo hold for pointwise arithmetic on it to be done in
+        place with NumPy rather than by a generated :func:`par_loop`?
+        Ignored if ``loop_fusion`` is on in lazy mode.
+    :param soa_layout: Should direct :func:`par_loop`\s on the host
+        backends access SoA :class:`Dat`\s through a transposed copy of
+        their data, if these :class:`Dat`\s are mostly accessed directly?
+        The copy is only transposed back when the data are next needed
+        in AoS format.
     :param dump_gencode: Should PyOP2 write the generated code
         somewhere for inspection?
     :param dump_gencode_path: Where should the generated code be
@@ -67,6 +95,17 @@ class Configuration(object):
         "log_level": ("PYOP2_LOG_LEVEL", (str, int), "WARNING"),
         "lazy_evaluation": ("PYOP2_LAZY", bool, True),
         "lazy_max_trace_length": ("PYOP2_MAX_TRACE_LENGTH", int, 0),
+        "loop_fusion": ("PYOP2_LOOP_FUSION", bool, False),
+        "loop_tiling": ("PYOP2_LOOP_TILING", bool, False),
+        "tile_size": ("PYOP2_TILE_SIZE", int, 1024),
+        "cache_dir": ("PYOP2_CACHE_DIR", str,
+                      os.path.join(gettempdir(), "pyop2-cache")),
+        "compile_in_background": ("PYOP2_COMPILE_IN_BACKGROUND", bool, False),
+        "partition_cache_size": ("PYOP2_PARTITION_CACHE_SIZE", int, 256 * 1024),
+        "coloring": ("PYOP2_COLORING", str, "greedy"),
+        "plan_disk_cache": ("PYOP2_PLAN_DISK_CACHE", bool, False),
+        "dat_op_numpy_size": ("PYOP2_DAT_OP_NUMPY_SIZE", int, 4096),
+        "soa_layout": ("PYOP2_SOA_LAYOUT", bool, False),
         "dump_gencode": ("PYOP2_DUMP_GENCODE", bool, False),
         "dump_gencode_path": ("PYOP2_DUMP_GENCODE_PATH", str,
                               os.path.join(gettempdir(), "pyop2-gencode")),
@@ -237,12 +237,9 @@ class Dat(DeviceDataMixin, base.Dat):
             raise ValueError("operands could not be broadcast together with shapes %s, %s"
                              % (self.shape, other.shape))
 
-    def halo_exchange_begin(self):
-        if self.dataset.halo is None:
-            return
+    def _halo_exchange_prepare(self):
         maybe_setflags(self._data, write=True)
         self._from_device()
-        super(Dat, self).halo_exchange_begin()
 
     def halo_exchange_end(self):
         if self.dataset.halo is None:
@@ -322,6 +319,14 @@ class Mat(base.Mat):
         self.state = DeviceDataMixin.DEVICE_UNALLOCATED
 
 
+class MatrixFreeMat(base.MatrixFreeMat):
+
+    def __init__(self, *args, **kwargs):
+        # Matrix-free operators are applied by PETSc shell matrices, which
+        # the device backends do not provide
+        raise MatTypeError("MatrixFreeMat is not supported on device backends")
+
+
 class ParLoop(base.ParLoop):
 
     def __init__(self, kernel, itspace, *args):
@@ -34,12 +34,21 @@
 """Base classes extending those from the :mod:`base` module with functionality
 common to backends executing on the host."""
 
+import atexit
+import cPickle
+from hashlib import md5
+import os
+import sys
+from subprocess import Popen, STDOUT
+from tempfile import mkstemp
 from textwrap import dedent
 
 import base
 from base import *
 from configuration import configuration
+from exceptions import CompilationError
 from logger import progress, INFO
+from mpi import MPI, collective
 from utils import as_tuple
 
 from ir.ast_base import Node
@@ -50,6 +59,17 @@ from ir.ast_vectorizer import vect_roundup
 
 class Kernel(base.Kernel):
 
+    @classmethod
+    def _cache_key(cls, code, name, opts={}):
+        key = super(Kernel, cls)._cache_key(code, name, opts)
+        if isinstance(code, Node):
+            # The code generated from an AST depends on the instruction set
+            # and compiler the vectoriser targets
+            vect = ((ir.ast_vectorizer.intrinsics or {}).get('inst_set'),
+                    (ir.ast_vectorizer.compiler or {}).get('name'))
+            key = md5(key + str(vect)).hexdigest()
+        return key
+
     @classmethod
     def _ast_to_c(cls, ast, name, opts={}):
         """Transform an Abstract Syntax Tree representing the kernel into a
@@ -63,6 +83,22 @@ class Kernel(base.Kernel):
 
 class Arg(base.Arg):
 
+    @property
+    def _is_blocked_mat(self):
+        """Is this a flattened :class:`Mat` argument inserted into a block AIJ
+        matrix a whole local tensor at a time?"""
+        return self._is_mat and self._flatten and self.data._is_blocked
+
+    @property
+    def _is_csr_mat(self):
+        """Is this a :class:`Mat` argument whose local tensor is added
+        straight to the CSR values of the matrix at the cached insertion
+        offsets of its :class:`Sparsity`, bypassing ``MatSetValues``? That is
+        the case for scalar fields which are not extruded in serial, where
+        PETSc shares the values of the matrix with us."""
+        return self._is_mat and not self._is_mixed and self.data._is_scalar_field and \
+            MPI.comm.size == 1 and all(m.iterset.layers == 1 for m in self.map)
+
     def c_arg_name(self, i=0, j=None):
         name = self.name
         if self._is_indirect and not (self._is_vec_map or self._uses_itspace):
@@ -96,6 +132,9 @@ class Arg(base.Arg):
             for i, map in enumerate(as_tuple(self.map, Map)):
                 for j, m in enumerate(map):
                     val += ", PyObject *_%s" % (self.c_map_name(i, j))
+        if self._is_csr_mat:
+            val += ", PyObject *_%(name)s_array, PyObject *_%(name)s_offsets" % \
+                {'name': self.c_arg_name()}
         return val
 
     def c_vec_dec(self):
@@ -105,7 +144,7 @@ class Arg(base.Arg):
              'vec_name': self.c_vec_name(),
              'arity': self.map.arity * cdim}
 
-    def c_wrapper_dec(self):
+    def c_wrapper_dec(self, vec_dec=True):
         if self._is_mixed_mat:
             val = "Mat %(name)s = (Mat)((uintptr_t)PyLong_AsUnsignedLong(_%(name)s))" % \
                 {"name": self.c_arg_name()}
@@ -129,16 +168,26 @@ class Arg(base.Arg):
                 for j in range(len(map)):
                     val += ";\nint *%(name)s = (int *)(((PyArrayObject *)_%(name)s)->data)" \
                         % {'name': self.c_map_name(i, j)}
-        if self._is_vec_map:
+        if self._is_csr_mat:
+            val += ";\n%(t)s *%(name)s_array = (%(t)s *)(((PyArrayObject *)_%(name)s_array)->data)" \
+                % {'name': self.c_arg_name(), 't': self.data.ctype}
+            val += ";\nint *%(name)s_offsets = (int *)(((PyArrayObject *)_%(name)s_offsets)->data)" \
+                % {'name': self.c_arg_name()}
+        if self._is_vec_map and vec_dec:
             val += self.c_vec_dec()
         return val
 
-    def c_ind_data(self, idx, i, j=0):
-        return "%(name)s + %(map_name)s[i * %(arity)s + %(idx)s] * %(dim)s%(off)s" % \
+    def c_ind_data(self, idx, i, j=0, layer=False):
+        if layer:
+            entry = "(%(map_name)s[i * %(arity)s + %(idx)s] + j_0 * _%(layer_off)s[%(idx)s])"
+        else:
+            entry = "%(map_name)s[i * %(arity)s + %(idx)s]"
+        return ("%(name)s + " + entry + " * %(dim)s%(off)s") % \
             {'name': self.c_arg_name(i),
              'map_name': self.c_map_name(i, 0),
              'arity': self.map.split[i].arity,
              'idx': idx,
+             'layer_off': self.c_offset_name(i, 0),
              'dim': self.data.split[i].cdim,
              'off': ' + %d' % j if j else ''}
 
@@ -160,7 +209,7 @@ class Arg(base.Arg):
     def c_local_tensor_name(self, i, j):
         return self.c_kernel_arg_name(i, j)
 
-    def c_kernel_arg(self, count, i=0, j=0, shape=(0,)):
+    def c_kernel_arg(self, count, i=0, j=0, shape=(0,), soa=False):
         if self._uses_itspace:
             if self._is_mat:
                 if self.data._is_vector_field:
@@ -191,11 +240,14 @@ class Arg(base.Arg):
             return self.c_global_reduction_name(count)
         elif isinstance(self.data, Global):
             return self.c_arg_name(i)
+        elif soa and self._is_soa:
+            # Components of element i are op2stride apart, see OP2_STRIDE
+            return "%(name)s + i" % {'name': self.c_arg_name(i)}
         else:
             return "%(name)s + i * %(dim)s" % {'name': self.c_arg_name(i),
                                                'dim': self.data.cdim}
 
-    def c_vec_init(self):
+    def c_vec_init(self, layer=False):
         val = []
         if self._flatten:
             for d in range(self.data.dataset.cdim):
@@ -203,14 +255,14 @@ class Arg(base.Arg):
                     val.append("%(vec_name)s[%(idx)s] = %(data)s" %
                                {'vec_name': self.c_vec_name(),
                                 'idx': d * self.map.arity + idx,
-                                'data': self.c_ind_data(idx, 0, d)})
+                                'data': self.c_ind_data(idx, 0, d, layer)})
         else:
             for i, rng in enumerate(zip(self.map.arange[:-1], self.map.arange[1:])):
                 for mi, idx in enumerate(range(*rng)):
                     val.append("%(vec_name)s[%(idx)s] = %(data)s" %
                                {'vec_name': self.c_vec_name(),
                                 'idx': idx,
-                                'data': self.c_ind_data(mi, i)})
+                                'data': self.c_ind_data(mi, i, 0, layer)})
         return ";\n".join(val)
 
     def c_addto_scalar_field(self, i, j, buf_name, extruded=None):
@@ -233,6 +285,65 @@ class Arg(base.Arg):
              'cols': cols_str,
              'insert': self.access == WRITE}
 
+    def c_addto_csr(self, i, j, buf_name):
+        """Add the local tensor straight to the CSR values of the matrix at
+        the insertion offsets of the current element."""
+        maps = as_tuple(self.map, Map)
+        nrows = maps[0].split[i].arity
+        ncols = maps[1].split[j].arity
+        return """{
+  int *%(offsets)s = %(name)s_offsets + i * %(size)d;
+  for (int b_0 = 0; b_0 < %(nrows)d; ++b_0) {
+    for (int b_1 = 0; b_1 < %(ncols)d; ++b_1) {
+      %(name)s_array[%(offsets)s[b_0 * %(ncols)d + b_1]] %(op)s %(vals)s[b_0][b_1];
+    }
+  }
+}""" % {'name': self.c_arg_name(),
+            'offsets': "offsets_" + buf_name,
+            'size': nrows * ncols,
+            'nrows': nrows,
+            'ncols': ncols,
+            'op': '=' if self.access == WRITE else '+=',
+            'vals': buf_name}
+
+    def c_addto_blocked(self, i, j, buf_name, extruded=None):
+        """Insert the flattened local tensor of a vector field into a block
+        AIJ matrix with a single call. The local tensor is ordered by
+        component and then by node, so it is first permuted into the node
+        major order expected by ``MatSetValuesBlocked``."""
+        maps = as_tuple(self.map, Map)
+        nrows = maps[0].split[i].arity
+        ncols = maps[1].split[j].arity
+        rmult, cmult = self.data.sparsity[i, j].dims
+        rows_str = "%s + i * %s" % (self.c_map_name(0, i), nrows)
+        cols_str = "%s + i * %s" % (self.c_map_name(1, j), ncols)
+
+        if extruded is not None:
+            rows_str = extruded + self.c_map_name(0, i)
+            cols_str = extruded + self.c_map_name(1, j)
+
+        return """{
+  %(t)s %(blocked)s[%(rsize)d][%(csize)d];
+  for (int b_0 = 0; b_0 < %(rsize)d; ++b_0) {
+    for (int b_1 = 0; b_1 < %(csize)d; ++b_1) {
+      %(blocked)s[(b_0 %% %(nrows)d) * %(rmult)d + b_0 / %(nrows)d][(b_1 %% %(ncols)d) * %(cmult)d + b_1 / %(ncols)d] = %(vals)s[b_0][b_1];
+    }
+  }
+  addto_blocked(%(mat)s, %(blocked)s, %(nrows)s, %(rows)s, %(ncols)s, %(cols)s, %(insert)d);
+}""" % {'t': self.data.ctype,
+            'blocked': "blocked_" + buf_name,
+            'rsize': nrows * rmult,
+            'csize': ncols * cmult,
+            'rmult': rmult,
+            'cmult': cmult,
+            'mat': self.c_arg_name(i, j),
+            'vals': buf_name,
+            'nrows': nrows,
+            'ncols': ncols,
+            'rows': rows_str,
+            'cols': cols_str,
+            'insert': self.access == WRITE}
+
     def c_addto_vector_field(self, i, j, xtr=""):
         maps = as_tuple(self.map, Map)
         nrows = maps[0].split[i].arity
@@ -302,33 +413,6 @@ class Arg(base.Arg):
         else:
             raise RuntimeError("Don't know how to zero temp array for %s" % self)
 
-    def c_add_offset_flatten(self):
-        cdim = np.prod(self.data.cdim)
-        val = []
-        for (k, offset), arity in zip(enumerate(self.map.arange[:-1]), self.map.arities):
-            for idx in range(cdim):
-                for i in range(arity):
-                    val.append("%(name)s[%(j)d] += _%(offset)s[%(i)d] * %(dim)s;" %
-                               {'name': self.c_vec_name(),
-                                'i': i,
-                                'j': offset + idx * arity + i,
-                                'offset': self.c_offset_name(k, 0),
-                                'dim': cdim})
-        return '\n'.join(val)+'\n'
-
-    def c_add_offset(self):
-        cdim = np.prod(self.data.cdim)
-        val = []
-        for (k, offset), arity in zip(enumerate(self.map.arange[:-1]), self.map.arities):
-            for i in range(arity):
-                val.append("%(name)s[%(j)d] += _%(offset)s[%(i)d] * %(dim)s;" %
-                           {'name': self.c_vec_name(),
-                            'i': i,
-                            'j': offset + i,
-                            'offset': self.c_offset_name(k, 0),
-                            'dim': cdim})
-        return '\n'.join(val)+'\n'
-
     # New globals generation which avoids false sharing.
     def c_intermediate_globals_decl(self, count):
         return "%(type)s %(name)s_l%(count)s[1][%(dim)s]" % \
@@ -392,8 +476,9 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
             for j, m in enumerate(map):
                 for idx in range(m.arity):
                     for k in range(cdim):
-                        val.append("xtr_%(name)s[%(ind_flat)s] = %(dat_dim)s * (*(%(name)s + i * %(dim)s + %(ind)s))%(offset)s;" %
+                        val.append("xtr_%(name)s[%(ind_flat)s] = %(dat_dim)s * (*(%(name)s + i * %(dim)s + %(ind)s) + j_0 * _%(off)s[%(ind)s])%(offset)s;" %
                                    {'name': self.c_map_name(i, j),
+                                    'off': self.c_offset_name(i, j),
                                     'dim': m.arity,
                                     'ind': idx,
                                     'dat_dim': str(cdim),
@@ -407,21 +492,22 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
         for i, map in enumerate(maps):
             for j, m in enumerate(map):
                 for idx in range(m.arity):
-                    val.append("xtr_%(name)s[%(ind)s] = *(%(name)s + i * %(dim)s + %(ind)s);" %
+                    val.append("xtr_%(name)s[%(ind)s] = *(%(name)s + i * %(dim)s + %(ind)s) + j_0 * _%(off)s[%(ind)s];" %
                                {'name': self.c_map_name(i, j),
+                                'off': self.c_offset_name(i, j),
                                 'dim': m.arity,
                                 'ind': idx})
         return '\n'.join(val)+'\n'
 
-    def c_map_bcs(self, top_bottom, layers, sign):
+    def c_map_bcs(self, top_bottom, layers):
         maps = as_tuple(self.map, Map)
         val = []
         if top_bottom is None:
             return ""
 
         # To throw away boundary condition values, we subtract a large
-        # value from the map to make it negative then add it on later to
-        # get back to the original
+        # value from the map to make it negative; the map is recomputed
+        # from the base values at the start of every layer
         max_int = 10000000
         if top_bottom[0]:
             # We need to apply the bottom bcs
@@ -429,11 +515,10 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
             for i, map in enumerate(maps):
                 for j, m in enumerate(map):
                     for idx in range(m.arity):
-                        val.append("xtr_%(name)s[%(ind)s] %(sign)s= %(val)s;" %
+                        val.append("xtr_%(name)s[%(ind)s] -= %(val)s;" %
                                    {'name': self.c_map_name(i, j),
                                     'val': max_int if m.bottom_mask[idx] < 0 else 0,
-                                    'ind': idx,
-                                    'sign': sign})
+                                    'ind': idx})
             val.append("}")
 
         if top_bottom[1]:
@@ -442,42 +527,13 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
             for i, map in enumerate(maps):
                 for j, m in enumerate(map):
                     for idx in range(m.arity):
-                        val.append("xtr_%(name)s[%(ind)s] %(sign)s= %(val)s;" %
+                        val.append("xtr_%(name)s[%(ind)s] -= %(val)s;" %
                                    {'name': self.c_map_name(i, j),
                                     'val': max_int if m.top_mask[idx] < 0 else 0,
-                                    'ind': idx,
-                                    'sign': sign})
+                                    'ind': idx})
             val.append("}")
         return '\n'.join(val)+'\n'
 
-    def c_add_offset_map_flatten(self):
-        cdim = np.prod(self.data.cdim)
-        maps = as_tuple(self.map, Map)
-        val = []
-        for i, map in enumerate(maps):
-            for j, m in enumerate(map):
-                for idx in range(m.arity):
-                    for k in range(cdim):
-                        val.append("xtr_%(name)s[%(ind_flat)s] += _%(off)s[%(ind)s] * %(dim)s;" %
-                                   {'name': self.c_map_name(i, j),
-                                    'off': self.c_offset_name(i, j),
-                                    'ind': idx,
-                                    'ind_flat': str(m.arity * k + idx),
-                                    'dim': str(cdim)})
-        return '\n'.join(val)+'\n'
-
-    def c_add_offset_map(self):
-        maps = as_tuple(self.map, Map)
-        val = []
-        for i, map in enumerate(maps):
-            for j, m in enumerate(map):
-                for idx in range(m.arity):
-                    val.append("xtr_%(name)s[%(ind)s] += _%(off)s[%(ind)s];" %
-                               {'name': self.c_map_name(i, j),
-                                'off': self.c_offset_name(i, j),
-                                'ind': idx})
-        return '\n'.join(val)+'\n'
-
     def c_offset_init(self):
         maps = as_tuple(self.map, Map)
         val = []
@@ -534,12 +590,72 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
                            for o in range(dim)])
 
 
+_builds = []
+
+# Build the module pickled to the file given as argument with instant, such
+# that it ends up in the disk cache
+_build_script = """
+import cPickle
+import os
+import sys
+from instant import inline_with_numpy
+with open(sys.argv[1], 'rb') as f:
+    code, kwargs = cPickle.load(f)
+os.remove(sys.argv[1])
+inline_with_numpy(code, **kwargs)
+"""
+
+
+def _build_in_background(code, kwargs):
+    """Start building a module with instant in a fresh Python interpreter,
+    which does not inherit the MPI state of this process, and return the
+    :class:`subprocess.Popen` object of the build. At most one build per
+    CPU runs at a time."""
+    from multiprocessing import cpu_count
+    _builds[:] = [b for b in _builds if b.poll() is None]
+    while len(_builds) >= cpu_count():
+        _builds.pop(0).wait()
+    fd, name = mkstemp(suffix='.pickle')
+    with os.fdopen(fd, 'wb') as f:
+        cPickle.dump((code, kwargs), f, cPickle.HIGHEST_PROTOCOL)
+    # The built module is imported, which needs to find PETSc
+    env = dict(os.environ, CC='mpicc')
+    env['LD_LIBRARY_PATH'] = os.pathsep.join(kwargs['library_dirs'] +
+                                             [env.get('LD_LIBRARY_PATH', '')])
+    with open(os.devnull, 'w') as devnull:
+        build = Popen([sys.executable, '-c', _build_script, name],
+                      stdout=devnull, stderr=STDOUT, close_fds=True, env=env)
+    _builds.append(build)
+    return build
+
+
+@atexit.register
+def _wait_for_builds():
+    """Wait for background builds to finish, such that no partially built
+    modules are left in the disk cache."""
+    for build in _builds:
+        build.wait()
+    del _builds[:]
+
+
 class JITModule(base.JITModule):
 
     _cppargs = []
     _system_headers = []
     _libraries = []
 
+    @classmethod
+    def _cache_key(cls, kernel, itspace, *args, **kwargs):
+        key = super(JITModule, cls)._cache_key(kernel, itspace, *args, **kwargs)
+        if itspace.layers > 1:
+            # Whether the layer loop is independent depends on which
+            # arguments access the same data through the same Map, see
+            # :attr:`_layers_independent`
+            key += tuple((next(i for i, b in enumerate(args) if b.data is a.data),
+                          next(i for i, b in enumerate(args) if b.map is a.map))
+                         for a in args)
+        return key
+
     def __init__(self, kernel, itspace, *args, **kwargs):
         # No need to protect against re-initialization since these attributes
         # are not expensive to set and won't be used if we hit cache
@@ -547,21 +663,98 @@ class JITModule(base.JITModule):
         self._itspace = itspace
         self._args = args
         self._direct = kwargs.get('direct', False)
+        self._soa = kwargs.get('soa', False)
+
+    @property
+    def _layers_independent(self):
+        """Whether the iterations of the layer loop over a column of an
+        extruded iteration set are independent: nothing is added to a
+        :class:`Mat` or reduced into a :class:`Global`, and every written
+        :class:`Dat` is reached through an iteration space index into a
+        :class:`Map` whose layers touch disjoint entries (see
+        :attr:`Map._layers_disjoint`), and which is the only :class:`Map`
+        any argument accesses that :class:`Dat` through."""
+        for arg in self._args:
+            if arg._is_mat or arg._is_global_reduction:
+                return False
+            if arg._is_dat and arg.access is not READ:
+                if not arg._uses_itspace or not arg.map._layers_disjoint:
+                    return False
+                # Another layer may access the entries written through a
+                # different Map
+                if any(a._is_dat and a.data is arg.data and a.map is not arg.map
+                       for a in self._args):
+                    return False
+        return True
 
     def __call__(self, *args):
         return self.compile()(*args)
 
+    def compile_async(self):
+        """Start compiling this module in a background process. A later call
+        to :meth:`compile` waits for the build to finish and loads the module
+        from the disk cache."""
+        if hasattr(self, '_fun') or hasattr(self, '_pending') or \
+                configuration["debug"] or MPI.comm.rank != 0:
+            return
+        code_to_compile, kwargs = self._build_args()
+        self._pending = _build_in_background(code_to_compile, kwargs)
+
     def compile(self):
         if hasattr(self, '_fun'):
             return self._fun
         from instant import inline_with_numpy
+        code_to_compile, kwargs = self._build_args()
+        # We need to build with mpicc since that's required by PETSc
+        cc = os.environ.get('CC')
+        os.environ['CC'] = 'mpicc'
+        try:
+            with progress(INFO, 'Compiling kernel %s', self._kernel.name):
+                if configuration["debug"]:
+                    self._fun = inline_with_numpy(code_to_compile, **kwargs)
+                elif MPI.comm.rank == 0:
+                    # Only rank 0 compiles, all other ranks wait and load the
+                    # module from the disk cache
+                    try:
+                        if hasattr(self, '_pending'):
+                            # A failed build is repeated below, raising
+                            # the compilation error in this process
+                            self._pending.wait()
+                        self._fun = inline_with_numpy(code_to_compile, **kwargs)
+                    finally:
+                        MPI.comm.bcast(hasattr(self, '_fun'), root=0)
+                else:
+                    if not MPI.comm.bcast(None, root=0):
+                        raise CompilationError("Compiling kernel %s failed on rank 0"
+                                               % self._kernel.name)
+                    self._fun = inline_with_numpy(code_to_compile, **kwargs)
+        finally:
+            if cc:
+                os.environ['CC'] = cc
+            else:
+                os.environ.pop('CC')
+        return self._fun
+
+    def _build_args(self):
+        """Generate the code for this module and the keyword arguments to
+        build it with instant."""
+        if hasattr(self, '_build'):
+            return self._build
         strip = lambda code: '\n'.join([l for l in code.splitlines()
                                         if l.strip() and l.strip() != ';'])
 
         compiler = ir.ast_vectorizer.compiler
         vect_flag = compiler.get(ir.ast_vectorizer.intrinsics.get('inst_set')) if compiler else None
 
-        if any(arg._is_soa for arg in self._args):
+        if self._soa:
+            kernel_code = """
+            #define OP2_STRIDE(a, idx) a[op2stride * (idx)]
+            %(header)s
+            %(code)s
+            #undef OP2_STRIDE
+            """ % {'code': self._kernel.code,
+                   'header': compiler.get('vect_header') if vect_flag else ""}
+        elif any(arg._is_soa for arg in self._args):
             kernel_code = """
             #define OP2_STRIDE(a, idx) a[idx]
             %(header)s
@@ -581,35 +774,44 @@ class JITModule(base.JITModule):
 
         _const_decs = '\n'.join([const._format_declaration()
                                 for const in Const._definitions()]) + '\n'
+        if self._soa:
+            _const_decs += 'static int op2stride;\n'
 
         self._dump_generated_code(code_to_compile)
-        # We need to build with mpicc since that's required by PETSc
-        cc = os.environ.get('CC')
-        os.environ['CC'] = 'mpicc'
         if configuration["debug"]:
             extra_cppargs = ['-O0', '-g']
         elif vect_flag:
             extra_cppargs = [vect_flag]
         else:
             extra_cppargs = []
-        with progress(INFO, 'Compiling kernel %s', self._kernel.name):
-            self._fun = inline_with_numpy(
-                code_to_compile, additional_declarations=kernel_code,
-                additional_definitions=_const_decs + kernel_code,
-                cppargs=self._cppargs + extra_cppargs,
-                include_dirs=[d + '/include' for d in get_petsc_dir()],
-                source_directory=os.path.dirname(os.path.abspath(__file__)),
-                wrap_headers=["mat_utils.h"],
-                system_headers=self._system_headers,
-                library_dirs=[d + '/lib' for d in get_petsc_dir()],
-                libraries=['petsc'] + self._libraries,
-                sources=["mat_utils.cxx"],
-                modulename=self._kernel.name if configuration["debug"] else None)
-        if cc:
-            os.environ['CC'] = cc
+        kwargs = {'additional_declarations': kernel_code,
+                  'additional_definitions': _const_decs + kernel_code,
+                  'cppargs': self._cppargs + extra_cppargs,
+                  'include_dirs': [d + '/include' for d in get_petsc_dir()],
+                  'source_directory': os.path.dirname(os.path.abspath(__file__)),
+                  'wrap_headers': ["mat_utils.h"],
+                  'system_headers': self._system_headers,
+                  'library_dirs': [d + '/lib' for d in get_petsc_dir()],
+                  'libraries': ['petsc'] + self._libraries,
+                  'sources': ["mat_utils.cxx"]}
+        if configuration["debug"]:
+            kwargs['modulename'] = self._kernel.name
         else:
-            os.environ.pop('CC')
-        return self._fun
+            # Compiled modules are cached on disk, keyed on everything
+            # which goes into building them
+            kwargs['signature'] = self._disk_cache_key(code_to_compile, kwargs)
+            kwargs['cache_dir'] = configuration["cache_dir"]
+        self._build = code_to_compile, kwargs
+        return self._build
+
+    def _disk_cache_key(self, code, kwargs):
+        """Compute the key of the compiled module in the disk cache from the
+        wrapper ``code`` and the ``kwargs`` passed to instant."""
+        src = os.path.dirname(os.path.abspath(__file__))
+        files = ''.join(open(os.path.join(src, f)).read()
+                        for f in kwargs['sources'] + kwargs['wrap_headers'])
+        return md5(code + files + version + 'mpicc' +
+                   str(sorted(kwargs.iteritems()))).hexdigest()
 
     def generate_code(self):
 
@@ -630,6 +832,12 @@ class JITModule(base.JITModule):
         def extrusion_loop():
             if self._direct:
                 return "{"
+            # Every layer addresses its data through maps computed from the
+            # column base and the layer index, so if no written entry is
+            # shared between layers the compiler may vectorise the loop
+            compiler = ir.ast_vectorizer.compiler
+            if compiler and compiler.get('ivdep') and self._layers_independent:
+                return compiler['ivdep'] + "\nfor (int j_0=0; j_0<layer-1; ++j_0){"
             return "for (int j_0=0; j_0<layer-1; ++j_0){"
 
         _ssinds_arg = ""
@@ -642,7 +850,11 @@ class JITModule(base.JITModule):
 
         _wrapper_args = ', '.join([arg.c_wrapper_arg() for arg in self._args])
 
-        _wrapper_decs = ';\n'.join([arg.c_wrapper_dec() for arg in self._args])
+        # The arrays of pointers of vector maps in an extruded loop are
+        # declared in the body of the layer loop so that no layer reuses
+        # storage written by another
+        layered = self._itspace.layers > 1
+        _wrapper_decs = ';\n'.join([arg.c_wrapper_dec(vec_dec=not layered) for arg in self._args])
 
         if len(Const._defs) > 0:
             _const_args = ', '
@@ -650,6 +862,11 @@ class JITModule(base.JITModule):
         else:
             _const_args = ''
         _const_inits = ';\n'.join([c_const_init(c) for c in Const._definitions()])
+        if self._soa:
+            # The number of elements of the iteration set, including the
+            # halo, separating the components of SoA arguments
+            _const_args += ', PyObject *_op2stride'
+            _const_inits += ';\nop2stride = (int)PyInt_AsLong(_op2stride)'
 
         _intermediate_globals_decl = ';\n'.join(
             [arg.c_intermediate_globals_decl(count)
@@ -664,18 +881,19 @@ class JITModule(base.JITModule):
              for count, arg in enumerate(self._args)
              if arg._is_global_reduction])
 
-        _vec_inits = ';\n'.join([arg.c_vec_init() for arg in self._args
-                                 if not arg._is_mat and arg._is_vec_map])
+        _vec_inits = [arg.c_vec_init(layered) for arg in self._args
+                      if not arg._is_mat and arg._is_vec_map]
+        if layered:
+            _vec_inits = [arg.c_vec_dec().lstrip(';\n') for arg in self._args
+                          if not arg._is_mat and arg._is_vec_map] + _vec_inits
+        _vec_inits = ';\n'.join(_vec_inits)
 
         indent = lambda t, i: ('\n' + '  ' * i).join(t.split('\n'))
 
-        _map_decl = ""
-        _apply_offset = ""
         _map_init = ""
         _extr_loop = ""
         _extr_loop_close = ""
         _map_bcs_m = ""
-        _map_bcs_p = ""
         _layer_arg = ""
         _layer_arg_init = ""
         if self._itspace.layers > 1:
@@ -686,26 +904,18 @@ class JITModule(base.JITModule):
                                  if arg._uses_itspace or arg._is_vec_map])
             _off_inits = ';\n'.join([arg.c_offset_decl() for arg in self._args
                                      if arg._uses_itspace or arg._is_vec_map])
-            _map_decl += ';\n'.join([arg.c_map_decl_itspace() for arg in self._args
+            # The extruded maps are declared in the body of the layer loop
+            # so that no layer reuses storage written by another
+            _map_init += ';\n'.join([arg.c_map_decl_itspace() for arg in self._args
                                      if arg._uses_itspace and not arg._is_mat])
-            _map_decl += ';\n'.join([arg.c_map_decl() for arg in self._args
+            _map_init += ';\n'.join([arg.c_map_decl() for arg in self._args
                                      if arg._is_mat])
             _map_init += ';\n'.join([arg.c_map_init_flattened() for arg in self._args
                                      if arg._uses_itspace and arg._flatten and not arg._is_mat])
             _map_init += ';\n'.join([arg.c_map_init() for arg in self._args
                                      if arg._uses_itspace and (not arg._flatten or arg._is_mat)])
-            _map_bcs_m += ';\n'.join([arg.c_map_bcs(a_bcs, self._itspace.layers, "-") for arg in self._args
-                                     if not arg._flatten and arg._is_mat])
-            _map_bcs_p += ';\n'.join([arg.c_map_bcs(a_bcs, self._itspace.layers, "+") for arg in self._args
+            _map_bcs_m += ';\n'.join([arg.c_map_bcs(a_bcs, self._itspace.layers) for arg in self._args
                                      if not arg._flatten and arg._is_mat])
-            _apply_offset += ';\n'.join([arg.c_add_offset_map_flatten() for arg in self._args
-                                         if arg._uses_itspace and arg._flatten and not arg._is_mat])
-            _apply_offset += ';\n'.join([arg.c_add_offset_map() for arg in self._args
-                                         if arg._uses_itspace and (not arg._flatten or arg._is_mat)])
-            _apply_offset += ';\n'.join([arg.c_add_offset_flatten() for arg in self._args
-                                         if arg._is_vec_map and arg._flatten])
-            _apply_offset += ';\n'.join([arg.c_add_offset() for arg in self._args
-                                         if arg._is_vec_map and not arg._flatten])
             _extr_loop = '\n' + extrusion_loop()
             _extr_loop_close = '}\n'
         else:
@@ -751,7 +961,7 @@ class JITModule(base.JITModule):
                 _buf_gather = arg.c_buffer_gather(_buf_size, count, _buf_name)
                 _itspace_loop_close = '\n'.join('  ' * n + '}' for n in range(len(_buf_size) - 1, -1, -1))
                 _buf_gather = "\n".join([_itspace_loops, _buf_gather, _itspace_loop_close])
-        _kernel_args = ', '.join([arg.c_kernel_arg(count) if not arg._uses_itspace else _buf_decl[arg][0]
+        _kernel_args = ', '.join([arg.c_kernel_arg(count, soa=self._soa) if not arg._uses_itspace else _buf_decl[arg][0]
                                   for count, arg in enumerate(self._args)])
         _buf_decl = ";\n".join([decl for name, decl in _buf_decl.values()])
 
@@ -776,16 +986,22 @@ class JITModule(base.JITModule):
             _addto_buf_name = _buf_scatter_name or _buf_name
             if self._itspace.layers > 1:
                 _addtos_scalar_field_extruded = ';\n'.join([arg.c_addto_scalar_field(i, j, _addto_buf_name, "xtr_") for arg in self._args
-                                                            if arg._is_mat and arg.data._is_scalar_field])
+                                                            if arg._is_mat and arg.data._is_scalar_field] +
+                                                           [arg.c_addto_blocked(i, j, _addto_buf_name, "xtr_") for arg in self._args
+                                                            if arg._is_blocked_mat])
                 _addtos_vector_field = ';\n'.join([arg.c_addto_vector_field(i, j, "xtr_") for arg in self._args
-                                                  if arg._is_mat and arg.data._is_vector_field])
+                                                  if arg._is_mat and arg.data._is_vector_field and not arg._is_blocked_mat])
                 _addtos_scalar_field = ""
             else:
                 _addtos_scalar_field_extruded = ""
                 _addtos_scalar_field = ';\n'.join([arg.c_addto_scalar_field(i, j, _addto_buf_name) for count, arg in enumerate(self._args)
-                                                   if arg._is_mat and arg.data._is_scalar_field])
+                                                   if arg._is_mat and arg.data._is_scalar_field and not arg._is_csr_mat] +
+                                                  [arg.c_addto_csr(i, j, _addto_buf_name) for arg in self._args
+                                                   if arg._is_csr_mat] +
+                                                  [arg.c_addto_blocked(i, j, _addto_buf_name) for arg in self._args
+                                                   if arg._is_blocked_mat])
                 _addtos_vector_field = ';\n'.join([arg.c_addto_vector_field(i, j) for arg in self._args
-                                                  if arg._is_mat and arg.data._is_vector_field])
+                                                  if arg._is_mat and arg.data._is_vector_field and not arg._is_blocked_mat])
 
             if not _addtos_vector_field and not _buf_scatter:
                 _itspace_loops = ''
@@ -809,8 +1025,6 @@ class JITModule(base.JITModule):
                 'addtos_vector_field': indent(_addtos_vector_field, 2 + nloops),
                 'itspace_loop_close': indent(_itspace_loop_close, 2),
                 'addtos_scalar_field_extruded': indent(_addtos_scalar_field_extruded, 2 + nloops),
-                'apply_offset': indent(_apply_offset, 3),
-                'extr_loop_close': indent(_extr_loop_close, 2),
                 'addtos_scalar_field': indent(_addtos_scalar_field, 2)
             }
 
@@ -827,12 +1041,9 @@ class JITModule(base.JITModule):
                 'off_inits': indent(_off_inits, 1),
                 'layer_arg': _layer_arg,
                 'layer_arg_init': indent(_layer_arg_init, 1),
-                'map_decl': indent(_map_decl, 2),
                 'map_init': indent(_map_init, 5),
-                'apply_offset': indent(_apply_offset, 3),
                 'extr_loop': indent(_extr_loop, 5),
                 'map_bcs_m': indent(_map_bcs_m, 5),
-                'map_bcs_p': indent(_map_bcs_p, 5),
                 'extr_loop_close': indent(_extr_loop_close, 2),
                 'interm_globals_decl': indent(_intermediate_globals_decl, 3),
                 'interm_globals_init': indent(_intermediate_globals_init, 3),
@@ -845,3 +1056,56 @@ class JITModule(base.JITModule):
                 'layout_loop_close': _layout_loops_close,
                 'kernel_args': _kernel_args,
                 'itset_loop_body': '\n'.join([itset_loop_body(i, j, shape, offsets) for i, j, shape, offsets in self._itspace])}
+
+
+class ParLoop(base.ParLoop):
+
+    @property
+    def _soa_layout(self):
+        """Should this parallel loop access its SoA :class:`Dat` arguments
+        through their transposed copies? This is the case for direct loops
+        if every such :class:`Dat` has mostly been accessed directly, see
+        :attr:`Dat._prefers_soa`. The choice is made once, when the loop
+        is first compiled or executed."""
+        if not hasattr(self, '_soa'):
+            soa = [arg for arg in self.args if arg._is_soa]
+            self._soa = configuration["soa_layout"] and bool(soa) and \
+                self.is_direct and not self.is_layered and \
+                all(len(arg.data) == 1 and arg.data._prefers_soa for arg in soa)
+        return self._soa
+
+    def _jit_arg_data(self, arg, d):
+        if self._soa_layout and arg._is_soa:
+            return d._soa_data
+        return d._data
+
+    @property
+    def _soa_stride(self):
+        """The number of elements, including the halo, separating the
+        components of the transposed SoA arguments."""
+        return next(arg.data.dataset.total_size for arg in self.args if arg._is_soa)
+
+    @collective
+    def compute(self):
+        # Profile how the Dats are accessed to choose their layout
+        for arg in self.args:
+            if arg._is_dat:
+                for d in arg.data:
+                    d._layout_profile[0 if arg._is_direct else 1] += 1
+        soa = [arg.data for arg in self.args if arg._is_soa] if self._soa_layout else []
+        for arg in self.args:
+            if arg._is_dat:
+                for d in arg.data:
+                    if not any(d is s for s in soa):
+                        d._to_aos()
+        for d in soa:
+            d._to_soa()
+        base.ParLoop.compute(self)
+        # Only the layout the loop has written is up to date
+        for arg in self.args:
+            if arg._is_dat and arg.access is not READ:
+                for d in arg.data:
+                    if any(d is s for s in soa):
+                        d._aos_valid = False
+                    else:
+                        d._soa_valid = False
@@ -62,6 +62,14 @@ class Node(object):
             code += n.gencode() + "\n"
         return code
 
+    def signature(self):
+        """Return a string identifying the structure of the tree rooted at
+        this node: the class and the attributes of each node. Unlike the
+        code returned by :meth:`gencode`, it can be computed before the tree
+        is transformed, and thus serve as a cache key for the result."""
+        attrs = ",".join("%s=%s" % (k, _signature(v)) for k, v in sorted(vars(self).items()))
+        return "%s(%s)" % (self.__class__.__name__, attrs)
+
 
 class Root(Node):
 
@@ -520,6 +528,15 @@ class PreprocessNode(Node):
 # Utility functions ###
 
 
+def _signature(value):
+    """Return the signature of an attribute of a node of the AST."""
+    if isinstance(value, Node):
+        return value.signature()
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ",".join(_signature(v) for v in value)
+    return repr(value)
+
+
 def indent(block):
     """Indent each row of the given string block with n*2 spaces."""
     indentation = " " * 2
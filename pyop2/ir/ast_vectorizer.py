@@ -514,8 +514,10 @@ def _init_compiler(compiler):
 
     if compiler == 'intel':
         return {
+            'name': 'intel',
             'align': lambda o: '__attribute__((aligned(%s)))' % o,
             'decl_aligned_for': '#pragma vector aligned',
+            'ivdep': '#pragma ivdep',
             'AVX': '-xAVX',
             'SSE': '-xSSE',
             'vect_header': '#include <immintrin.h>'
@@ -523,8 +525,10 @@ def _init_compiler(compiler):
 
     if compiler == 'gnu':
         return {
+            'name': 'gnu',
             'align': lambda o: '__attribute__((aligned(%s)))' % o,
             'decl_aligned_for': '#pragma vector aligned',
+            'ivdep': '#pragma GCC ivdep',
             'AVX': '-mavx',
             'SSE': '-msse',
             'vect_header': '#include <immintrin.h>'
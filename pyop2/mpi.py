@@ -61,6 +61,7 @@ class MPIConfig(object):
 
     def __init__(self):
         self.COMM = _MPI.COMM_WORLD
+        self._ntags = 0
 
     @property
     def parallel(self):
@@ -80,6 +81,19 @@ class MPIConfig(object):
         .. note:: The communicator must be of type :py:class:`mpi4py.MPI.Comm`
         or implement a method :py:meth:`tompi4py` to be converted to one."""
         self.COMM = _check_comm(comm)
+        self._ntags = 0
+
+    @collective
+    def next_tag(self):
+        """Draw a new tag for point-to-point messages over the communicator.
+
+        Tags are drawn from a single counter per communicator, such that
+        concurrent communications set up by different objects never match
+        each other's messages. All ranks need to draw tags in the same
+        order."""
+        tag = self._ntags
+        self._ntags = (tag + 1) % self.COMM.Get_attr(_MPI.TAG_UB)
+        return tag
 
     def rank_zero(self, f):
         """Decorator for executing a function only on MPI rank zero."""
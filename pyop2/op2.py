@@ -49,8 +49,8 @@ __all__ = ['configuration', 'READ', 'WRITE', 'RW', 'INC', 'MIN', 'MAX',
            'i', 'debug', 'info', 'warning', 'error', 'critical', 'initialised',
            'set_log_level', 'MPI', 'init', 'exit', 'Kernel', 'Set', 'MixedSet',
            'Subset', 'DataSet', 'MixedDataSet', 'Halo', 'Dat', 'MixedDat',
-           'Mat', 'Const', 'Global', 'Map', 'MixedMap', 'Sparsity', 'Solver',
-           'par_loop', 'solve']
+           'Mat', 'MatrixFreeMat', 'Const', 'Global', 'Map', 'MixedMap',
+           'Sparsity', 'Solver', 'par_loop', 'prepare_par_loop', 'solve']
 
 
 def initialised():
@@ -160,6 +160,10 @@ class Mat(base.Mat):
     __metaclass__ = backends._BackendSelector
 
 
+class MatrixFreeMat(base.MatrixFreeMat):
+    __metaclass__ = backends._BackendSelector
+
+
 class Const(base.Const):
     __metaclass__ = backends._BackendSelector
 
@@ -241,7 +245,29 @@ def par_loop(kernel, iterset, *args):
 
 
 @collective
-@validate_type(('M', base.Mat, MatTypeError),
+def prepare_par_loop(kernel, iterset, *args):
+    """Prepare a :func:`par_loop` for repeated execution without queueing it.
+
+    Takes the same arguments as :func:`par_loop` and returns the parallel
+    loop, which is queued for execution every time it is called. The argument
+    vector passed to the generated code and the execution plan are reused
+    between calls, which makes executing the same loop many times, e.g. in a
+    time loop, cheap. ::
+
+      update = pyop2.prepare_par_loop(kernel, cells, q(pyop2.RW), res(pyop2.READ))
+      for t in range(nsteps):
+          update()
+
+    The loop may also be called with new arguments of the same structure as
+    the ones it was prepared with, i.e. built from data of the same shape
+    and type, accessed through maps of the same arity with the same index
+    and access descriptor.
+    """
+    return backends._BackendSelector._backend.prepare_par_loop(kernel, iterset, *args)
+
+
+@collective
+@validate_type(('M', (base.Mat, base.MatrixFreeMat), MatTypeError),
                ('x', base.Dat, DatTypeError),
                ('b', base.Dat, DatTypeError))
 def solve(M, x, b):
@@ -263,6 +263,10 @@ class Mat(device.Mat, petsc_base.Mat, DeviceDataMixin):
 
     """OP2 OpenCL matrix data type."""
 
+    # Matrices are assembled on the device into the values of a scalar AIJ
+    # matrix shared with PETSc
+    _is_blocked = False
+
     def _allocate_device(self):
         if self.state is DeviceDataMixin.DEVICE_UNALLOCATED:
             self._dev_array = array.empty(_queue,
@@ -36,7 +36,10 @@
 import os
 import numpy as np
 import math
+from multiprocessing import cpu_count
 
+from caching import Cached
+from configuration import configuration
 from exceptions import *
 from utils import *
 from petsc_base import *
@@ -51,6 +54,13 @@ from subprocess import Popen, PIPE
 _max_threads = 32
 # cache line padding
 _padding = 8
+# smallest number of elements in a block of a parallel loop
+_min_partition_size = 64
+
+
+def _num_threads():
+    """Number of OpenMP threads executing a parallel loop."""
+    return min(int(os.environ.get('OMP_NUM_THREADS', cpu_count())), _max_threads)
 
 
 def _detect_openmp_flags():
@@ -167,7 +177,6 @@ void wrap_%(kernel_name)s__(PyObject* _boffset,
 
   #pragma omp parallel shared(boffset, nblocks, nelems, blkmap)
   {
-    %(map_decl)s
     int tid = omp_get_thread_num();
     %(interm_globals_decl)s;
     %(interm_globals_init)s;
@@ -181,9 +190,9 @@ void wrap_%(kernel_name)s__(PyObject* _boffset,
       for (int n = efirst; n < efirst+ nelem; n++ )
       {
         int i = %(index_expr)s;
+        %(extr_loop)s
         %(vec_inits)s;
         %(map_init)s;
-        %(extr_loop)s
         %(map_bcs_m)s;
         %(buffer_decl)s;
         %(buffer_gather)s
@@ -193,8 +202,6 @@ void wrap_%(kernel_name)s__(PyObject* _boffset,
             %(layout_assign)s;
         %(layout_loop_close)s
         %(itset_loop_body)s;
-        %(map_bcs_p)s;
-        %(apply_offset)s;
         %(extr_loop_close)s
       }
     }
@@ -222,10 +229,40 @@ void wrap_%(kernel_name)s__(PyObject* _boffset,
         return code_dict
 
 
+class FakePlan(Cached):
+
+    """Plan for direct loops, splitting the iteration set into blocks of
+    consecutive elements, all of which can be executed in parallel."""
+
+    _cache = {}
+
+    @classmethod
+    def _cache_key(cls, part, partition_size):
+        return (part.offset, part.size, partition_size)
+
+    def __init__(self, part, partition_size):
+        # Return early if we got a cached object
+        if self._initialized:
+            return
+        self.nblocks = int(math.ceil(part.size / float(partition_size)))
+        self.ncolors = 1
+        self.ncolblk = np.array([self.nblocks], dtype=np.int32)
+        self.blkmap = np.arange(self.nblocks, dtype=np.int32)
+        self.nelems = np.array([min(partition_size, part.size - i * partition_size) for i in range(self.nblocks)],
+                               dtype=np.int32)
+        self.offset = np.arange(part.offset, part.offset + part.size, partition_size, dtype=np.int32)
+        self._initialized = True
+
+
 class ParLoop(device.ParLoop, host.ParLoop):
 
+    @property
+    def _jitmodule(self):
+        return JITModule(self.kernel, self.it_space, *self.args,
+                         direct=self.is_direct, soa=self._soa_layout)
+
     def _compute(self, part):
-        fun = JITModule(self.kernel, self.it_space, *self.args, direct=self.is_direct)
+        fun = self._jitmodule
         if not hasattr(self, '_jit_args'):
             self._jit_args = [None] * 5
             if isinstance(self._it_space._iterset, Subset):
@@ -237,7 +274,7 @@ class ParLoop(device.ParLoop, host.ParLoop):
                     for d in arg.data:
                         # Cannot access a property of the Dat or we will force
                         # evaluation of the trace
-                        self._jit_args.append(d._data)
+                        self._jit_args.append(self._jit_arg_data(arg, d))
 
                 if arg._is_indirect or arg._is_mat:
                     maps = as_tuple(arg.map, Map)
@@ -245,17 +282,23 @@ class ParLoop(device.ParLoop, host.ParLoop):
                         for m in map:
                             self._jit_args.append(m.values_with_halo)
 
+                if arg._is_csr_mat:
+                    self._jit_args.append(arg.data._array)
+                    self._jit_args.append(arg.data.sparsity._insertion_offsets(*arg.map))
+
             for c in Const._definitions():
                 self._jit_args.append(c.data)
 
+            if self._soa_layout:
+                self._jit_args.append(self._soa_stride)
+
             # offset_args returns an empty list if there are none
             self._jit_args.extend(self.offset_args)
 
             self._jit_args.extend(self.layer_arg)
 
         if part.size > 0:
-            #TODO: compute partition size
-            plan = self._get_plan(part, 1024)
+            plan = self._get_plan(part, self._partition_size(part))
             self._jit_args[2] = plan.blkmap
             self._jit_args[3] = plan.offset
             self._jit_args[4] = plan.nelems
@@ -269,29 +312,54 @@ class ParLoop(device.ParLoop, host.ParLoop):
                 boffset += nblocks
 
     def _get_plan(self, part, part_size):
+        # Plans are kept with the loop, such that executing it again skips
+        # the plan cache lookup
+        if not hasattr(self, '_plans'):
+            self._plans = {}
+        key = (part.offset, part.size, part_size)
+        if key not in self._plans:
+            self._plans[key] = self._build_plan(part, part_size)
+        return self._plans[key]
+
+    def _build_plan(self, part, part_size):
         if self._is_indirect:
-            plan = _plan.Plan(part,
+            return _plan.Plan(part,
                               *self._unwound_args,
                               partition_size=part_size,
                               matrix_coloring=True,
                               staging=False,
                               thread_coloring=False)
-        else:
-            # TODO:
-            # Create the fake plan according to the number of cores available
-            class FakePlan(object):
-
-                def __init__(self, part, partition_size):
-                    self.nblocks = int(math.ceil(part.size / float(partition_size)))
-                    self.ncolors = 1
-                    self.ncolblk = np.array([self.nblocks], dtype=np.int32)
-                    self.blkmap = np.arange(self.nblocks, dtype=np.int32)
-                    self.nelems = np.array([min(partition_size, part.size - i * partition_size) for i in range(self.nblocks)],
-                                           dtype=np.int32)
-                    self.offset = np.arange(part.offset, part.offset + part.size, partition_size, dtype=np.int32)
-
-            plan = FakePlan(part, part_size)
-        return plan
+        return FakePlan(part, part_size)
+
+    def _partition_size(self, part):
+        """Pick the number of elements of a block such that the data
+        accessed by a block fits in ``partition_cache_size`` bytes, but
+        there are still enough blocks to balance the load between threads."""
+        size = configuration['partition_cache_size'] // max(self._bytes_per_element, 1)
+        # Several blocks per thread, such that each colour of an indirect
+        # loop still has work for all threads
+        size = min(size, -(-part.size // (4 * _num_threads())))
+        return max(size, _min_partition_size)
+
+    @property
+    def _bytes_per_element(self):
+        """Number of bytes of data and map entries accessed per iteration."""
+        if not hasattr(self, '_nbytes'):
+            self._nbytes = 0
+            for arg in self.args:
+                if arg._is_mat:
+                    self._nbytes += sum(m.arity for maps in arg.map for m in maps) * 4
+                elif arg._is_dat:
+                    if arg._is_direct:
+                        entries = 1
+                    elif arg.idx is None or arg._uses_itspace:
+                        entries = sum(m.arity for m in arg.map)
+                        self._nbytes += entries * 4
+                    else:
+                        entries = 1
+                        self._nbytes += 4
+                    self._nbytes += sum(d.cdim * d.dtype.itemsize for d in arg.data) * entries
+        return self._nbytes
 
     @property
     def _requires_matrix_coloring(self):
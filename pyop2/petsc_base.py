@@ -86,11 +86,16 @@ class Dat(base.Dat):
         acc = (lambda d: d.data_ro) if readonly else (lambda d: d.data)
         # Getting the Vec needs to ensure we've done all current computation.
         self._force_evaluation()
+        # The accessor brings the data up to date every time, even if the
+        # Vec wrapping them has been created before
+        data = acc(self)
         if not hasattr(self, '_vec'):
             size = (self.dataset.size * self.cdim, None)
-            self._vec = PETSc.Vec().createWithArray(acc(self), size=size)
+            self._vec = PETSc.Vec().createWithArray(data, size=size)
         yield self._vec
         if not readonly:
+            # The data have been written, the SoA copy is stale
+            self._soa_valid = False
             self.needs_halo_update = True
 
     @property
@@ -229,8 +234,45 @@ class Mat(base.Mat):
         mat.createNest([[m.handle for m in row] for row in self._blocks])
         self._handle = mat
 
+    @property
+    def _is_blocked(self):
+        """Is this a block AIJ matrix, with one block per pair of row and
+        column nodes? That is the case for vector fields with square blocks,
+        since PETSc only supports square blocks."""
+        rdim, cdim = self.sparsity.dims
+        return self.sparsity.shape == (1, 1) and rdim == cdim > 1
+
     def _init_block(self):
         self._blocks = [[self]]
+        if self._is_blocked:
+            self._init_baij()
+        else:
+            self._init_aij()
+
+    def _init_baij(self):
+        mat = PETSc.Mat()
+        dim = self.sparsity.dims[0]
+        if MPI.comm.size == 1:
+            # The PETSc local to global mapping is the identity in the sequential case
+            row_lg = PETSc.LGMap().create(
+                indices=np.arange(self.sparsity.nrows, dtype=PETSc.IntType), bsize=dim)
+            col_lg = PETSc.LGMap().create(
+                indices=np.arange(self.sparsity.ncols, dtype=PETSc.IntType), bsize=dim)
+            mat.createBAIJ((self.sparsity.nrows * dim, self.sparsity.ncols * dim), dim,
+                           csr=(self.sparsity._block_rowptr, self.sparsity._block_colidx))
+        else:
+            # The global_to_petsc_numbering of the halo is a blocked map
+            row_lg = PETSc.LGMap().create(indices=self.sparsity.rmaps[
+                0].toset.halo.global_to_petsc_numbering, bsize=dim)
+            col_lg = PETSc.LGMap().create(indices=self.sparsity.cmaps[
+                0].toset.halo.global_to_petsc_numbering, bsize=dim)
+            mat.createBAIJ(size=((self.sparsity.nrows * dim, None),
+                                 (self.sparsity.ncols * dim, None)),
+                           bsize=dim,
+                           nnz=(self.sparsity._block_d_nnz, self.sparsity._block_o_nnz))
+        self._init_handle(mat, row_lg, col_lg)
+
+    def _init_aij(self):
         mat = PETSc.Mat()
         row_lg = PETSc.LGMap()
         col_lg = PETSc.LGMap()
@@ -242,32 +284,30 @@ class Mat(base.Mat):
             col_lg.create(
                 indices=np.arange(self.sparsity.ncols * cdim, dtype=PETSc.IntType))
             self._array = np.zeros(self.sparsity.nz, dtype=PETSc.RealType)
-            # We're not currently building a blocked matrix, so need to scale the
-            # number of rows and columns by the sparsity dimensions
-            # FIXME: This needs to change if we want to do blocked sparse
+            # This is not a blocked matrix, so need to scale the number of
+            # rows and columns by the sparsity dimensions
             # NOTE: using _rowptr and _colidx since we always want the host values
             mat.createAIJWithArrays(
                 (self.sparsity.nrows * rdim, self.sparsity.ncols * cdim),
                 (self.sparsity._rowptr, self.sparsity._colidx, self._array))
         else:
-            # FIXME: probably not right for vector fields
             # We get the PETSc local to global mapping from the halo
             row_lg.create(indices=self.sparsity.rmaps[
                           0].toset.halo.global_to_petsc_numbering)
             col_lg.create(indices=self.sparsity.cmaps[
                           0].toset.halo.global_to_petsc_numbering)
-            # PETSc has utility for turning a local to global map into
-            # a blocked one and vice versa, if rdim or cdim are > 1,
-            # the global_to_petsc_numbering we have is a blocked map,
-            # however, we can't currently generate the correct code
-            # for that case, so build the unblocked map and use that.
-            # This is a temporary fix until we do things properly.
+            # If rdim or cdim are > 1, the global_to_petsc_numbering we
+            # have is a blocked map. Since the blocks of this matrix are
+            # not square, it is not blocked, so unblock the map.
             row_lg = row_lg.unblock(rdim)
             col_lg = col_lg.unblock(cdim)
 
             mat.createAIJ(size=((self.sparsity.nrows * rdim, None),
                                 (self.sparsity.ncols * cdim, None)),
                           nnz=(self.sparsity.nnz, self.sparsity.onnz))
+        self._init_handle(mat, row_lg, col_lg)
+
+    def _init_handle(self, mat, row_lg, col_lg):
         mat.setLGMap(rmap=row_lg, cmap=col_lg)
         # Do not stash entries destined for other processors, just drop them
         # (we take care of those in the halo)
@@ -382,7 +422,9 @@ class Mat(base.Mat):
         # Now that we've filled up the sparsity pattern, we can ignore
         # zero entries for MatSetValues calls.
         # Do not create a zero location when adding a zero value
-        self._handle.setOption(self._handle.Option.IGNORE_ZERO_ENTRIES, True)
+        # (block AIJ matrices do not support this option)
+        if not self._is_blocked:
+            self._handle.setOption(self._handle.Option.IGNORE_ZERO_ENTRIES, True)
         self.handle.assemble()
 
     @property
@@ -394,10 +436,17 @@ class Mat(base.Mat):
 
     @property
     def array(self):
-        """Array of non-zero values."""
-        if not hasattr(self, '_array'):
+        """Array of non-zero values. For a block AIJ matrix, which does not
+        share its values with us, this is a read-only copy of the values in
+        the order of the scalar sparsity."""
+        if not hasattr(self, '_handle'):
             self._init()
         base._trace.evaluate(set([self]), set())
+        if self._is_blocked:
+            # Writes to the copy would be lost
+            values = self.handle.getValuesCSR()[2]
+            values.setflags(write=False)
+            return values
         return self._array
 
     @property
@@ -434,6 +483,47 @@ class Mat(base.Mat):
         dat.needs_halo_update = True
         return dat
 
+
+class MatrixFreeMat(base.MatrixFreeMat):
+
+    """OP2 matrix-free operator, applied by a PETSc shell matrix whose
+    multiplication executes the operator's :class:`Kernel`."""
+
+    @property
+    def handle(self):
+        """Petsc4py shell Mat applying this operator."""
+        if not hasattr(self, '_handle'):
+            if not self.dtype == PETSc.ScalarType:
+                raise RuntimeError("Can only create a matrix of type %s, %s is not supported"
+                                   % (PETSc.ScalarType, self.dtype))
+            rset, cset = self.dsets
+            # Work Dats through which the Vecs PETSc multiplies with are
+            # passed to the par_loop
+            self._x = _make_object('Dat', cset, dtype=self.dtype)
+            self._y = _make_object('Dat', rset, dtype=self.dtype)
+            mat = PETSc.Mat()
+            mat.createPython(((rset.size * rset.cdim, None), (cset.size * cset.cdim, None)),
+                             context=self)
+            mat.setUp()
+            self._handle = mat
+        return self._handle
+
+    @collective
+    def mult(self, mat, x, y):
+        """Compute ``y = A x`` for :class:`PETSc.Vec`\s ``x`` and ``y``.
+        Called by PETSc."""
+        self._x.data[:] = x.array_r.reshape(self._x.data.shape)
+        self._apply(self._x, self._y)
+        y.array[:] = self._y.data_ro.reshape(-1)
+
+    @collective
+    def getDiagonal(self, mat, d):
+        """Copy the diagonal of the operator to the :class:`PETSc.Vec`
+        ``d``. Called by PETSc."""
+        if self.diagonal is None:
+            raise MatTypeError("Diagonal of MatrixFreeMat %s is not known" % self.name)
+        d.array[:] = self.diagonal.data_ro.reshape(-1)
+
 # FIXME: Eventually (when we have a proper OpenCL solver) this wants to go in
 # sequential
 
@@ -474,6 +564,10 @@ class Solver(base.Solver, PETSc.KSP):
     def _solve(self, A, x, b):
         self.setOperators(A.handle)
         self._set_parameters()
+        if isinstance(A, base.MatrixFreeMat) and A.diagonal is None:
+            # There are no entries of a matrix-free operator to
+            # precondition with
+            self.getPC().setType(PETSc.PC.Type.NONE)
         if self.parameters['plot_convergence']:
             self.reshist = []
 
@@ -36,11 +36,15 @@ Cython implementation of the Plan construction.
 """
 
 import base
+from configuration import configuration
+from hashlib import md5
+import os
+from exceptions import ConfigurationError
 from utils import align, as_tuple
 import math
 import numpy
 cimport numpy
-from libc.stdlib cimport malloc, free
+cimport cython
 try:
     from collections import OrderedDict
 # OrderedDict was added in Python 2.7. Earlier versions can use ordereddict
@@ -48,22 +52,81 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
-# C type declarations
-ctypedef struct map_idx_t:
-    # pointer to the raw numpy array containing the map values
-    int * map_base
-    # arity of the map
-    int arity
-    int idx
-
-ctypedef struct flat_race_args_t:
-    # Dat size
-    int size
-    # Temporary array for coloring purpose
-    unsigned int* tmp
-    # lenght of mip (ie, number of occurences of Dat in the access descriptors)
-    int count
-    map_idx_t * mip
+# Available colouring algorithms
+_colorings = ('greedy', 'jones_plassmann')
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _first_fit(int[::1] order, int[::1] start, int[::1] end,
+                    int[:, ::1] ents, int[::1] colors,
+                    unsigned long long[::1] work) nogil:
+    """Colour nodes visited in the given ``order`` with the lowest colour not
+    used by any previously coloured node touching the same entries. Node ``n``
+    touches the entries in rows ``start[n]`` to ``end[n]`` of ``ents``.
+
+    Colours are assigned in windows of 64, with a bit mask of the colours of
+    the current window used by each entry in ``work``. Another pass over the
+    nodes is only made for those which could not be coloured in a window.
+
+    Returns the number of colours used."""
+    cdef int nnodes = order.shape[0]
+    cdef int k = ents.shape[1]
+    cdef int ncolored = 0
+    cdef int base_color = 0
+    cdef int ncolors = 0
+    cdef int i, n, r, j, c
+    cdef unsigned long long mask
+
+    for i in range(nnodes):
+        colors[order[i]] = -1
+    while ncolored < nnodes:
+        # Only entries touched by nodes still to be coloured are looked at
+        for i in range(nnodes):
+            n = order[i]
+            if colors[n] == -1:
+                for r in range(start[n], end[n]):
+                    for j in range(k):
+                        work[ents[r, j]] = 0
+        for i in range(nnodes):
+            n = order[i]
+            if colors[n] != -1:
+                continue
+            mask = 0
+            for r in range(start[n], end[n]):
+                for j in range(k):
+                    mask |= work[ents[r, j]]
+            if mask == 0xffffffffffffffffULL:
+                continue
+            c = 0
+            while mask & 1:
+                mask >>= 1
+                c += 1
+            colors[n] = base_color + c
+            ncolors = max(ncolors, base_color + c + 1)
+            ncolored += 1
+            mask = 1ULL << c
+            for r in range(start[n], end[n]):
+                for j in range(k):
+                    work[ents[r, j]] |= mask
+        base_color += 64
+    return ncolors
+
+
+def _coloring_order(int n, degree, coloring):
+    """Order in which to colour ``n`` nodes with the given ``degree``.
+
+    Greedy colouring visits the nodes in order and ignores ``degree``. For
+    Jones-Plassmann colouring every node gets a weight of its degree plus a
+    random fraction and is coloured after all of its neighbours with a
+    higher weight. Since all nodes are coloured by a single process here this
+    is the same as colouring the nodes greedily by decreasing weight (largest
+    degree first)."""
+    if coloring == 'greedy':
+        return numpy.arange(n, dtype=numpy.int32)
+    weight = degree + numpy.random.RandomState(0).random_sample(len(degree))
+    return numpy.argsort(-weight, kind='mergesort').astype(numpy.int32)
+
 
 cdef class _Plan:
     """Plan object contains necessary information for data staging and execution scheduling."""
@@ -92,14 +155,17 @@ cdef class _Plan:
 
     def __init__(self, iset, *args, partition_size=1,
                  matrix_coloring=False, staging=True, thread_coloring=True,
-                 **kwargs):
+                 coloring=None, **kwargs):
         assert partition_size > 0, "partition size must be strictly positive"
+        coloring = coloring or configuration['coloring']
+        if coloring not in _colorings:
+            raise ConfigurationError("Unknown colouring algorithm %s" % coloring)
 
         self._compute_partition_info(iset, partition_size, matrix_coloring, args)
         if staging:
             self._compute_staging_info(iset, partition_size, matrix_coloring, args)
 
-        self._compute_coloring(iset, partition_size, matrix_coloring, thread_coloring, args)
+        self._compute_coloring(iset, partition_size, matrix_coloring, thread_coloring, args, coloring)
 
     def _compute_partition_info(self, iset, partition_size, matrix_coloring, args):
         self._nblocks = int(math.ceil(iset.size / float(partition_size)))
@@ -213,7 +279,7 @@ cdef class _Plan:
                 nshareds[pi] += align(sizes[(dat,map,pi)] * dat.dtype.itemsize * dat.cdim)
         self._nshared = max(nshareds)
 
-    def _compute_coloring(self, iset, partition_size, matrix_coloring, thread_coloring, args):
+    def _compute_coloring(self, iset, partition_size, matrix_coloring, thread_coloring, args, coloring):
         """Constructs:
             - thrcol
             - nthrcol
@@ -239,155 +305,119 @@ cdef class _Plan:
                     l.append((rowmap, i))
                 race_args[k] = l
 
-        # convert 'OrderedDict race_args' into a flat array for performant access in cython
-        cdef int n_race_args = len(race_args)
-        cdef flat_race_args_t* flat_race_args = <flat_race_args_t*> malloc(n_race_args * sizeof(flat_race_args_t))
-        pcds = [None] * n_race_args
-        for i, ra in enumerate(race_args.iterkeys()):
-            if isinstance(ra, base.Dat):
-                s = ra.dataset.exec_size
-            elif isinstance(ra, base.Mat):
-                s = ra.sparsity.maps[0][0].toset.exec_size
-
-            pcds[i] = numpy.empty((s,), dtype=numpy.uint32)
-            flat_race_args[i].size = s
-            flat_race_args[i].tmp = <unsigned int *> numpy.PyArray_DATA(pcds[i])
-
-            flat_race_args[i].count = len(race_args[ra])
-            flat_race_args[i].mip = <map_idx_t*> malloc(flat_race_args[i].count * sizeof(map_idx_t))
-            for j, mi in enumerate(race_args[ra]):
-                map, idx = mi
-                if map._parent is not None:
-                    map = map._parent
-                flat_race_args[i].mip[j].map_base = <int *> numpy.PyArray_DATA(map.values_with_halo)
-                flat_race_args[i].mip[j].arity = map.arity
-                flat_race_args[i].mip[j].idx = idx
-
-        # type constraining a few variables
-        cdef int _p
-        cdef unsigned int _base_color
-        cdef int _t
-        cdef unsigned int _mask
-        cdef unsigned int _color
-        cdef int _rai
-        cdef int _mi
-        cdef int _i
-
-        # indirection array:
-        # array containing the iteration set index given a thread index
+        # iteration set index of each thread index
         #  - id for normal sets
         #  - Subset::indices for subsets
-        # (the extra indirection is to avoid a having a test in the inner most
-        # loops and to avoid splitting code: set vs subset)
-        cdef int * iteridx
         if isinstance(iset.set, base.Subset):
-            iteridx = <int *> numpy.PyArray_DATA(iset.set.indices)
+            iteridx = iset.set.indices[:iset.set.exec_size]
         else:
-            _id = numpy.arange(iset.set.total_size, dtype=numpy.uint32)
-            iteridx = <int *> numpy.PyArray_DATA(_id)
-
-        # intra partition coloring
-        self._thrcol = numpy.empty((iset.set.exec_size, ), dtype=numpy.int32)
-        self._thrcol.fill(-1)
+            iteridx = numpy.arange(iset.set.exec_size, dtype=numpy.int32)
+
+        # entries of all race args touched by each thread index, numbered
+        # consecutively across race args
+        cols = []
+        cdef int nents = 0
+        for ra, mips in race_args.iteritems():
+            for map, idx in mips:
+                if map._parent is not None:
+                    map = map._parent
+                cols.append(map.values_with_halo[iteridx, idx] + nents)
+            if isinstance(ra, base.Dat):
+                nents += ra.dataset.set.total_size
+            elif isinstance(ra, base.Mat):
+                nents += ra.sparsity.maps[0][0].toset.total_size
+        if cols:
+            ents = numpy.ascontiguousarray(numpy.column_stack(cols), dtype=numpy.int32)
+        else:
+            ents = numpy.empty((len(iteridx), 0), dtype=numpy.int32)
+        work = numpy.empty(nents, dtype=numpy.uint64)
+        # number of thread indices touching each entry, estimating the degree
+        # of the conflict graph for Jones-Plassmann colouring
+        if coloring == 'jones_plassmann':
+            degree = numpy.bincount(ents.ravel(), minlength=nents)[ents].sum(axis=1)
+        else:
+            degree = None
 
-        # create direct reference to numpy array storage
-        cdef int * thrcol = <int *> numpy.PyArray_DATA(self._thrcol)
+        cdef int _p
         cdef int * nelems = <int *> numpy.PyArray_DATA(self._nelems)
         cdef int * offset = <int *> numpy.PyArray_DATA(self._offset)
 
+        # intra partition coloring
+        self._thrcol = numpy.empty((iset.set.exec_size, ), dtype=numpy.int32)
+        self._thrcol.fill(-1)
 
         if thread_coloring:
+            self._nthrcol = numpy.zeros(self._nblocks, dtype=numpy.int32)
             for _p in range(self._nblocks):
-                _base_color = 0
-                terminated = False
-                while not terminated:
-                    terminated = True
-
-                    # zero out working array:
-                    for _rai in range(n_race_args):
-                        for _i in range(flat_race_args[_rai].size):
-                            flat_race_args[_rai].tmp[_i] = 0
-
-                    # color threads
-                    for _t in range(offset[_p], offset[_p] + nelems[_p]):
-                        if thrcol[_t] == -1:
-                            _mask = 0
-
-                            for _rai in range(n_race_args):
-                                for _mi in range(flat_race_args[_rai].count):
-                                    _mask |= flat_race_args[_rai].tmp[flat_race_args[_rai].mip[_mi].map_base[iteridx[_t] * flat_race_args[_rai].mip[_mi].arity + flat_race_args[_rai].mip[_mi].idx]]
-
-                            if _mask == 0xffffffffu:
-                                terminated = False
-                            else:
-                                _color = 0
-                                while _mask & 0x1:
-                                    _mask = _mask >> 1
-                                    _color += 1
-                                thrcol[_t] = _base_color + _color
-                                _mask = 1 << _color
-                                for _rai in range(n_race_args):
-                                    for _mi in range(flat_race_args[_rai].count):
-                                        flat_race_args[_rai].tmp[flat_race_args[_rai].mip[_mi].map_base[iteridx[_t] * flat_race_args[_rai].mip[_mi].arity + flat_race_args[_rai].mip[_mi].idx]] |= _mask
-
-                    _base_color += 32
-
-            self._nthrcol = numpy.zeros(self._nblocks,dtype=numpy.int32)
-            for _p in range(self._nblocks):
-                self._nthrcol[_p] = max(self._thrcol[offset[_p]:(offset[_p] + nelems[_p])]) + 1
+                start = numpy.arange(offset[_p], offset[_p] + nelems[_p], dtype=numpy.int32)
+                tdegree = degree[start] if degree is not None else None
+                self._nthrcol[_p] = _first_fit(_coloring_order(nelems[_p], tdegree, coloring),
+                                               start, start + 1, ents,
+                                               self._thrcol[offset[_p]:offset[_p] + nelems[_p]],
+                                               work)
             self._thrcol = self._thrcol[iset.offset:(iset.offset + iset.size)]
 
         # partition coloring
         pcolors = numpy.empty(self._nblocks, dtype=numpy.int32)
-        pcolors.fill(-1)
-
-        cdef int * _pcolors = <int *> numpy.PyArray_DATA(pcolors)
-
-        _base_color = 0
-        terminated = False
-        while not terminated:
-            terminated = True
-
-            # zero out working array:
-            for _rai in range(n_race_args):
-                for _i in range(flat_race_args[_rai].size):
-                    flat_race_args[_rai].tmp[_i] = 0
-
-            for _p in range(self._nblocks):
-                if _pcolors[_p] == -1:
-                    _mask = 0
-                    for _t in range(offset[_p], offset[_p] + nelems[_p]):
-                        for _rai in range(n_race_args):
-                            for _mi in range(flat_race_args[_rai].count):
-                                _mask |= flat_race_args[_rai].tmp[flat_race_args[_rai].mip[_mi].map_base[iteridx[_t] * flat_race_args[_rai].mip[_mi].arity + flat_race_args[_rai].mip[_mi].idx]]
-
-                    if _mask == 0xffffffffu:
-                        terminated = False
-                    else:
-                        _color = 0
-                        while _mask & 0x1:
-                            _mask = _mask >> 1
-                            _color += 1
-                        _pcolors[_p] = _base_color + _color
-
-                        _mask = 1 << _color
-                        for _t in range(offset[_p], offset[_p] + nelems[_p]):
-                            for _rai in range(n_race_args):
-                                for _mi in range(flat_race_args[_rai].count):
-                                    flat_race_args[_rai].tmp[flat_race_args[_rai].mip[_mi].map_base[iteridx[_t] * flat_race_args[_rai].mip[_mi].arity + flat_race_args[_rai].mip[_mi].idx]] |= _mask
-
-            _base_color += 32
-
-        # memory free
-        for i in range(n_race_args):
-            free(flat_race_args[i].mip)
-        free(flat_race_args)
+        if degree is not None and self._nblocks > 0:
+            bdegree = numpy.add.reduceat(degree[iset.offset:iset.offset + iset.size],
+                                         self._offset - iset.offset)
+        else:
+            bdegree = numpy.zeros(self._nblocks, dtype=numpy.int32)
+        self._ncolors = _first_fit(_coloring_order(self._nblocks, bdegree, coloring),
+                                   self._offset, self._offset + self._nelems,
+                                   ents, pcolors, work)
 
         self._pcolors = pcolors
-        self._ncolors = max(pcolors) + 1
-        self._ncolblk = numpy.bincount(pcolors).astype(numpy.int32)
+        self._ncolblk = numpy.bincount(pcolors, minlength=self._ncolors).astype(numpy.int32)
         self._blkmap = numpy.argsort(pcolors, kind='mergesort').astype(numpy.int32)
 
+    def _save(self, filename):
+        """Write the arrays describing this plan to the npz file ``filename``.
+        The file is written under a temporary name first and then moved into
+        place, such that other processes never see a partial file."""
+        arrays = {'nelems': self._nelems,
+                  'ind_map': self._ind_map,
+                  'loc_map': self._loc_map,
+                  'ind_sizes': self._ind_sizes,
+                  'nindirect': self._nindirect,
+                  'ind_offs': self._ind_offs,
+                  'offset': self._offset,
+                  'thrcol': self._thrcol,
+                  'nthrcol': self._nthrcol,
+                  'ncolblk': self._ncolblk,
+                  'blkmap': self._blkmap,
+                  'pcolors': self._pcolors}
+        arrays = dict((k, v) for k, v in arrays.iteritems() if v is not None)
+        arrays['scalars'] = numpy.array([self._nblocks, self._nargs, self._ninds,
+                                         self._nshared, self._ncolors], dtype=numpy.int64)
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.rename(tmpname, filename)
+
+    def _load(self, filename):
+        """Read the arrays describing this plan from the npz file
+        ``filename`` written by :meth:`_save`."""
+        data = numpy.load(filename)
+        try:
+            get = lambda k: data[k] if k in data.files else None
+            self._nelems = get('nelems')
+            self._ind_map = get('ind_map')
+            self._loc_map = get('loc_map')
+            self._ind_sizes = get('ind_sizes')
+            self._nindirect = get('nindirect')
+            self._ind_offs = get('ind_offs')
+            self._offset = get('offset')
+            self._thrcol = get('thrcol')
+            self._nthrcol = get('nthrcol')
+            self._ncolblk = get('ncolblk')
+            self._blkmap = get('blkmap')
+            self._pcolors = get('pcolors')
+            self._nblocks, self._nargs, self._ninds, self._nshared, self._ncolors = data['scalars']
+        finally:
+            data.close()
+
     @property
     def nargs(self):
         return self._nargs
@@ -464,7 +494,13 @@ class Plan(base.Cached, _Plan):
         if self._initialized:
             Plan._cache_hit[self] += 1
             return
-        _Plan.__init__(self, iset, *args, **kwargs)
+        filename = Plan._disk_cache_file(iset, *args, **kwargs)
+        if filename and os.path.exists(filename):
+            self._load(filename)
+        else:
+            _Plan.__init__(self, iset, *args, **kwargs)
+            if filename:
+                self._save(filename)
         Plan._cache_hit[self] = 0
         self._initialized = True
 
@@ -478,9 +514,10 @@ class Plan(base.Cached, _Plan):
             return
         partition_size = kwargs.get('partition_size', 0)
         matrix_coloring = kwargs.get('matrix_coloring', False)
+        coloring = kwargs.get('coloring') or configuration['coloring']
 
         key = (part.set.size, part.offset, part.size,
-               partition_size, matrix_coloring)
+               partition_size, matrix_coloring, coloring)
 
         # For each indirect arg, the map, the access type, and the
         # indices into the map are important
@@ -515,3 +552,45 @@ class Plan(base.Cached, _Plan):
         key += subkey
 
         return key
+
+    @classmethod
+    def _disk_cache_file(cls, part, *args, **kwargs):
+        """Name of the file the plan is stored in if the ``plan_disk_cache``
+        configuration parameter is set, otherwise ``None``.
+
+        The file name is a hash of the same information as the in-memory
+        cache key, but with the values of each :class:`Map` (and the
+        indices of a :class:`Subset`) instead of their identity, as well as
+        all options which influence the plan. Plans for the same mesh are
+        therefore found again by a new process."""
+        if not configuration['plan_disk_cache'] or kwargs.get('refresh_cache', False):
+            return
+        h = md5()
+        h.update(str((part.set.total_size, part.set.exec_size, part.offset, part.size,
+                      kwargs.get('partition_size', 1),
+                      kwargs.get('matrix_coloring', False),
+                      kwargs.get('staging', True),
+                      kwargs.get('thread_coloring', True),
+                      kwargs.get('coloring') or configuration['coloring'])))
+        if isinstance(part.set, base.Subset):
+            h.update(numpy.ascontiguousarray(part.set.indices))
+        # Data carriers are numbered in order of appearance, since only
+        # which arguments share data matters
+        dats = OrderedDict()
+        for arg in args:
+            if arg._is_indirect or arg._is_mat:
+                n = dats.setdefault(arg.data, len(dats))
+                maps = arg.map if arg._is_mat else (arg.map, )
+                h.update(str((n, arg._is_mat, arg.data.cdim if arg._is_dat else arg.data.dims,
+                              arg.data.dtype.itemsize, arg.access is base.INC, arg.idx)))
+                for map in maps:
+                    for m in map:
+                        h.update(numpy.ascontiguousarray(m.values_with_halo))
+        cachedir = os.path.join(configuration['cache_dir'], 'plans')
+        if not os.path.exists(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                # Another process created the directory in the meantime
+                pass
+        return os.path.join(cachedir, h.hexdigest() + '.npz')
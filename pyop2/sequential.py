@@ -55,12 +55,11 @@ void wrap_%(kernel_name)s__(PyObject *_start, PyObject *_end,
   %(const_inits)s;
   %(off_inits)s;
   %(layer_arg_init)s;
-  %(map_decl)s
   for ( int n = start; n < end; n++ ) {
     int i = %(index_expr)s;
+    %(extr_loop)s
     %(vec_inits)s;
     %(map_init)s;
-    %(extr_loop)s
     %(map_bcs_m)s;
     %(buffer_decl)s;
     %(buffer_gather)s
@@ -70,8 +69,6 @@ void wrap_%(kernel_name)s__(PyObject *_start, PyObject *_end,
         %(layout_assign)s;
     %(layout_loop_close)s
     %(itset_loop_body)s
-    %(map_bcs_p)s;
-    %(apply_offset)s;
     %(extr_loop_close)s
   }
 }
@@ -83,8 +80,13 @@ class ParLoop(host.ParLoop):
     def __init__(self, *args, **kwargs):
         host.ParLoop.__init__(self, *args, **kwargs)
 
+    @property
+    def _jitmodule(self):
+        return JITModule(self.kernel, self.it_space, *self.args,
+                         direct=self.is_direct, soa=self._soa_layout)
+
     def _compute(self, part):
-        fun = JITModule(self.kernel, self.it_space, *self.args, direct=self.is_direct)
+        fun = self._jitmodule
         if not hasattr(self, '_jit_args'):
             self._jit_args = [0, 0]
             if isinstance(self._it_space._iterset, Subset):
@@ -96,7 +98,7 @@ class ParLoop(host.ParLoop):
                     for d in arg.data:
                         # Cannot access a property of the Dat or we will force
                         # evaluation of the trace
-                        self._jit_args.append(d._data)
+                        self._jit_args.append(self._jit_arg_data(arg, d))
 
                 if arg._is_indirect or arg._is_mat:
                     maps = as_tuple(arg.map, Map)
@@ -104,9 +106,16 @@ class ParLoop(host.ParLoop):
                         for m in map:
                             self._jit_args.append(m.values_with_halo)
 
+                if arg._is_csr_mat:
+                    self._jit_args.append(arg.data._array)
+                    self._jit_args.append(arg.data.sparsity._insertion_offsets(*arg.map))
+
             for c in Const._definitions():
                 self._jit_args.append(c.data)
 
+            if self._soa_layout:
+                self._jit_args.append(self._soa_stride)
+
             self._jit_args.extend(self.offset_args)
 
             self._jit_args.extend(self.layer_arg)
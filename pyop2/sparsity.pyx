@@ -31,9 +31,6 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from libcpp.vector cimport vector
-from libcpp.set cimport set
-from cython.operator cimport dereference as deref, preincrement as inc
 from cpython cimport bool
 import numpy as np
 cimport numpy as np
@@ -42,6 +39,11 @@ import cython
 np.import_array()
 
 ctypedef np.int32_t DTYPE_t
+ctypedef np.int64_t PTR_t
+
+cdef extern from "<algorithm>" namespace "std":
+    void sort[T](T first, T last) nogil
+    T unique[T](T first, T last) nogil
 
 ctypedef struct cmap:
     int from_size
@@ -67,142 +69,185 @@ cdef cmap init_map(omap):
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef build_sparsity_pattern_seq(int rmult, int cmult, int nrows, list maps):
-    """Create and populate auxiliary data structure: for each element of the
-    from set, for each row pointed to by the row map, add all columns pointed
-    to by the col map."""
+cdef fill_node_buckets(int nrows, list maps, bint exec_halo,
+                       np.ndarray[PTR_t, ndim=1] pos, int *cols):
+    """For each element of the from set, for each row pointed to by the row
+    map, count the columns pointed to by the col map in ``pos`` if ``cols`` is
+    NULL, or else append them to the bucket of that row in ``cols`` starting at
+    ``pos``. Rows outside ``nrows`` are ignored."""
     cdef:
-        int e, i, r, d, c
-        int lsize, rsize, row
+        int e, i, d, l, row, col, nelems, nlayers
+        bint extruded
         cmap rowmap, colmap
-        vector[set[int]] s_diag
-        set[int].iterator it
-
-    lsize = nrows*rmult
-    s_diag = vector[set[int]](lsize)
 
     for rmap, cmap in maps:
         rowmap = init_map(rmap)
         colmap = init_map(cmap)
-        rsize = rowmap.from_size
-        if rowmap.layers > 1:
-            for e in range(rsize):
-                for i in range(rowmap.arity):
-                    for r in range(rmult):
-                        for l in range(rowmap.layers - 1):
-                            row = rmult * (rowmap.values[i + e*rowmap.arity] + l * rowmap.offset[i]) + r
-                            for d in range(colmap.arity):
-                                for c in range(cmult):
-                                    s_diag[row].insert(cmult * (colmap.values[d + e * colmap.arity] +
-                                                       l * colmap.offset[d]) + c)
-        else:
-            for e in range(rsize):
-                for i in range(rowmap.arity):
-                    for r in range(rmult):
-                            row = rmult * rowmap.values[i + e*rowmap.arity] + r
-                            for d in range(colmap.arity):
-                                for c in range(cmult):
-                                    s_diag[row].insert(cmult * colmap.values[d + e * colmap.arity] + c)
+        nelems = rowmap.from_exec_size if exec_halo else rowmap.from_size
+        extruded = rowmap.layers > 1
+        nlayers = rowmap.layers - 1 if extruded else 1
+        for e in range(nelems):
+            for i in range(rowmap.arity):
+                for l in range(nlayers):
+                    row = rowmap.values[i + e*rowmap.arity]
+                    if extruded:
+                        row += l * rowmap.offset[i]
+                    # NOTE: this hides errors due to invalid map entries
+                    if row >= nrows:
+                        continue
+                    if cols == NULL:
+                        pos[row] += colmap.arity
+                        continue
+                    for d in range(colmap.arity):
+                        col = colmap.values[d + e*colmap.arity]
+                        if extruded:
+                            col += l * colmap.offset[d]
+                        cols[pos[row]] = col
+                        pos[row] += 1
 
-    # Create final sparsity structure
-    cdef np.ndarray[DTYPE_t, ndim=1] nnz = np.empty(lsize, dtype=np.int32)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef build_node_pattern(int nrows, list maps, bint exec_halo):
+    """Build the sparsity pattern on the level of nodes, i.e. ignoring the
+    dimensions of the data sets, and return it as a pair (rowptr, colidx) in
+    CSR format with sorted column indices.
+
+    The (non-unique) columns of all rows are gathered in a single flat array
+    bucketed by row, and each bucket is then sorted and made unique in place.
+    This is much faster and needs much less memory than inserting into a tree
+    per row, in particular since it is only done once per node rather than
+    for each of its components."""
+    cdef:
+        int row
+        PTR_t j, k, start, end
+        np.ndarray[PTR_t, ndim=1] bucket = np.zeros(nrows + 1, dtype=np.int64)
+        np.ndarray[PTR_t, ndim=1] rowptr = np.zeros(nrows + 1, dtype=np.int64)
+        np.ndarray[DTYPE_t, ndim=1] colidx
+        int *cols
+
+    fill_node_buckets(nrows, maps, exec_halo, bucket[1:], NULL)
+    bucket = np.cumsum(bucket)
+    colidx = np.empty(bucket[nrows], dtype=np.int32)
+    cols = <int *>np.PyArray_DATA(colidx)
+    fill_node_buckets(nrows, maps, exec_halo, bucket[:nrows].copy(), cols)
+
+    k = 0
+    for row in range(nrows):
+        start = bucket[row]
+        sort(cols + start, cols + bucket[row + 1])
+        end = unique(cols + start, cols + bucket[row + 1]) - cols
+        for j in range(start, end):
+            cols[k] = cols[j]
+            k += 1
+        rowptr[row + 1] = k
+    return rowptr, colidx[:k]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def expand_sparsity(int rmult, int cmult, np.ndarray[DTYPE_t, ndim=1] nptr,
+                    np.ndarray[DTYPE_t, ndim=1] ncol):
+    """Expand the block sparsity pattern given in CSR format by ``nptr`` and
+    ``ncol`` into a scalar one, by turning each block row into ``rmult`` rows
+    and each block column into ``cmult`` columns.
+
+    :returns: a tuple (rowptr, colidx) of the scalar pattern in CSR format"""
+    cdef:
+        int n, r, c, nrows, lsize, i, j
+
+    nrows = nptr.shape[0] - 1
+    lsize = nrows*rmult
     cdef np.ndarray[DTYPE_t, ndim=1] rowptr = np.empty(lsize + 1, dtype=np.int32)
     rowptr[0] = 0
-    for row in range(lsize):
-        nnz[row] = s_diag[row].size()
-        rowptr[row+1] = rowptr[row] + nnz[row]
+    for n in range(nrows):
+        for r in range(rmult):
+            rowptr[n*rmult + r + 1] = rowptr[n*rmult + r] + (nptr[n + 1] - nptr[n]) * cmult
+    if rmult == 1 and cmult == 1:
+        return rowptr, ncol
 
     cdef np.ndarray[DTYPE_t, ndim=1] colidx = np.empty(rowptr[lsize], dtype=np.int32)
-    # Note: elements in a set are always sorted, so no need to sort colidx
-    for row in range(lsize):
-        i = rowptr[row]
-        it = s_diag[row].begin()
-        while it != s_diag[row].end():
-            colidx[i] = deref(it)
-            inc(it)
-            i += 1
+    # Note: column blocks are sorted, and so is colidx
+    for n in range(nrows):
+        for r in range(rmult):
+            i = rowptr[n*rmult + r]
+            for j in range(nptr[n], nptr[n + 1]):
+                for c in range(cmult):
+                    colidx[i] = cmult * ncol[j] + c
+                    i += 1
 
-    return rowptr[lsize], nnz, rowptr, colidx
+    return rowptr, colidx
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef build_sparsity_pattern_seq(int rmult, int cmult, int nrows, list maps):
+    """Create the block sparsity pattern in CSR format and the number of
+    nonzeros of each block row and of each scalar row."""
+    cdef np.ndarray[PTR_t, ndim=1] nptr
+    cdef np.ndarray[DTYPE_t, ndim=1] ncol
+
+    nptr, ncol = build_node_pattern(nrows, maps, False)
+    block_nnz = np.diff(nptr).astype(np.int32)
+    nnz = np.repeat(block_nnz * cmult, rmult)
+    return nptr[nrows] * rmult * cmult, nnz, block_nnz, nptr.astype(np.int32), ncol
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cdef build_sparsity_pattern_mpi(int rmult, int cmult, int nrows, int ncols, list maps):
-    """Create and populate auxiliary data structure: for each element of the
-    from set, for each row pointed to by the row map, add all columns pointed
-    to by the col map."""
+    """Count the diagonal and off-diagonal nonzeros of each row. A column
+    belongs to the diagonal block if its node is owned, i.e. less than
+    ``ncols``, which as column nodes are sorted are the leading ones."""
     cdef:
-        int lrsize, lcsize, rsize, row, entry
-        int e, i, r, d, c
-        cmap rowmap, colmap
-        vector[set[int]] s_diag, s_odiag
+        int n, r, lrsize, diag
+        PTR_t j
+        np.ndarray[PTR_t, ndim=1] nptr
+        np.ndarray[DTYPE_t, ndim=1] ncol
 
-    lrsize = nrows*rmult
-    lcsize = ncols*cmult
-    s_diag = vector[set[int]](lrsize)
-    s_odiag = vector[set[int]](lrsize)
-
-    for rmap, cmap in maps:
-        rowmap = init_map(rmap)
-        colmap = init_map(cmap)
-        rsize = rowmap.from_exec_size;
-        if rowmap.layers > 1:
-            for e in range (rsize):
-                for i in range(rowmap.arity):
-                    for r in range(rmult):
-                        for l in range(rowmap.layers - 1):
-                            row = rmult * (rowmap.values[i + e*rowmap.arity] + l * rowmap.offset[i]) + r
-                            # NOTE: this hides errors due to invalid map entries
-                            if row < lrsize:
-                                for d in range(colmap.arity):
-                                    for c in range(cmult):
-                                        entry = cmult * (colmap.values[d + e * colmap.arity] + l * colmap.offset[d]) + c
-                                        if entry < lcsize:
-                                            s_diag[row].insert(entry)
-                                        else:
-                                            s_odiag[row].insert(entry)
-        else:
-            for e in range (rsize):
-                for i in range(rowmap.arity):
-                    for r in range(rmult):
-                            row = rmult * rowmap.values[i + e*rowmap.arity] + r
-                            # NOTE: this hides errors due to invalid map entries
-                            if row < lrsize:
-                                for d in range(colmap.arity):
-                                    for c in range(cmult):
-                                        entry = cmult * colmap.values[d + e * colmap.arity] + c
-                                        if entry < lcsize:
-                                            s_diag[row].insert(entry)
-                                        else:
-                                            s_odiag[row].insert(entry)
+    nptr, ncol = build_node_pattern(nrows, maps, True)
 
     # Create final sparsity structure
+    lrsize = nrows*rmult
     cdef np.ndarray[DTYPE_t, ndim=1] d_nnz = np.empty(lrsize, dtype=np.int32)
     cdef np.ndarray[DTYPE_t, ndim=1] o_nnz = np.empty(lrsize, dtype=np.int32)
+    cdef np.ndarray[DTYPE_t, ndim=1] block_d_nnz = np.empty(nrows, dtype=np.int32)
+    cdef np.ndarray[DTYPE_t, ndim=1] block_o_nnz = np.empty(nrows, dtype=np.int32)
     cdef int d_nz = 0
     cdef int o_nz = 0
-    for row in range(lrsize):
-        d_nnz[row] = s_diag[row].size()
-        d_nz += d_nnz[row]
-        o_nnz[row] = s_odiag[row].size()
-        o_nz += o_nnz[row]
-
-    return d_nnz, o_nnz, d_nz, o_nz
+    for n in range(nrows):
+        diag = 0
+        for j in range(nptr[n], nptr[n + 1]):
+            if ncol[j] >= ncols:
+                break
+            diag += 1
+        block_d_nnz[n] = diag
+        block_o_nnz[n] = nptr[n + 1] - nptr[n] - diag
+        for r in range(rmult):
+            d_nnz[n*rmult + r] = diag * cmult
+            o_nnz[n*rmult + r] = (nptr[n + 1] - nptr[n] - diag) * cmult
+        d_nz += diag * cmult * rmult
+        o_nz += (nptr[n + 1] - nptr[n] - diag) * cmult * rmult
+
+    return d_nnz, o_nnz, d_nz, o_nz, block_d_nnz, block_o_nnz
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def build_sparsity(object sparsity, bool parallel):
+    """Build the sparsity pattern of ``sparsity``. The pattern is stored per
+    block of ``sparsity.dims``, the scalar pattern is expanded from it with
+    :func:`expand_sparsity` on demand."""
     cdef int rmult, cmult
     rmult, cmult = sparsity._dims
     cdef int nrows = sparsity._nrows
     cdef int ncols = sparsity._ncols
 
     if parallel:
-        sparsity._d_nnz, sparsity._o_nnz, sparsity._d_nz, sparsity._o_nz = \
+        sparsity._d_nnz, sparsity._o_nnz, sparsity._d_nz, sparsity._o_nz, \
+            sparsity._block_d_nnz, sparsity._block_o_nnz = \
             build_sparsity_pattern_mpi(rmult, cmult, nrows, ncols, sparsity.maps)
-        sparsity._rowptr = []
-        sparsity._colidx = []
+        sparsity._block_rowptr = None
+        sparsity._block_colidx = None
     else:
-        sparsity._d_nz, sparsity._d_nnz, sparsity._rowptr, sparsity._colidx = \
+        sparsity._d_nz, sparsity._d_nnz, sparsity._block_d_nnz, \
+            sparsity._block_rowptr, sparsity._block_colidx = \
             build_sparsity_pattern_seq(rmult, cmult, nrows, sparsity.maps)
         sparsity._o_nnz = []
+        sparsity._block_o_nnz = []
         sparsity._o_nz = 0
@@ -36,6 +36,7 @@
 from __future__ import division
 
 import os
+import re
 import sys
 import numpy as np
 from decorator import decorator
@@ -214,6 +215,58 @@ def verify_reshape(data, dtype, shape, allow_none=False):
                                 (np.prod(shape), np.asarray(data).size))
 
 
+def hdf5_read(slot, indices=None, block_size=2 ** 26):
+    """Read the rows ``indices`` of the HDF5 dataset ``slot`` into a new
+    array, or all rows if ``indices`` is None.
+
+    Each run of consecutive indices is read as a hyperslab, in blocks of at
+    most ``block_size`` bytes, straight into the array returned. Hence only
+    the rows requested are ever held in memory, and no temporary copy of
+    them. If the file was opened with the ``mpio`` driver, every rank
+    reads its own rows with MPI-IO.
+
+    :arg slot: the h5py dataset to read from
+    :arg indices: an increasing array of row indices, e.g. the global
+        numbers of the owned and halo elements of the local set
+    :arg block_size: the maximum number of bytes read at once
+    """
+    if indices is None:
+        indices = np.arange(slot.shape[0])
+        starts, ends = np.array([0]), np.array([len(indices)])
+    else:
+        indices = np.asarray(indices)
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(indices)]))
+    out = np.empty((len(indices),) + slot.shape[1:], dtype=slot.dtype)
+    if len(indices) == 0:
+        return out
+    row = max(int(np.prod(slot.shape[1:])) * slot.dtype.itemsize, 1)
+    step = max(block_size // row, 1)
+    for start, end in zip(starts, ends):
+        offset = indices[start] - start
+        for a in xrange(start, end, step):
+            b = min(a + step, end)
+            slot.read_direct(out, np.s_[a + offset:b + offset], np.s_[a:b])
+    return out
+
+
+def hdf5_memmap(slot):
+    """Memory-map the HDF5 dataset ``slot`` read-only, such that its values
+    are only read from the file when accessed and may be shared by all
+    processes on a node through the page cache.
+
+    Only a contiguous dataset without filters (e.g. compression) can be
+    mapped, otherwise None is returned."""
+    if slot.chunks is not None or slot.compression is not None:
+        return None
+    offset = slot.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(slot.file.filename, dtype=slot.dtype, mode='r',
+                     offset=offset, shape=slot.shape)
+
+
 def align(bytes, alignment=16):
     """Align BYTES to a multiple of ALIGNMENT"""
     return ((bytes + alignment - 1) // alignment) * alignment
@@ -271,12 +324,78 @@ def parse_args(*args, **kwargs):
     return vars(parser(*args, **kwargs).parse_args())
 
 
+_preprocess_cache = {}
+
+# Comments and string or character literals, which must be told apart to
+# strip the former and not substitute macros in the latter
+_c_comment_or_literal = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^\\"\n])*"|\'(?:\\.|[^\\\'\n])*\'',
+                                   re.DOTALL)
+_c_define = re.compile(r'#\s*define\s+([A-Za-z_]\w*)(?:\s+(.*))?$')
+_c_undef = re.compile(r'#\s*undef\s+([A-Za-z_]\w*)\s*$')
+_c_identifier = re.compile(r'\b[A-Za-z_]\w*')
+
+
+def _preprocess_fast(text):
+    """Preprocess C code ``text`` in Python, if it only contains the
+    directives PyOP2 generates: pragmas and the definition and removal of
+    object-like macros. Returns ``None`` for any other input, which is left
+    to ``cpp``."""
+    if re.search(r'\b__\w+__\b', text):
+        # Predefined macros are only known to cpp
+        return None
+    text = _c_comment_or_literal.sub(lambda m: m.group(0) if m.group(0)[0] in '"\'' else ' ',
+                                     text.replace('\\\n', ''))
+    # Macros whose values refer to any macro, including ones defined later,
+    # need rescanning after substitution, which is left to cpp
+    defined = set(m.group(1) for m in (_c_define.match(l.strip()) for l in text.split('\n')) if m)
+    macros = {}
+    lines = []
+    for l in text.split('\n'):
+        stripped = l.strip()
+        if stripped.startswith('#'):
+            define = _c_define.match(stripped)
+            undef = _c_undef.match(stripped)
+            if re.match(r'#\s*pragma\b', stripped):
+                lines.append(stripped)
+            elif define:
+                value = (define.group(2) or '').strip()
+                if any(i in defined for i in _c_identifier.findall(value)):
+                    return None
+                macros[define.group(1)] = value
+            elif undef:
+                macros.pop(undef.group(1), None)
+            else:
+                return None
+        elif stripped:
+            if macros:
+                # Substitute macros outside of string and character literals
+                parts = re.split(r'("(?:\\.|[^\\"])*"|\'(?:\\.|[^\\\'])*\')', l)
+                parts[::2] = [_c_identifier.sub(lambda m: macros.get(m.group(0), m.group(0)), p)
+                              for p in parts[::2]]
+                l = ''.join(parts)
+            if l.strip():
+                lines.append(l)
+    return '\n'.join(lines)
+
+
 def preprocess(text):
-    p = Popen(['cpp', '-E', '-I' + os.path.dirname(__file__)], stdin=PIPE,
-              stdout=PIPE, universal_newlines=True)
-    # Strip empty lines and any preprocessor instructions other than pragmas
-    processed = '\n'.join(l for l in p.communicate(text)[0].split('\n')
-                          if l.strip() and (not l.startswith('#') or l.startswith('#pragma')))
+    """Run the C preprocessor on ``text`` and strip empty lines and any
+    preprocessor instructions other than pragmas. Code which only defines
+    and removes object-like macros is handled in Python, anything else by
+    ``cpp``. Results are cached on the source text, since kernels are
+    created over and over again."""
+    try:
+        return _preprocess_cache[text]
+    except KeyError:
+        pass
+    processed = _preprocess_fast(text)
+    if processed is None:
+        p = Popen(['cpp', '-E', '-I' + os.path.dirname(__file__)], stdin=PIPE,
+                  stdout=PIPE, universal_newlines=True)
+        # Strip empty lines and any preprocessor instructions other than pragmas
+        processed = '\n'.join(l for l in p.communicate(text)[0].split('\n')
+                              if l.strip() and (not l.startswith('#') or l.startswith('#pragma')))
+    _preprocess_cache[text] = processed
     return processed
 
 
@@ -72,6 +72,12 @@ class Mat(object):
         raise RuntimeError("Please call op2.init to select a backend")
 
 
+class MatrixFreeMat(object):
+
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError("Please call op2.init to select a backend")
+
+
 class Const(object):
 
     def __init__(self, *args, **kwargs):
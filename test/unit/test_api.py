@@ -2012,6 +2012,25 @@ class TestKernelAPI:
         k = op2.Kernel("int foo() { return 0; }", 'foo')
         assert str(k) == "OP2 Kernel: %s" % k.name
 
+    def test_kernel_preprocess_macros(self, backend):
+        "Kernel code should have object-like macros and comments removed."
+        k = op2.Kernel("""#define N 3
+void foo(double x[N]) { /* N */ x[0] = 'N'; } // N
+#undef N""", 'foo')
+        assert k.code.split() == "void foo(double x[3]) { x[0] = 'N'; }".split()
+        k = op2.Kernel("""#define A B
+#define B 1
+int x = A;""", 'x')
+        assert k.code.split() == "int x = 1;".split()
+
+    def test_kernel_preprocess_conditional(self, backend):
+        "Kernel code should have conditional directives evaluated."
+        k = op2.Kernel("""#if 0
+int bar() { return 1; }
+#endif
+int foo() { return 0; }""", 'foo')
+        assert k.code == "int foo() { return 0; }"
+
 
 class TestParLoopAPI:
 
@@ -368,6 +368,70 @@ void kernel_swap(unsigned int* x)
         assert self.cache_hit[plan1] == 1
         assert self.cache_hit[plan2] == 1
 
+    def test_plan_cached_on_disk(self, backend, iterset, indset, x, tmpdir):
+        cache_dir = op2.configuration['cache_dir']
+        op2.configuration['cache_dir'] = str(tmpdir)
+        op2.configuration['plan_disk_cache'] = True
+        try:
+            self.cache.clear()
+            # A map with the same values but a different identity
+            values = numpy.random.randint(0, nelems, nelems)
+            map1 = op2.Map(iterset, indset, 1, values)
+            map2 = op2.Map(iterset, indset, 1, values.copy())
+            plan1 = plan.Plan(iterset.all_part, x(op2.INC, map1[0]),
+                              partition_size=10)
+            assert len(tmpdir.join('plans').listdir()) == 1
+            self.cache.clear()
+            plan2 = plan.Plan(iterset.all_part, x(op2.INC, map2[0]),
+                              partition_size=10)
+            assert plan1 is not plan2
+            assert len(tmpdir.join('plans').listdir()) == 1
+            assert plan1.ncolors == plan2.ncolors
+            assert (plan1.blkmap == plan2.blkmap).all()
+            assert (plan1.thrcol == plan2.thrcol).all()
+            assert (plan1.ind_map == plan2.ind_map).all()
+        finally:
+            op2.configuration['cache_dir'] = cache_dir
+            op2.configuration['plan_disk_cache'] = False
+
+
+class TestDirectPlanCache:
+
+    """
+    Direct Loop Plan Cache Tests.
+    """
+    # Only the OpenMP backend partitions direct loops
+    skip_backends = ['sequential', 'cuda', 'opencl']
+
+    def test_direct_plan_cached(self, backend, iterset, diterset):
+        from pyop2.openmp import FakePlan
+        FakePlan._cache.clear()
+        a = op2.Dat(diterset, range(nelems), numpy.uint32, "a")
+
+        kernel_inc = "void kernel_inc(unsigned int* x) { *x += 1; }"
+        kernel_dec = "void kernel_dec(unsigned int* x) { *x -= 1; }"
+
+        op2.par_loop(op2.Kernel(kernel_inc, "kernel_inc"), iterset, a(op2.RW))
+        op2.base._trace.evaluate(set([a]), set())
+        assert len(FakePlan._cache) == 1
+
+        op2.par_loop(op2.Kernel(kernel_dec, "kernel_dec"), iterset, a(op2.RW))
+        op2.base._trace.evaluate(set([a]), set())
+        assert len(FakePlan._cache) == 1
+
+    def test_partition_size_fits_cache(self, backend):
+        s = op2.Set(100000)
+        k = op2.Kernel("void k(double *x) {}", "k")
+        narrow = op2.prepare_par_loop(k, s, op2.Dat(s, dtype=numpy.float64)(op2.WRITE))
+        wide = op2.prepare_par_loop(k, s, op2.Dat(s ** 16, dtype=numpy.float64)(op2.WRITE))
+        cache_size = op2.configuration['partition_cache_size']
+        op2.configuration['partition_cache_size'] = 1024
+        try:
+            assert narrow._partition_size(s.core_part) == 128
+            assert wide._partition_size(s.core_part) == 64
+        finally:
+            op2.configuration['partition_cache_size'] = cache_size
+
 
 class TestGeneratedCodeCache:
 
@@ -637,6 +701,33 @@ void kernel_swap(unsigned int* x[2])
         op2.base._trace.evaluate(set([g]), set())
         assert len(self.cache) == 2
 
+    def test_compiled_module_cached_on_disk(self, backend, skip_cuda, skip_opencl,
+                                            iterset, a, tmpdir):
+        cache_dir = op2.configuration['cache_dir']
+        op2.configuration['cache_dir'] = str(tmpdir)
+        try:
+            k = op2.Kernel("""void kernel_disk_cache(unsigned int* a) { *a += 1; }""",
+                           'kernel_disk_cache')
+            op2.par_loop(k, iterset, a(op2.RW))
+            op2.base._trace.evaluate(set([a]), set())
+            assert len(tmpdir.listdir()) > 0
+        finally:
+            op2.configuration['cache_dir'] = cache_dir
+
+    def test_compile_in_background(self, backend, skip_cuda, skip_opencl, skip_greedy,
+                                   iterset, a):
+        op2.configuration['compile_in_background'] = True
+        try:
+            k = op2.Kernel("""void kernel_background(unsigned int* a) { *a += 2; }""",
+                           'kernel_background')
+            op2.par_loop(k, iterset, a(op2.RW))
+            jitmodule = op2.base._trace._trace[-1]._jitmodule
+            assert hasattr(jitmodule, '_pending')
+            assert all(a.data == numpy.arange(nelems) + 2)
+            assert jitmodule._pending.returncode == 0
+        finally:
+            op2.configuration['compile_in_background'] = False
+
 
 class TestKernelCache:
 
@@ -679,6 +770,61 @@ class TestKernelCache:
         k2 = op2.Kernel("void l(void *x) {}", 'l')
         assert k1 is not k2 and len(self.cache) == 2
 
+    def test_kernels_same_ast_same_name(self, backend, monkeypatch):
+        """Kernels with structurally equal ASTs and same name should be
+        retrieved from cache without translating the AST again."""
+        self.cache.clear()
+        ast = lambda: FunDecl("void", "k", [Decl("int*", c_sym("x"))],
+                              c_for("i", 1, Assign(Symbol("x", ("i",)), c_sym(0))))
+        k1 = op2.Kernel(ast(), 'k')
+
+        def fail(cls, *args, **kwargs):
+            raise AssertionError("AST translated on a cache hit")
+        monkeypatch.setattr(type(k1), '_ast_to_c', classmethod(fail))
+        k2 = op2.Kernel(ast(), 'k')
+        assert k1 is k2
+
+    def test_kernels_differing_ast_same_name(self, backend):
+        """Kernels with structurally different ASTs and same name should not
+        be retrieved from cache."""
+        self.cache.clear()
+        k1 = op2.Kernel(FunDecl("void", "k", [Decl("int*", c_sym("x"))],
+                                c_for("i", 1, Assign(Symbol("x", ("i",)), c_sym(0)))), 'k')
+        k2 = op2.Kernel(FunDecl("void", "k", [Decl("int*", c_sym("x"))],
+                                c_for("i", 1, Assign(Symbol("x", ("i",)), c_sym(1)))), 'k')
+        assert k1 is not k2
+
+    def test_kernels_same_ast_differing_vectorizer(self, backend, monkeypatch, skip_cuda, skip_opencl):
+        """Kernels with the same AST should be translated again for a
+        different vectoriser instruction set or compiler."""
+        from pyop2.ir import ast_vectorizer
+        self.cache.clear()
+        ast = lambda: FunDecl("void", "k", [Decl("int*", c_sym("x"))],
+                              c_for("i", 1, Assign(Symbol("x", ("i",)), c_sym(0))))
+        state = (ast_vectorizer.intrinsics, ast_vectorizer.compiler,
+                 ast_vectorizer.vectorizer_init)
+        try:
+            ast_vectorizer.init_vectorizer('sse', 'gnu')
+            k = op2.Kernel(ast(), 'k')
+            translated = []
+            ast_to_c = type(k)._ast_to_c
+
+            def count(cls, *args, **kwargs):
+                translated.append(args)
+                return ast_to_c(*args, **kwargs)
+            monkeypatch.setattr(type(k), '_ast_to_c', classmethod(count))
+            op2.Kernel(ast(), 'k')
+            assert len(translated) == 0
+            ast_vectorizer.init_vectorizer('avx', 'gnu')
+            op2.Kernel(ast(), 'k')
+            assert len(translated) == 1
+            ast_vectorizer.init_vectorizer('avx', 'intel')
+            op2.Kernel(ast(), 'k')
+            assert len(translated) == 2
+        finally:
+            (ast_vectorizer.intrinsics, ast_vectorizer.compiler,
+             ast_vectorizer.vectorizer_init) = state
+
 
 class TestSparsityCache:
 
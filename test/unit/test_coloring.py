@@ -107,3 +107,34 @@ class TestColoring:
                 assert (counter < 2).all()
 
             eidx += plan.nelems[p]
+
+    def test_more_than_64_colors(self, backend, nodes):
+        nele = 100
+        elements = op2.Set(nele, "elements")
+        # All elements increment the same node and hence need distinct colours
+        elem_node = op2.Map(elements, nodes, 1, numpy.zeros(nele, dtype=numpy.uint32))
+        x = op2.Dat(nodes, dtype=numpy.uint32)
+
+        plan = _plan.Plan(elements.all_part, x(op2.INC, elem_node[0]),
+                          partition_size=nele, refresh_cache=True)
+
+        assert plan.nblocks == 1
+        assert plan.nthrcol[0] == nele
+        assert sorted(plan.thrcol) == range(nele)
+
+    @pytest.mark.parametrize('coloring', ['greedy', 'jones_plassmann'])
+    def test_block_coloring(self, backend, elements, elem_node, x, coloring):
+        plan = _plan.Plan(elements.all_part, x(op2.INC, elem_node[0]),
+                          partition_size=2, coloring=coloring, refresh_cache=True)
+
+        assert sum(plan.ncolblk) == plan.nblocks
+        offset = 0
+        for c in range(plan.ncolors):
+            counter = numpy.zeros(NUM_NODES, dtype=numpy.uint32)
+            for b in plan.blkmap[offset:offset + plan.ncolblk[c]]:
+                touched = set(elem_node.values[plan.offset[b] + i][0]
+                              for i in range(plan.nelems[b]))
+                for n in touched:
+                    counter[n] += 1
+            assert (counter < 2).all()
+            offset += plan.ncolblk[c]
@@ -260,6 +260,169 @@ class TestDirectLoop:
         y.zero()
         assert (y.data == 0).all()
 
+    def test_prepared_loop(self, backend, elems, x):
+        """A prepared par_loop can be executed repeatedly."""
+        kernel_inc = """void kernel_inc(unsigned int* x) { (*x) = (*x) + 1; }"""
+        loop = op2.prepare_par_loop(op2.Kernel(kernel_inc, "kernel_inc"),
+                                    elems, x(op2.RW))
+        for i in range(3):
+            loop()
+        assert sum(x.data) == sum(range(elems.size)) + 3 * elems.size
+
+    def test_prepared_loop_rebind(self, backend, elems, x):
+        """A prepared par_loop can be executed with new arguments."""
+        kernel_cpy = """void kernel_cpy(unsigned int* y, unsigned int* x) { *y = *x; }"""
+        y = op2.Dat(x.dataset, None, np.uint32, "y")
+        z = op2.Dat(x.dataset, None, np.uint32, "z")
+        loop = op2.prepare_par_loop(op2.Kernel(kernel_cpy, "kernel_cpy"),
+                                    elems, y(op2.WRITE), x(op2.READ))
+        loop()
+        loop(z(op2.WRITE), y(op2.READ))
+        assert all(z.data == x.data)
+
+    def test_prepared_loop_rebind_mismatch_raises(self, backend, elems, x, y):
+        """Rebinding a prepared par_loop to arguments of different structure
+        raises an error."""
+        kernel_wo = """void kernel_wo(unsigned int* x) { *x = 42; }"""
+        loop = op2.prepare_par_loop(op2.Kernel(kernel_wo, "kernel_wo"),
+                                    elems, x(op2.WRITE))
+        with pytest.raises(ValueError):
+            loop(y(op2.WRITE))
+
+    def test_prepared_loop_replaced_global(self, backend, elems, x, g):
+        """A prepared par_loop picks up replaced Global data."""
+        kernel_sum = """void kernel_sum(unsigned int* g, unsigned int* x) { *g += *x; }"""
+        loop = op2.prepare_par_loop(op2.Kernel(kernel_sum, "kernel_sum"),
+                                    elems, g(op2.INC), x(op2.READ))
+        loop()
+        assert g.data[0] == sum(range(elems.size))
+        g.data = 0
+        loop()
+        assert g.data[0] == sum(range(elems.size))
+
+
+class TestSoALayout:
+
+    """
+    Tests of the SoA layout of Dats on the host backends.
+    """
+
+    skip_backends = ['cuda', 'opencl']
+
+    @pytest.fixture
+    def soa(cls, delems2):
+        return op2.Dat(delems2, np.column_stack((xarray(), 2 * xarray())),
+                       np.uint32, "soa", soa=True)
+
+    @pytest.fixture
+    def soa_layout(cls, request):
+        op2.configuration['soa_layout'] = True
+
+        def reset():
+            op2.configuration['soa_layout'] = False
+        request.addfinalizer(reset)
+
+    @pytest.fixture
+    def y(cls, delems2):
+        return op2.Dat(delems2, None, np.uint32, "y")
+
+    @pytest.fixture
+    def swap(cls):
+        return op2.Kernel("""void swap(unsigned int *x, unsigned int *y) {
+          y[0] = OP2_STRIDE(x, 1); y[1] = OP2_STRIDE(x, 0);
+        }""", "swap")
+
+    @pytest.fixture
+    def add(cls):
+        return op2.Kernel("""void add(unsigned int *x) {
+          OP2_STRIDE(x, 1) += OP2_STRIDE(x, 0);
+        }""", "add")
+
+    def test_direct_loop_reads_transposed_copy(self, backend, soa_layout, elems, soa, y, swap):
+        """A direct loop reads a SoA Dat through its transposed copy."""
+        op2.par_loop(swap, elems, soa(op2.READ), y(op2.WRITE))
+        assert np.array_equal(y.data_ro[:, ::-1], soa.data_ro)
+        assert soa._soa_valid
+        assert np.array_equal(soa._soa_data.T, soa.data_ro_with_halos)
+
+    def test_direct_loop_writes_transposed_copy(self, backend, soa_layout, elems, soa, add):
+        """A direct loop writing a SoA Dat through its transposed copy
+        leaves the data stale until they are accessed."""
+        op2.par_loop(add, elems, soa(op2.RW))
+        op2.par_loop(add, elems, soa(op2.RW))
+        op2.base._trace.evaluate(set([soa]), set())
+        assert soa._soa_valid and not soa._aos_valid
+        assert all(soa.data_ro[:, 0] == xarray()[:elems.size])
+        assert all(soa.data_ro[:, 1] == 4 * xarray()[:elems.size])
+        assert soa._soa_valid and soa._aos_valid
+
+    def test_gather_transposes_back(self, backend, soa_layout, elems, soa, y, add):
+        """A loop gathering a SoA Dat written through its transposed copy
+        reads the up to date data."""
+        m = op2.Map(elems, elems, 1, range(elems.total_size), "m")
+        k = """void k(unsigned int *x, unsigned int *y) {
+          y[0] = OP2_STRIDE(x, 0); y[1] = OP2_STRIDE(x, 1);
+        }"""
+        op2.par_loop(add, elems, soa(op2.RW))
+        op2.par_loop(op2.Kernel(k, "k"), elems, soa(op2.READ, m[0]), y(op2.WRITE))
+        assert all(y.data_ro[:, 1] == 3 * xarray()[:elems.size])
+
+    def test_write_invalidates_transposed_copy(self, backend, soa_layout, elems, soa, y, swap):
+        """Writing the data of a SoA Dat invalidates its transposed copy."""
+        op2.par_loop(swap, elems, soa(op2.READ), y(op2.WRITE))
+        soa.data[:] = 7
+        assert not soa._soa_valid
+        op2.par_loop(swap, elems, soa(op2.READ), y(op2.WRITE))
+        assert all(y.data_ro.ravel() == 7)
+
+    def test_vec_write_invalidates_transposed_copy(self, backend, soa_layout, elems, delems2):
+        """Writing the data of a SoA Dat through a PETSc Vec created before
+        invalidates its transposed copy."""
+        x = op2.Dat(delems2, np.arange(2 * delems2.total_size), np.float64, "x", soa=True)
+        y = op2.Dat(delems2, None, np.float64, "y")
+        k = op2.Kernel("""void k(double *x, double *y) {
+          y[0] = OP2_STRIDE(x, 0); y[1] = OP2_STRIDE(x, 1);
+        }""", "k")
+        with x.vec_ro:
+            pass
+        op2.par_loop(k, elems, x(op2.READ), y(op2.WRITE))
+        with x.vec as v:
+            v.set(100)
+        op2.par_loop(k, elems, x(op2.READ), y(op2.WRITE))
+        assert all(y.data_ro.ravel() == 100)
+
+    def test_vec_transposes_back(self, backend, soa_layout, elems, delems2):
+        """A PETSc Vec created before a loop writing a SoA Dat through its
+        transposed copy sees the written values."""
+        x = op2.Dat(delems2, np.ones(2 * delems2.total_size), np.float64, "x", soa=True)
+        k = op2.Kernel("""void k(double *x) {
+          OP2_STRIDE(x, 1) += OP2_STRIDE(x, 0);
+        }""", "k")
+        with x.vec_ro:
+            pass
+        op2.par_loop(k, elems, x(op2.RW))
+        with x.vec_ro as v:
+            assert all(v.array_r[1::2] == 2)
+
+    def test_gathered_dat_stays_aos(self, backend, soa_layout, elems, soa, y, swap):
+        """A SoA Dat mostly accessed through a Map is not transposed."""
+        m = op2.Map(elems, elems, 1, range(elems.total_size), "m")
+        k = """void k(unsigned int *x, unsigned int *y) {
+          y[0] = OP2_STRIDE(x, 1); y[1] = OP2_STRIDE(x, 0);
+        }"""
+        for _ in range(2):
+            op2.par_loop(op2.Kernel(k, "k"), elems, soa(op2.READ, m[0]), y(op2.WRITE))
+        op2.par_loop(swap, elems, soa(op2.READ), y(op2.WRITE))
+        assert np.array_equal(y.data_ro[:, ::-1], soa.data_ro)
+        assert not soa._soa_valid
+
+    def test_soa_layout_off(self, backend, elems, soa, y, swap):
+        """No transposed copy is made unless the soa_layout configuration
+        parameter is set."""
+        op2.par_loop(swap, elems, soa(op2.READ), y(op2.WRITE))
+        assert np.array_equal(y.data_ro[:, ::-1], soa.data_ro)
+        assert soa._soa_array is None
+
 if __name__ == '__main__':
     import os
     pytest.main(os.path.abspath(__file__))
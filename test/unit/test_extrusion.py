@@ -39,6 +39,7 @@ from numpy.testing import assert_allclose
 from pyop2 import op2
 from pyop2.computeind import compute_ind_extr
 from pyop2.ir.ast_base import *
+from pyop2.ir import ast_vectorizer
 
 backends = ['sequential', 'openmp']
 
@@ -378,6 +379,51 @@ void comp_vol(double A[1], double *x[], double *y[])
 
         assert all(map(lambda x: x == 42, dat_f.data))
 
+    def test_layers_disjoint(self, backend, coords_map, field_map):
+        assert field_map._layers_disjoint
+        assert not coords_map._layers_disjoint
+
+    def test_write_data_field_ivdep(self, backend, elements, dat_coords, coords_map, field_map):
+        fields = op2.Set(nelems * wedges, "fields", layers=layers)
+        dat_f = op2.Dat(fields, dtype=numpy.float64, name="f")
+        xtr_field_map = op2.Map(elements, fields, map_dofs_field,
+                                field_map.values_with_halo, "elem_field", off2)
+        kernel_ivdep = """void kernel_ivdep(double x[1], double *c[2]) {
+                            x[0] = double(42) + 0.0 * c[0][0]; }\n"""
+
+        state = (ast_vectorizer.intrinsics, ast_vectorizer.compiler,
+                 ast_vectorizer.vectorizer_init)
+        ast_vectorizer.init_vectorizer('sse', 'gnu')
+        try:
+            # Reading through a vector map whose layers overlap does not
+            # prevent vectorising the layer loop
+            loop = op2.prepare_par_loop(op2.Kernel(kernel_ivdep, "kernel_ivdep"), elements,
+                                        dat_f(op2.WRITE, xtr_field_map[op2.i[0]]),
+                                        dat_coords(op2.READ, coords_map))
+            loop()
+            assert all(dat_f.data == 42)
+            code, _ = loop._jitmodule._build_args()
+            assert "#pragma GCC ivdep" in code
+            # Writing the entries of the layer above those read by a vertical
+            # sweep carries a dependence from one layer to the next
+            top = op2.Map(elements, fields, map_dofs_field,
+                          field_map.values_with_halo + 1, "elem_field_top", off2)
+            loop = op2.prepare_par_loop(op2.Kernel(kernel_ivdep, "kernel_ivdep"), elements,
+                                        dat_f(op2.WRITE, top[op2.i[0]]),
+                                        dat_f(op2.READ, xtr_field_map))
+            code, _ = loop._jitmodule._build_args()
+            assert "#pragma GCC ivdep" not in code
+            # The same access to two Dats has independent layers
+            dat_g = op2.Dat(fields, dtype=numpy.float64, name="g")
+            loop = op2.prepare_par_loop(op2.Kernel(kernel_ivdep, "kernel_ivdep"), elements,
+                                        dat_f(op2.WRITE, top[op2.i[0]]),
+                                        dat_g(op2.READ, xtr_field_map))
+            code, _ = loop._jitmodule._build_args()
+            assert "#pragma GCC ivdep" in code
+        finally:
+            (ast_vectorizer.intrinsics, ast_vectorizer.compiler,
+             ast_vectorizer.vectorizer_init) = state
+
     def test_write_data_coords(self, backend, elements, dat_coords, dat_field, coords_map, field_map, dat_c):
         kernel_wo_c = """void kernel_wo_c(double* x[]) {
                                                                x[0][0] = double(42); x[0][1] = double(42);
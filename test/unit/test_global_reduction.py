@@ -431,3 +431,16 @@ void kernel_max(double* x, double* g)
                      g_double(op2.INC))
         assert_allclose(g_uint32.data[0], g_double.data[0])
         assert g_uint32.data[0] == set.size
+
+    def test_batched_reductions(self, backend, set, d2):
+        g_sum = op2.Global(2, [0, 0], numpy.uint32, "g_sum")
+        g_sum2 = op2.Global(1, [0], numpy.uint32, "g_sum2")
+        g_max = op2.Global(1, [0], numpy.uint32, "g_max")
+        k = """void k(unsigned int* x, unsigned int* s, unsigned int* s2, unsigned int* m) {
+          s[0] += x[0]; s[1] += x[1]; *s2 += 1; *m = *m > x[1] ? *m : x[1];
+        }"""
+        op2.par_loop(op2.Kernel(k, "k"), set,
+                     d2(op2.READ), g_sum(op2.INC), g_sum2(op2.INC), g_max(op2.MAX))
+        assert all(g_sum.data == d2.data.sum(axis=0))
+        assert g_sum2.data[0] == set.size
+        assert g_max.data[0] == d2.data[:, 1].max()
@@ -63,6 +63,8 @@ class TestHDF5:
         f['set'].attrs['dim'] = 2
         f.create_dataset('myconstant', data=np.arange(3))
         f.create_dataset('map', data=np.array((1, 2, 2, 3)).reshape(2, 2))
+        f.create_dataset('map32', data=np.array((1, 2, 2, 3)).reshape(2, 2),
+                         dtype=np.int32)
         request.addfinalizer(f.close)
         return f
 
@@ -122,3 +124,92 @@ class TestHDF5:
         assert m.arity == 2
         assert m.values.sum() == sum((1, 2, 2, 3))
         assert m.name == 'map'
+
+    def test_dat_hdf5_indices(self, backend, h5file):
+        "Creating a dat from selected rows of a Dat in h5file should work."
+        dset = op2.Set(3) ** 2
+        d = op2.Dat.fromhdf5(dset, h5file, 'dat', indices=[0, 2, 3])
+        assert (d.data == [[0, 1], [4, 5], [6, 7]]).all()
+
+    def test_dat_hdf5_blocks(self, backend, h5file, dset):
+        "Reading a Dat in blocks of a single row should give the same data."
+        from pyop2.utils import hdf5_read
+        assert (hdf5_read(h5file['dat'], block_size=1) == np.arange(10).reshape(5, 2)).all()
+
+    def test_map_hdf5_indices(self, backend, toset, h5file):
+        "Creating a Map from selected rows of a map in h5file should work."
+        m = op2.Map.fromhdf5(op2.Set(1), toset, h5file, name="map", indices=[1])
+        assert (m.values == [[2, 3]]).all()
+
+    def test_map_hdf5_mmap(self, backend, iterset, toset, h5file):
+        "Memory-mapping the values of a Map in h5file should work."
+        h5file.flush()
+        m = op2.Map.fromhdf5(iterset, toset, h5file, name="map32", mmap=True)
+        assert not m.values.flags.writeable
+        assert (m.values == [[1, 2], [2, 3]]).all()
+
+
+class TestCheckpoint:
+
+    @pytest.fixture
+    def filename(cls, tmpdir):
+        return str(tmpdir.join('checkpoint.h5'))
+
+    def test_checkpoint_restart(self, backend, filename):
+        "Restarting from a checkpoint should give back the data written."
+        from pyop2.checkpoint import checkpoint, restart
+        nodes, cells = op2.Set(4), op2.Set(2)
+        d = op2.Dat(nodes ** 2, np.arange(8, dtype=np.float64), name='d')
+        m = op2.Map(cells, nodes, 3, [0, 1, 2, 3, 2, 1], name='m')
+        g = op2.Global(1, 3.0, np.float64, name='g')
+        checkpoint(filename, [d, m, g], compression='gzip')
+        d2 = op2.Dat(nodes ** 2, name='d')
+        m2 = op2.Map(cells, nodes, 3, np.zeros(6, dtype=np.int32), name='m')
+        g2 = op2.Global(1, 0.0, np.float64, name='g')
+        restart(filename, [d2, m2, g2])
+        assert (d2.data_ro == d.data_ro).all()
+        assert (m2.values == m.values).all()
+        assert g2.data_ro[0] == 3.0
+
+    def test_checkpoint_restart_numbering(self, backend, filename):
+        "Restarting with a numbering of the Sets should read the rows by number."
+        from pyop2.checkpoint import checkpoint, restart
+        nodes, cells = op2.Set(4), op2.Set(2)
+        d = op2.Dat(nodes, np.arange(4, dtype=np.float64), name='d')
+        m = op2.Map(cells, nodes, 2, [0, 1, 2, 3], name='m')
+        checkpoint(filename, [d, m], numbering={nodes: [0, 1, 2, 3], cells: [0, 1]})
+        # The same elements numbered in a different local order
+        d2 = op2.Dat(nodes, name='d')
+        m2 = op2.Map(cells, nodes, 2, np.zeros(4, dtype=np.int32), name='m')
+        restart(filename, [d2, m2], numbering={nodes: [3, 2, 1, 0], cells: [1, 0]})
+        assert (d2.data_ro == [3, 2, 1, 0]).all()
+        assert (m2.values == [[1, 0], [3, 2]]).all()
+        with pytest.raises(ValueError):
+            restart(filename, [d2])
+
+    def test_checkpoint_restart_comm_size(self, backend, filename):
+        "Restarting data numbered by rank on a different number of processes should fail."
+        from pyop2.checkpoint import checkpoint, restart
+        d = op2.Dat(op2.Set(4), np.arange(4, dtype=np.float64), name='d')
+        checkpoint(filename, [d])
+        with h5py.File(filename, 'r+') as f:
+            f['d'].attrs['comm_size'] += 1
+        with pytest.raises(ValueError):
+            restart(filename, [d])
+
+    def test_checkpoint_fromhdf5(self, backend, filename):
+        "A checkpointed Dat should be readable by Dat.fromhdf5."
+        from pyop2.checkpoint import checkpoint
+        dset = op2.Set(3) ** 2
+        d = op2.Dat(dset, np.arange(6, dtype=np.float64), name='d')
+        checkpoint(filename, [d])
+        with h5py.File(filename, 'r') as f:
+            d2 = op2.Dat.fromhdf5(dset, f, 'd')
+        assert (d2.data_ro == d.data_ro).all()
+
+    def test_checkpoint_duplicate_names(self, backend, filename):
+        "Checkpointing objects of the same name should fail."
+        from pyop2.checkpoint import checkpoint
+        dset = op2.Set(3)
+        with pytest.raises(ValueError):
+            checkpoint(filename, [op2.Dat(dset, name='d'), op2.Dat(dset, name='d')])
@@ -224,6 +224,22 @@ class TestIndirectLoop:
         expected = np.arange(1, nedges * 2 + 1, 2)
         assert all(expected == edge_vals.data)
 
+    def test_prepared_loop_rebind_map(self, backend):
+        """A prepared par_loop rebound to arguments accessed through a
+        different map reads through the new map."""
+        s = op2.Set(4, "s")
+        x = op2.Dat(s, np.arange(4, dtype=np.uint32), np.uint32, "x")
+        z = op2.Dat(s, None, np.uint32, "z")
+        ident = op2.Map(s, s, 1, np.arange(4, dtype=np.int32), "ident")
+        rev = op2.Map(s, s, 1, np.arange(3, -1, -1, dtype=np.int32), "rev")
+        kernel_cpy = "void kernel_cpy(unsigned int* z, unsigned int* x) { *z = *x; }"
+        loop = op2.prepare_par_loop(op2.Kernel(kernel_cpy, "kernel_cpy"), s,
+                                    z(op2.WRITE), x(op2.READ, ident[0]))
+        loop()
+        assert all(z.data == [0, 1, 2, 3])
+        loop(z(op2.WRITE), x(op2.READ, rev[0]))
+        assert all(z.data == [3, 2, 1, 0])
+
 
 @pytest.fixture
 def mset(indset, unitset):
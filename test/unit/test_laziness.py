@@ -157,6 +157,212 @@ sum(unsigned int* sum, unsigned int* x)
         assert sum(y.data) == nelems
         assert not op2.base._trace.in_queue(pl_copy)
 
+
+class TestLoopFusion:
+
+    @pytest.fixture
+    def iterset(cls):
+        return op2.Set(nelems, name="iterset")
+
+    @pytest.fixture
+    def indset(cls):
+        return op2.Set(nelems, name="indset")
+
+    @pytest.fixture
+    def iter2ind(cls, iterset, indset):
+        return op2.Map(iterset, indset, 1,
+                       numpy.array(range(nelems)[::-1], dtype=numpy.uint32), "iter2ind")
+
+    @pytest.fixture(autouse=True)
+    def loop_fusion(cls, request):
+        op2.configuration['loop_fusion'] = True
+
+        def reset():
+            op2.configuration['loop_fusion'] = False
+        request.addfinalizer(reset)
+
+    def _fused_length(self):
+        return len(op2.base._trace._fuse(op2.base._trace._trace))
+
+    def test_fuse_direct(self, backend, skip_greedy, iterset):
+        op2.base._trace.clear()
+        x = op2.Dat(iterset, numpy.zeros(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, numpy.zeros(nelems), numpy.float64, "y")
+        k1 = op2.Kernel("void k(double *x) { *x = 1.0; }", "k")
+        k2 = op2.Kernel("void k(double *y, double *x) { *y = 2.0 * (*x); }", "k")
+        op2.par_loop(k1, iterset, x(op2.WRITE))
+        op2.par_loop(k2, iterset, y(op2.WRITE), x(op2.READ))
+        assert self._fused_length() == 1
+        assert all(y.data_ro == 2.0)
+        assert all(x.data_ro == 1.0)
+
+    def test_fuse_dat_arithmetic(self, backend, skip_greedy, iterset):
+        op2.base._trace.clear()
+        x = op2.Dat(iterset, numpy.ones(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, numpy.ones(nelems), numpy.float64, "y")
+        x += y
+        x *= 3.0
+        x -= y
+        assert self._fused_length() == 1
+        assert all(x.data_ro == 5.0)
+
+    def test_fuse_indirect_increments(self, backend, skip_greedy, iterset, indset, iter2ind):
+        op2.base._trace.clear()
+        x = op2.Dat(indset, numpy.zeros(nelems), numpy.float64, "x")
+        k = op2.Kernel("void k(double *x) { *x += 1.0; }", "k")
+        op2.par_loop(k, iterset, x(op2.INC, iter2ind[0]))
+        op2.par_loop(k, iterset, x(op2.INC, iter2ind[0]))
+        assert self._fused_length() == 1
+        assert all(x.data_ro == 2.0)
+
+    def test_fuse_kernel_with_helper(self, backend, skip_greedy, iterset):
+        op2.base._trace.clear()
+        x = op2.Dat(iterset, numpy.ones(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, 2 * numpy.ones(nelems), numpy.float64, "y")
+        k = op2.Kernel("""static inline double sq(double a) { return a * a; }
+void k(double *x) { *x = sq(*x); }""", "k")
+        op2.par_loop(k, iterset, x(op2.RW))
+        op2.par_loop(k, iterset, y(op2.RW))
+        assert self._fused_length() == 1
+        op2.base._trace.evaluate_all()
+        assert all(x.data_ro == 1.0)
+        assert all(y.data_ro == 4.0)
+
+    def test_no_fuse_kernels_redefining_helper(self, backend, skip_greedy, iterset):
+        op2.base._trace.clear()
+        x = op2.Dat(iterset, numpy.ones(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, 2 * numpy.ones(nelems), numpy.float64, "y")
+        k1 = op2.Kernel("""static inline double f(double a) { return a * a; }
+void k1(double *x) { *x = f(*x); }""", "k1")
+        k2 = op2.Kernel("""static inline double f(double a) { return a + a; }
+void k2(double *y) { *y = f(*y); }""", "k2")
+        op2.par_loop(k1, iterset, x(op2.RW))
+        op2.par_loop(k2, iterset, y(op2.RW))
+        assert self._fused_length() == 2
+        op2.base._trace.evaluate_all()
+        assert all(x.data_ro == 1.0)
+        assert all(y.data_ro == 4.0)
+
+    def test_no_fuse_indirect_read_after_write(self, backend, skip_greedy, iterset, indset, iter2ind):
+        op2.base._trace.clear()
+        x = op2.Dat(indset, numpy.zeros(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, numpy.zeros(nelems), numpy.float64, "y")
+        k1 = op2.Kernel("void k1(double *x) { *x = 1.0; }", "k1")
+        k2 = op2.Kernel("void k2(double *y, double *x) { *y = *x; }", "k2")
+        op2.par_loop(k1, indset, x(op2.WRITE))
+        op2.par_loop(k2, iterset, y(op2.WRITE), x(op2.READ, iter2ind[0]))
+        assert self._fused_length() == 2
+        assert all(y.data_ro == 1.0)
+
+    def test_no_fuse_indirect_read_after_direct_write(self, backend, skip_greedy, iterset, iter2ind):
+        op2.base._trace.clear()
+        x = op2.Dat(iterset, numpy.zeros(nelems), numpy.float64, "x")
+        y = op2.Dat(iterset, numpy.zeros(nelems), numpy.float64, "y")
+        m = op2.Map(iterset, iterset, 1, iter2ind.values, "iter2iter")
+        k1 = op2.Kernel("void k1(double *x) { *x = 1.0; }", "k1")
+        k2 = op2.Kernel("void k2(double *y, double *x) { *y = *x; }", "k2")
+        op2.par_loop(k1, iterset, x(op2.WRITE))
+        op2.par_loop(k2, iterset, y(op2.WRITE), x(op2.READ, m[0]))
+        assert self._fused_length() == 2
+        assert all(y.data_ro == 1.0)
+
+    def test_no_fuse_global_read_after_reduction(self, backend, skip_greedy, iterset):
+        op2.base._trace.clear()
+        g = op2.Global(1, 0.0, numpy.float64, "g")
+        x = op2.Dat(iterset, numpy.ones(nelems), numpy.float64, "x")
+        k1 = op2.Kernel("void k1(double *g, double *x) { *g += *x; }", "k1")
+        k2 = op2.Kernel("void k2(double *x, double *g) { *x = *g; }", "k2")
+        op2.par_loop(k1, iterset, g(op2.INC), x(op2.READ))
+        op2.par_loop(k2, iterset, x(op2.WRITE), g(op2.READ))
+        assert self._fused_length() == 2
+        assert all(x.data_ro == nelems)
+
+
+class TestLoopTiling:
+
+    @pytest.fixture
+    def edges(cls):
+        return op2.Set(nelems, name="edges")
+
+    @pytest.fixture
+    def nodes(cls):
+        return op2.Set(nelems + 1, name="nodes")
+
+    @pytest.fixture
+    def edge2node(cls, edges, nodes):
+        values = numpy.array([(i, i + 1) for i in range(nelems)], dtype=numpy.uint32)
+        return op2.Map(edges, nodes, 2, values, "edge2node")
+
+    @pytest.fixture(autouse=True)
+    def loop_tiling(cls, request):
+        op2.configuration['loop_tiling'] = True
+        op2.configuration['tile_size'] = 4
+
+        def reset():
+            op2.configuration['loop_tiling'] = False
+            op2.configuration['tile_size'] = 1024
+        request.addfinalizer(reset)
+
+    def _chain(self, edges, nodes, edge2node):
+        n = op2.Dat(nodes, numpy.zeros(nelems + 1), numpy.float64, "n")
+        m = op2.Dat(nodes, numpy.zeros(nelems + 1), numpy.float64, "m")
+        e = op2.Dat(edges, numpy.zeros(nelems), numpy.float64, "e")
+        k1 = op2.Kernel("void k1(double **n) { n[0][0] += 1.0; n[1][0] += 1.0; }", "k1")
+        k2 = op2.Kernel("void k2(double *m, double *n) { *m = 2.0 * (*n); }", "k2")
+        k3 = op2.Kernel("void k3(double *e, double **m) { *e = m[0][0] + m[1][0]; }", "k3")
+        k4 = op2.Kernel("void k4(double *n) { *n = 0.0; }", "k4")
+        op2.par_loop(k1, edges, n(op2.INC, edge2node))
+        op2.par_loop(k2, nodes, m(op2.WRITE), n(op2.READ))
+        op2.par_loop(k3, edges, e(op2.WRITE), m(op2.READ, edge2node))
+        op2.par_loop(k4, nodes, n(op2.WRITE))
+        return n, e
+
+    def test_tile_chain(self, backend, skip_greedy, edges, nodes, edge2node):
+        op2.base._trace.clear()
+        n, e = self._chain(edges, nodes, edge2node)
+        comps = op2.base._trace._tile(op2.base._trace._trace)
+        assert len(comps) == 1
+        assert isinstance(comps[0], op2.base.TiledLoopChain)
+        degree = numpy.array([1] + [2] * (nelems - 1) + [1])
+        assert numpy.allclose(e.data_ro, 2.0 * (degree[:-1] + degree[1:]))
+        assert numpy.allclose(n.data_ro, 0.0)
+
+    def test_schedule(self, backend, skip_greedy, edges, nodes, edge2node):
+        op2.base._trace.clear()
+        self._chain(edges, nodes, edge2node)
+        tiling = op2.base.Tiling(op2.base._trace._trace, 4)
+        assert tiling.ntiles == (nelems + 3) // 4
+        for loop, schedule in zip(op2.base._trace._trace, tiling.schedule):
+            assert len(schedule) == tiling.ntiles
+            assert sorted(numpy.concatenate(schedule)) == range(loop.it_space.iterset.size)
+        op2.base._trace.clear()
+
+    def test_schedule_cached(self, backend, skip_greedy, edges, nodes, edge2node):
+        op2.base._trace.clear()
+        self._chain(edges, nodes, edge2node)
+        loops = op2.base._trace._trace
+        op2.base._trace.clear()
+        self._chain(edges, nodes, edge2node)
+        assert op2.base.Tiling(loops, 4) is op2.base.Tiling(op2.base._trace._trace, 4)
+        op2.base._trace.clear()
+
+    def test_tile_loops_reused(self, backend, skip_greedy, edges, nodes, edge2node):
+        n = op2.Dat(nodes, numpy.zeros(nelems + 1), numpy.float64, "n")
+        e = op2.Dat(edges, numpy.zeros(nelems), numpy.float64, "e")
+        k1 = op2.Kernel("void k1(double **n) { n[0][0] += 1.0; n[1][0] += 1.0; }", "k1")
+        k2 = op2.Kernel("void k2(double *e, double **n) { *e += n[0][0] + n[1][0]; }", "k2")
+        tile_loops = []
+        for i in range(2):
+            op2.par_loop(k1, edges, n(op2.INC, edge2node))
+            op2.par_loop(k2, edges, e(op2.INC), n(op2.READ, edge2node))
+            tiling = op2.base.Tiling(op2.base._trace._trace, 4)
+            e.data_ro
+            tile_loops.append(tiling._tile_loops[1])
+        assert tile_loops[0] is tile_loops[1]
+        degree = numpy.array([1] + [2] * (nelems - 1) + [1])
+        assert numpy.allclose(n.data_ro, 2 * degree)
+        assert numpy.allclose(e.data_ro, 3 * (degree[:-1] + degree[1:]))
+
 if __name__ == '__main__':
     import os
     pytest.main(os.path.abspath(__file__))
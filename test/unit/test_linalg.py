@@ -31,6 +31,11 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from distutils.spawn import find_executable
+from subprocess import check_call
+import os
+import sys
+
 import pytest
 import numpy as np
 
@@ -39,6 +44,18 @@ from pyop2 import op2
 nelems = 8
 
 
+@pytest.fixture(autouse=True, params=['numpy', 'par_loop'])
+def dat_op(request):
+    """Do the arithmetic with NumPy as well as by generated loops."""
+    size = op2.configuration['dat_op_numpy_size']
+    if request.param == 'par_loop':
+        op2.configuration['dat_op_numpy_size'] = 0
+
+    def restore():
+        op2.configuration['dat_op_numpy_size'] = size
+    request.addfinalizer(restore)
+
+
 @pytest.fixture
 def set():
     return op2.Set(nelems)
@@ -298,3 +315,99 @@ class TestLinAlgScalar:
         s = op2.Set(2)
         n = op2.Dat(s, [3, 4], np.float64, "n")
         assert abs(n.norm - 5) < 1e-12
+
+    def test_norm_mixed(self, backend):
+        n = op2.MixedDat([op2.Dat(op2.Set(1), [3], np.float64),
+                          op2.Dat(op2.Set(1), [4], np.float64)])
+        assert abs(n.norm - 5) < 1e-12
+
+    def test_inner(self, backend, x, y):
+        x._data = 2 * y.data
+        assert x.inner(y).data[0] == 2 * sum(y.data * y.data)
+
+    def test_inner_mixed(self, backend, x, y):
+        x._data = 2 * y.data
+        m = op2.MixedDat([x, y])
+        assert m.inner(m).data[0] == 5 * sum(y.data * y.data)
+
+    @pytest.mark.skipif(not find_executable('mpiexec'), reason='mpiexec not found')
+    def test_inner_norm_mixed_parallel(self, backend):
+        """The inner product and norm of a MixedDat on 2 processes count the
+        values of every component once. The processes are started with the
+        environment of this process before MPI was initialised in it."""
+        check_call(['mpiexec', '-n', '2', sys.executable, '-c', """
+from pyop2 import op2
+import numpy as np
+op2.init(backend='%s')
+m = op2.MixedDat([op2.Dat(op2.Set(4), np.ones(4), np.float64) for _ in range(2)])
+assert m.inner(m).data[0] == 16
+assert abs(m.norm - 4) < 1e-12
+""" % backend], env=os.environ)
+
+    def test_maxabs(self, backend, y):
+        y._data = -y.data
+        assert y.maxabs == nelems
+
+    def test_maxabs_mixed(self, backend, x, y):
+        x._data = -2 * y.data
+        assert op2.MixedDat([x, y]).maxabs == 2 * nelems
+
+
+class TestLinAlgBLAS:
+
+    """
+    Tests of BLAS style operations modifying a Dat in place.
+    """
+
+    def test_axpy(self, backend, x, y):
+        x._data = 2 * y.data
+        x.axpy(3.0, y)
+        assert all(x.data == 5 * y.data)
+
+    def test_axpy_global(self, backend, x, y):
+        x._data = 2 * y.data
+        x.axpy(op2.Global(1, 3.0, np.float64), y)
+        assert all(x.data == 5 * y.data)
+
+    def test_axpy_inner(self, backend, x, y):
+        """The result of inner can scale an axpy without being evaluated."""
+        x._data = np.ones(nelems)
+        x.axpy(x.inner(x), y)
+        assert all(x.data == 1 + nelems * y.data)
+
+    def test_axpy_inner_mixed(self, backend, x, y):
+        """The result of inner on a MixedDat can scale an axpy without being
+        evaluated."""
+        x._data = np.ones(nelems)
+        z = op2.Dat(x.dataset, np.ones(nelems), np.float64)
+        m = op2.MixedDat([x, z])
+        m.axpy(m.inner(m), op2.MixedDat([y, y]))
+        assert all(x.data == 1 + 2 * nelems * y.data)
+        assert all(z.data == 1 + 2 * nelems * y.data)
+
+    def test_aypx(self, backend, x, y):
+        x._data = 2 * y.data
+        x.aypx(3.0, y)
+        assert all(x.data == 7 * y.data)
+
+    def test_waxpy(self, backend, x, y):
+        w = op2.Dat(x.dataset, None, np.float64)
+        x._data = 2 * y.data
+        w.waxpy(3.0, x, y)
+        assert all(w.data == 7 * y.data)
+
+    def test_waxpy_aliased(self, backend, x, y):
+        x._data = 2 * y.data
+        y.waxpy(3.0, x, y)
+        assert all(y.data == 7 * x.data / 2)
+
+    def test_axpy_mixed(self, backend, x, y):
+        x._data = 2 * y.data
+        m = op2.MixedDat([x, op2.Dat(y.dataset, y.data.copy(), np.float64)])
+        m.axpy(2.0, op2.MixedDat([y, y]))
+        assert all(m[0].data == 4 * y.data)
+        assert all(m[1].data == 3 * y.data)
+
+    def test_axpy_shape_mismatch(self, backend, x2, y2):
+        with pytest.raises(ValueError):
+            x2.axpy(1.0, y2)
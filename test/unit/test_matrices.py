@@ -36,7 +36,7 @@ import numpy as np
 from numpy.testing import assert_allclose
 
 from pyop2 import op2
-from pyop2.exceptions import MapValueError, ModeValueError
+from pyop2.exceptions import MapValueError, ModeValueError, MatTypeError
 
 from pyop2.ir.ast_base import *
 
@@ -546,6 +546,38 @@ class TestSparsity:
         assert all(sparsity._colidx == [0, 1, 3, 4, 0, 1, 2, 4, 1, 2,
                                         3, 4, 0, 2, 3, 4, 0, 1, 2, 3, 4])
 
+    def test_build_sparsity_multiple_maps(self, backend):
+        """Building a sparsity from several pairs of maps should give the
+        union of their patterns, without duplicate entries."""
+        elements = op2.Set(2)
+        nodes = op2.Set(3)
+        m1 = op2.Map(elements, nodes, 2, [0, 1, 1, 2])
+        m2 = op2.Map(elements, nodes, 2, [2, 1, 1, 0])
+        sparsity = op2.Sparsity((nodes ** 2, nodes ** 2), [(m1, m1), (m2, m2)])
+        assert all(sparsity._rowptr == [0, 4, 8, 14, 20, 24, 28])
+        assert all(sparsity._colidx == [0, 1, 2, 3, 0, 1, 2, 3,
+                                        0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5,
+                                        2, 3, 4, 5, 2, 3, 4, 5])
+        assert all(sparsity.nnz == [4, 4, 6, 6, 4, 4])
+
+    def test_insertion_offsets(self, backend):
+        """The insertion offsets of the local tensor entries of each element
+        should point at the CSR entries of their rows and columns, and be
+        cached per pair of maps."""
+        elements = op2.Set(4)
+        nodes = op2.Set(5)
+        elem_node = op2.Map(elements, nodes, 3, [0, 4, 3, 0, 1, 4,
+                                                 1, 2, 4, 2, 3, 4])
+        sparsity = op2.Sparsity((nodes, nodes), (elem_node, elem_node))
+        offsets = sparsity._insertion_offsets(elem_node, elem_node)
+        assert offsets.shape == (4, 3, 3)
+        for e, cols in enumerate(elem_node.values):
+            for i, row in enumerate(cols):
+                assert all(offsets[e, i] >= sparsity._rowptr[row])
+                assert all(offsets[e, i] < sparsity._rowptr[row + 1])
+                assert all(sparsity._colidx[offsets[e, i]] == cols)
+        assert sparsity._insertion_offsets(elem_node, elem_node) is offsets
+
     def test_build_mixed_sparsity(self, backend, msparsity):
         """Building a sparsity from a pair of mixed maps should give the
         expected rowptr and colidx for each block."""
@@ -752,6 +784,126 @@ class TestMatrices:
             assert mat.handle[i, i] == v
 
 
+class TestBlockedMatrices:
+    """
+    Matrix tests for vector fields
+    """
+
+    # Only the host backends assemble into block AIJ matrices
+    backends = ['sequential', 'openmp']
+
+    def test_vector_mat_is_blocked(self, backend, elem_node, dvnodes):
+        """A matrix on a vector DataSet should be a block AIJ matrix."""
+        mat = op2.Mat(op2.Sparsity(dvnodes, elem_node), valuetype)
+        assert mat.handle.getType() == 'seqbaij'
+        assert mat.handle.getBlockSize() == NUM_DIMS
+        assert len(mat.sparsity._block_colidx) * NUM_DIMS ** 2 == mat.sparsity.nz
+
+    def test_vector_mat_array_read_only(self, backend, elem_node, dvnodes):
+        """The values of a block AIJ matrix are a read-only copy."""
+        mat = op2.Mat(op2.Sparsity(dvnodes, elem_node), valuetype)
+        assert len(mat.array) == mat.sparsity.nz
+        with pytest.raises(ValueError):
+            mat.array[0] = 1.0
+
+    def test_assemble_flattened_vector_mat(self, backend, elements, elem_node, dvnodes):
+        """Assembling a flattened local tensor, numbered by component first,
+        into a block AIJ matrix should give the expected values."""
+        mat = op2.Mat(op2.Sparsity(dvnodes, elem_node), valuetype)
+        n = 3 * NUM_DIMS
+        kernel = op2.Kernel("""
+void kernel_vec(double A[%(n)d][%(n)d]) {
+  for (int i = 0; i < %(n)d; i++)
+    for (int j = 0; j < %(n)d; j++)
+      A[i][j] += i * %(n)d + j;
+}""" % {'n': n}, "kernel_vec")
+        op2.par_loop(kernel, elements,
+                     mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]]), flatten=True))
+        expected = np.zeros((NUM_NODES * NUM_DIMS, NUM_NODES * NUM_DIMS), dtype=valuetype)
+        for e in elem_node.values:
+            rows = [NUM_DIMS * e[i % 3] + i / 3 for i in range(n)]
+            expected[np.ix_(rows, rows)] += np.arange(n * n).reshape(n, n)
+        assert_allclose(mat.values, expected, 1e-12)
+
+
+class TestMatrixFreeMatrices:
+    """
+    Matrix-free operator tests
+    """
+
+    # Only the PETSc backends apply matrix-free operators
+    backends = ['sequential', 'openmp']
+
+    # Local operator of each element, which is symmetric positive definite
+    code = """
+void %(name)s(%(args)s) {
+  for (int i = 0; i < 3; i++)
+    for (int j = 0; j < 3; j++)
+      %(body)s;
+}"""
+
+    @pytest.fixture
+    def mat(self, elements, elem_node, dnodes):
+        mat = op2.Mat(op2.Sparsity(dnodes, elem_node), valuetype)
+        kernel = op2.Kernel(self.code % {'name': 'assemble',
+                                         'args': 'double A[3][3]',
+                                         'body': 'A[i][j] += (i == j) ? 3.0 : 0.5'},
+                            "assemble")
+        op2.par_loop(kernel, elements,
+                     mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]])))
+        return mat
+
+    @pytest.fixture
+    def action(self, elements, elem_node, dnodes):
+        kernel = op2.Kernel(self.code % {'name': 'action',
+                                         'args': 'double **y, double **x',
+                                         'body': 'y[i][0] += ((i == j) ? 3.0 : 0.5) * x[j][0]'},
+                            "action")
+        return lambda diagonal=None: op2.MatrixFreeMat(
+            (dnodes, dnodes), kernel, elements,
+            lambda x, y: [y(op2.INC, elem_node), x(op2.READ, elem_node)],
+            diagonal=diagonal)
+
+    def test_mult(self, backend, mat, action, x):
+        """Applying a matrix-free operator should give the same result as
+        multiplying with the assembled matrix."""
+        x.data[:] = np.arange(NUM_NODES)
+        assert_allclose((action() * x).data_ro, np.dot(mat.values, x.data_ro), 1e-12)
+
+    def test_solve(self, backend, mat, action, dnodes, x):
+        """Solving with a matrix-free operator should give the same solution
+        as solving with the assembled matrix."""
+        b = op2.Dat(dnodes, np.arange(NUM_NODES, dtype=valuetype), valuetype)
+        op2.solve(action(), x, b)
+        assert_allclose(x.data_ro, np.linalg.solve(mat.values, b.data_ro), 1e-6)
+
+    def test_solve_jacobi(self, backend, mat, action, dnodes, x):
+        """Solving with a matrix-free operator whose diagonal is given should
+        use Jacobi preconditioning."""
+        b = op2.Dat(dnodes, np.arange(NUM_NODES, dtype=valuetype), valuetype)
+        diagonal = op2.Dat(dnodes, np.diag(mat.values).copy(), valuetype)
+        solver = op2.Solver(pc_type='jacobi')
+        solver.solve(action(diagonal), x, b)
+        assert solver.getPC().getType() == 'jacobi'
+        assert_allclose(x.data_ro, np.linalg.solve(mat.values, b.data_ro), 1e-6)
+
+
+class TestMatrixFreeMatricesDevice:
+    """
+    Matrix-free operator tests on the device backends
+    """
+
+    backends = ['cuda', 'opencl']
+
+    def test_unsupported(self, backend, elements, elem_node, dnodes):
+        """Building a matrix-free operator on a device backend should
+        raise a MatTypeError."""
+        kernel = op2.Kernel("void action(double **y, double **x) {}", "action")
+        with pytest.raises(MatTypeError):
+            op2.MatrixFreeMat((dnodes, dnodes), kernel, elements,
+                              lambda x, y: [y(op2.INC, elem_node), x(op2.READ, elem_node)])
+
+
 class TestMixedMatrices:
     """
     Matrix tests for mixed spaces